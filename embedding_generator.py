@@ -6,15 +6,20 @@ import logging
 from sentence_transformers import SentenceTransformer
 import torch
 
+from rag.embedding_cache import EmbeddingCache, model_identity
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class EmbeddingGenerator:
-    def __init__(self, input_file, output_dir, model_name="all-MiniLM-L6-v2"):
+    def __init__(self, input_file, output_dir, model_name="all-MiniLM-L6-v2", cache_path=None, cache_max_bytes=None):
         self.input_file = input_file
         self.output_dir = output_dir
         self.model_name = model_name
         
+        # Optional on-disk cache of previously computed embeddings
+        self.cache = EmbeddingCache(cache_path, cache_max_bytes) if cache_path else None
+        
         # Create output directory if it doesn't exist
         os.makedirs(output_dir, exist_ok=True)
         
@@ -50,8 +55,7 @@ class EmbeddingGenerator:
             texts = [chunk['text'] for chunk in batch]
             
             # Generate embeddings
-            with torch.no_grad():
-                embeddings = self.model.encode(texts)
+            embeddings = self._encode(texts)
             
             # Add embeddings to chunks
             for j, embedding in enumerate(embeddings):
@@ -74,9 +78,30 @@ class EmbeddingGenerator:
         
         logger.info(f"Saved {len(all_embeddings)} embeddings to {embeddings_file}")
         logger.info(f"Saved {len(all_chunks)} chunks to {chunks_file}")
+        if self.cache:
+            logger.info(f"Embedding cache: {self.cache.stats()}")
         
         return all_chunks, all_embeddings
     
+    def _encode(self, texts):
+        """Encode texts, reusing cached embeddings when a cache is configured"""
+        if not self.cache:
+            with torch.no_grad():
+                return self.model.encode(texts)
+        
+        name, revision = model_identity(self.model)
+        cached = self.cache.get_many(name, revision, texts)
+        missing = [i for i in range(len(texts)) if i not in cached]
+        embeddings = np.empty((len(texts), self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        for i, embedding in cached.items():
+            embeddings[i] = embedding
+        if missing:
+            with torch.no_grad():
+                encoded = self.model.encode([texts[i] for i in missing])
+            embeddings[missing] = encoded
+            self.cache.put_many(name, revision, [texts[i] for i in missing], encoded)
+        return embeddings
+    
     def _create_chunks(self, document, chunk_size, overlap):
         """Split document into chunks for embedding"""
         content = document['content']
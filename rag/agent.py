@@ -1,14 +1,26 @@
 import json
-from contextlib import asynccontextmanager
+import time
 from pathlib import Path
-from typing import Any, Dict, Tuple, AsyncGenerator
+from concurrent.futures import Executor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 import asyncio
 import asyncpg
 from sentence_transformers import SentenceTransformer
 
-import helpers
 import forms
+import helpers
+import indexes
 import legislation
+import extract
+import ingest
+import statements
+import shards
+import text_cache
+import vector_storage
+import vectors
+from chunking import DEFAULT_OVERLAP_TOKENS, TokenCounter
+from embedding_cache import EmbeddingCache, model_identity
+from monitor import Progress
 
 class Singleton(type):
     _instances = {}
@@ -18,17 +30,115 @@ class Singleton(type):
         return cls._instances[cls]
 
 class Config:
-    def __init__(self, forms_path: str, legislation_path: str, chunk_size: int = 512):
+    def __init__(
+            self,
+            forms_path: str,
+            legislation_path: str,
+            chunk_size: int = 512,
+            chunk_overlap: int = DEFAULT_OVERLAP_TOKENS,
+            embedding_batch_size: int = 64,
+            embedding_cache_path: Optional[str] = None,
+            embedding_cache_max_bytes: Optional[int] = None,
+            parse_processes: Optional[int] = None,
+            parse_workers: int = 8,
+            encode_workers: Optional[int] = None,
+            write_workers: int = 4,
+            write_batch_documents: int = 32,
+            pipeline_queue_size: int = 16,
+            text_cache_path: Optional[str] = None,
+            progress_interval: float = 10.0,
+            ingest_processes: int = 1,
+            search_profile: Optional[str] = None,
+    ):
         self.forms_path = Path(forms_path)
         self.legislation_path = Path(legislation_path)
+        # Tokens per chunk, capped at the embedding model's limit, and tokens shared by neighbouring chunks.
+        # Recorded in the ingest manifest, changing them re-ingests every file
         self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.embedding_batch_size = embedding_batch_size
+        self.embedding_cache_path = Path(embedding_cache_path) if embedding_cache_path else None
+        self.embedding_cache_max_bytes = embedding_cache_max_bytes
+        self.parse_processes = parse_processes
+        self.parse_workers = parse_workers
+        self.encode_workers = encode_workers
+        self.write_workers = write_workers
+        self.write_batch_documents = write_batch_documents
+        self.pipeline_queue_size = pipeline_queue_size
+        self.text_cache_path = Path(text_cache_path) if text_cache_path else None
+        self.progress_interval = progress_interval
+        # Above one, ingest is sharded over that many processes, each with its own model replica
+        self.ingest_processes = ingest_processes
+        # Default of RAGAgent.query, see vector_storage.SEARCH_PROFILES;
+        # None keeps the server's hnsw.ef_search and vector_storage.DEFAULT_CANDIDATES
+        self.search_profile = search_profile
 
 class DBConfig:
-    def __init__(self, dsn: str = "postgresql://@localhost:5432", database: str = "maia", pool_size: Tuple[int, int] = (1, 10) ):
+    def __init__(
+            self,
+            dsn: str = "postgresql://@localhost:5432",
+            database: str = "maia",
+            pool_size: Tuple[int, int] = (1, 10),
+            prewarm_indexes: bool = True,
+            health_check_interval: float = 30.0,
+            health_check_timeout: float = 5.0,
+            max_inactive_connection_lifetime: float = 300.0,
+            hnsw_m: int = 16,
+            hnsw_ef_construction: int = 64,
+            index_build_memory: Optional[str] = "1GB",
+            index_build_workers: Optional[int] = None,
+            vector_storage: Optional[Dict[str, str]] = None,
+            rerank_factor: int = 4,
+            vector_tuning_path: Optional[str] = None,
+    ):
         self.dsn = dsn
         self.database = database
         self.min_pool_size = pool_size[0]
         self.max_pool_size = pool_size[1]
+        self.prewarm_indexes = prewarm_indexes
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        self.max_inactive_connection_lifetime = max_inactive_connection_lifetime
+        # HNSW build parameters, used when bulk loading rebuilds the vector indexes
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.index_build_memory = index_build_memory
+        self.index_build_workers = index_build_workers
+        # Table -> "vector", "halfvec", "binary" or "ivfflat" index, see vector_storage.STORAGE_MODES;
+        # applied by init_database. vector_storage.IVFFLAT_PROFILE puts the chunk tables on IVFFlat
+        self.vector_storage = vector_storage or {}
+        # Candidates a quantized index returns per result, re-ranked against the full-precision vectors
+        self.rerank_factor = rerank_factor
+        # JSON file of the IVFFlat lists and probes of each table, written by RAGAgent.tune_vector_indexes
+        self.vector_tuning_path = vector_tuning_path
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    """
+    Pool init hook: register the pgvector codecs, then prepare the catalog statements against them.
+    """
+    await vectors.register_vector_codecs(conn)
+    await statements.catalog.init_connection(conn)
+
+
+async def _prewarm_vector_indexes(conn: asyncpg.Connection, storage: Optional[Dict[str, str]]) -> None:
+    """
+    Load the HNSW and IVFFlat indexes vector_storage manages for storage into shared buffers with pg_prewarm.
+    """
+    try:
+        rows = await conn.fetch(
+            '''
+            SELECT c.relname, pg_prewarm(c.oid) AS blocks
+            FROM pg_class c
+            WHERE c.relkind = 'i' AND c.relname = ANY($1::text[])
+            ''',
+            vector_storage.index_names(storage),
+        )
+    except asyncpg.UndefinedFunctionError:
+        print("pg_prewarm is not installed, skipping index prewarm.")
+        return
+    for row in rows:
+        print(f"Prewarmed {row['relname']} ({row['blocks']} blocks)")
 
 
 def _merge_and_sort_results(form_results, legislation_results):
@@ -90,6 +200,15 @@ class RAGAgent(metaclass=Singleton):
         self.rag_config = rag_config
         self.embedding_model = embedding_model
         self.db_init = False
+        self._pool: asyncpg.Pool | None = None
+        self._health_task: asyncio.Task | None = None
+        self.embedding_cache: Optional[EmbeddingCache] = None
+        self.ingest_stats: Dict[str, Dict[str, Any]] = {}
+        self.index_build_seconds: Dict[str, float] = {}
+        self.vector_tuning: Dict[str, Dict[str, Any]] = {}
+        self.ingest_progress: Optional[Progress] = None
+        if rag_config.embedding_cache_path is not None:
+            self.embedding_cache = EmbeddingCache(rag_config.embedding_cache_path, rag_config.embedding_cache_max_bytes)
 
 
     async def init_database(self):
@@ -114,7 +233,21 @@ class RAGAgent(metaclass=Singleton):
                         print(f"Database {database} already exists.")
 
                     print("Setting up database schema...")
-                    await conn.execute(helpers.read_file_to_string("sql/forms-db-init.sql"))
+                    await conn.execute(statements.catalog.text("forms-db-init"))
+                    # Summaries of forms stored before the table existed, ingest keeps them current afterwards
+                    if not await conn.fetchval("SELECT EXISTS (SELECT 1 FROM form_summaries)"):
+                        await forms.refresh_summaries(conn)
+                    # Vector indexes, and the search functions reading them, for the configured storage modes
+                    self.vector_tuning = vector_storage.load_tuning(self.db_config.vector_tuning_path)
+                    await vector_storage.apply(
+                        conn,
+                        self.db_config.vector_storage,
+                        self.db_config.rerank_factor,
+                        {"m": self.db_config.hnsw_m, "ef_construction": self.db_config.hnsw_ef_construction},
+                        self.db_config.index_build_memory,
+                        self.db_config.index_build_workers,
+                        self.vector_tuning,
+                    )
                     self.db_init = True
             except Exception as e:
                 print(f"Error initializing database: {e}")
@@ -123,33 +256,327 @@ class RAGAgent(metaclass=Singleton):
                 await conn.close()
             return
 
-    @asynccontextmanager
-    async def db_pool(self) -> AsyncGenerator[asyncpg.Pool, None]:
+    @property
+    def pool(self) -> asyncpg.Pool:
+        """
+        The shared connection pool owned by the agent.
+        Raises RuntimeError if startup() has not been called.
+        """
+        if self._pool is None:
+            raise RuntimeError("RAGAgent.startup() must be called before using the database")
+        return self._pool
+
+    async def startup(self):
+        """
+        Create the long-lived connection pool, warm it up and start the background health checks.
+        Calling it more than once is a no-op.
+        """
+        if self._pool is not None:
+            return
         server_dsn = self.db_config.dsn
         database = self.db_config.database
+        statements.catalog.load()
+        self.vector_tuning = vector_storage.load_tuning(self.db_config.vector_tuning_path)
         print(f"Connecting to database {database}...")
-        pool = await asyncpg.create_pool(f'{server_dsn}/{database}')
-        try:
-            yield pool
-        finally:
-            await pool.close()
+        self._pool = await asyncpg.create_pool(
+            f'{server_dsn}/{database}',
+            min_size=self.db_config.min_pool_size,
+            max_size=self.db_config.max_pool_size,
+            max_inactive_connection_lifetime=self.db_config.max_inactive_connection_lifetime,
+            connection_class=statements.CatalogConnection,
+            init=_init_connection,
+        )
+        await self.warm_up()
+        if self.db_config.health_check_interval > 0:
+            self._health_task = asyncio.create_task(self._health_check_loop())
+
+    async def shutdown(self):
+        """
+        Stop the health checks and close the connection pool.
+        """
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+            print("Database pool closed.")
+
+    async def __aenter__(self) -> "RAGAgent":
+        await self.startup()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.shutdown()
+
+    def statement_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Execution counts and timings of the prepared search statements.
+        """
+        return statements.catalog.report()
+
+    def _search_settings(self, profile: Optional[str] = None) -> Dict[str, str]:
+        # Quantized indexes also need a larger hnsw.ef_search for the candidates they re-rank,
+        # IVFFlat indexes the tuned ivfflat.probes
+        return vector_storage.search_settings(
+            self.db_config.vector_storage,
+            self.db_config.rerank_factor,
+            profile or self.rag_config.search_profile,
+            tuning=self.vector_tuning,
+        )
+
+    async def explain_search(
+            self, query_text: str, top_k: int = 5, analyze: bool = False, profile: Optional[str] = None
+    ) -> Dict[str, List[str]]:
+        """
+        Query plans of the forms and legislation searches for a query, to check that candidates come from index scans.
+        """
+        embedding = await helpers.generate_embeddings_async(None, self.embedding_model, query_text)
+        plans = {}
+        async with self.pool.acquire() as conn:
+            candidates = vector_storage.search_candidates(profile or self.rag_config.search_profile)
+            for name in ("search-forms", "search-legislation"):
+                async with conn.transaction():
+                    await statements.apply_settings(conn, self._search_settings(profile))
+                    plans[name] = await statements.catalog.explain(
+                        conn, name, embedding, top_k, candidates, analyze=analyze
+                    )
+        return plans
 
+    async def warm_up(self):
+        """
+        Load the vector indexes into shared buffers, so the first queries do not read cold index pages.
+        The pool already opened its min_pool_size connections when it was created.
+        """
+        if not self.db_config.prewarm_indexes:
+            return
+        async with self.pool.acquire() as conn:
+            await _prewarm_vector_indexes(conn, self.db_config.vector_storage)
 
+    async def check_health(self) -> bool:
+        """
+        Ping one pooled connection, holding no more than that connection away from queries.
+        When it does not answer it is terminated and every other connection of the pool is expired,
+        the pool reconnects them on their next use. Connections idle for max_inactive_connection_lifetime
+        are closed by the pool itself.
 
+        Returns:
+            Whether the connection answered.
+        """
+        pool = self.pool
+        async with pool.acquire() as conn:
+            try:
+                await conn.fetchval("SELECT 1", timeout=self.db_config.health_check_timeout)
+                return True
+            except (asyncpg.PostgresConnectionError, asyncpg.InterfaceError, OSError, asyncio.TimeoutError) as e:
+                print(f"Replacing broken database connections: {e}")
+                conn.terminate()
+        await pool.expire_connections()
+        return False
+
+    async def _health_check_loop(self):
+        while True:
+            await asyncio.sleep(self.db_config.health_check_interval)
+            try:
+                await self.check_health()
+            except Exception as e:
+                print(f"Database health check failed: {e}")
 
-    async def populate_database(self):
+    async def populate_database(
+            self,
+            bulk_load: bool = False,
+            on_progress: Optional[Callable[[Progress], None]] = print,
+            shard: Optional[Tuple[int, int]] = None,
+            enqueue: bool = False,
+    ):
         """
         Populate the database with forms and legislation data.
+        Files are committed as they finish, re-running after an interruption picks up where it stopped.
+        :param bulk_load: Drop the HNSW indexes before loading and build them once all rows are in,
+            instead of inserting every row into the graphs as it arrives. Meant for initial loads,
+            searches fall back to exact scans until the indexes are rebuilt.
+        :param on_progress: Called periodically with the live progress, see ingest_status.
+        :param shard: (index, count) to ingest a single shard of the files, used by the shard worker processes.
+        :param enqueue: Only queue the new and changed files as ingest jobs, for run_ingest_worker to process.
         """
+        if enqueue:
+            await self.enqueue_ingest()
+            return
         print("Populating the database...")
-        async with self.db_pool() as pool:
-            # Populate forms
-            await forms.populate_db(self.embedding_model, pool, self.rag_config.forms_path)
-            # Populate legislation
-            await legislation.populate_db(self.embedding_model, pool, self.rag_config.legislation_path)
+        deferred = []
+        if bulk_load:
+            async with self.pool.acquire() as conn:
+                for method in indexes.VECTOR_METHODS:
+                    deferred += await indexes.vector_indexes(conn, method)
+                await indexes.drop(conn, deferred)
+        try:
+            if shard is None and self.rag_config.ingest_processes > 1:
+                await self._ingest_sharded(on_progress)
+            else:
+                await self._ingest(on_progress, shard=shard)
+        finally:
+            # Rebuild even after a failed load, init_database would also recreate them with the defaults
+            if deferred:
+                await self.build_vector_indexes(deferred)
+
+    async def enqueue_ingest(self, max_attempts: int = 3) -> int:
+        """
+        Queue the new and changed files as ingest jobs and delete the rows of vanished files.
+        :return: Number of jobs queued.
+        """
+        return await ingest.enqueue(self.embedding_model, self.pool, self._sources(), max_attempts)
+
+    async def run_ingest_worker(
+            self,
+            on_progress: Optional[Callable[[Progress], None]] = print,
+            stop_when_empty: bool = True,
+            lease_seconds: float = 300.0,
+            worker: Optional[str] = None,
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Process queued ingest jobs, claimed with FOR UPDATE SKIP LOCKED so workers can run on several machines.
+        :param stop_when_empty: Return once no job is queued or running, otherwise keep polling for new jobs.
+        :param lease_seconds: How long a claimed job stays leased without a heartbeat before another worker retries it.
+        """
+        await self._ingest(
+            on_progress,
+            ingest.work,
+            stop_when_empty=stop_when_empty,
+            lease_seconds=lease_seconds,
+            worker=worker,
+        )
+        return self.ingest_stats
+
+    def _sources(self, executor: Optional[Executor] = None, counter: Optional[TokenCounter] = None) -> List[ingest.Source]:
+        return [
+            forms.source(
+                self.rag_config.forms_path, executor, counter, self.rag_config.chunk_size, self.rag_config.chunk_overlap
+            ),
+            legislation.source(
+                self.rag_config.legislation_path, executor, counter, self.rag_config.chunk_size, self.rag_config.chunk_overlap
+            ),
+        ]
+
+    def ingest_status(self) -> Optional[Dict[str, Any]]:
+        """
+        Progress of the running or last ingest: files done, chunks and embeddings per second, time remaining.
+        """
+        return self.ingest_progress.as_dict() if self.ingest_progress is not None else None
+
+    async def _ingest_sharded(self, on_progress: Optional[Callable[[Progress], None]]):
+        shard_count = self.rag_config.ingest_processes
+        print(f"Ingesting in {shard_count} processes...")
+        self.ingest_progress = Progress()
+        try:
+            results, errors = await shards.populate(
+                self.db_config, self.rag_config, model_identity(self.embedding_model), shard_count, self.ingest_progress, on_progress
+            )
+        finally:
+            self.ingest_progress.finished = time.perf_counter()
+        self.ingest_stats = {f"shard-{index}": stats for index, stats in sorted(results.items())}
+        self.ingest_stats["progress"] = self.ingest_progress.as_dict()
+        print(f"Ingest finished: {self.ingest_progress}")
+        if errors:
+            raise RuntimeError(f"{len(errors)} of {shard_count} ingest shards failed: {errors}")
+
+    async def _ingest(
+            self,
+            on_progress: Optional[Callable[[Progress], None]],
+            run: Callable[..., Awaitable[Dict[str, Dict[str, Any]]]] = ingest.populate,
+            **options: Any,
+    ):
+        # Extracted PDF and HTML text is reused across runs when a text cache is configured
+        if self.rag_config.text_cache_path is not None:
+            text_cache.set_default(text_cache.TextCache(self.rag_config.text_cache_path))
+        # Forms and legislation go through one pipeline, documents are parsed in a process pool
+        counter = TokenCounter.for_model(self.embedding_model)
+        self.ingest_progress = Progress()
+        # Encoding runs in its own threads so database writes keep flowing on the event loop
+        encoder = helpers.make_encode_executor(self.rag_config.encode_workers)
+        with extract.make_executor(self.embedding_model, self.rag_config.parse_processes) as executor, encoder:
+            self.ingest_stats = await run(
+                self.embedding_model,
+                self.pool,
+                self._sources(executor, counter),
+                batch_size=self.rag_config.embedding_batch_size,
+                cache=self.embedding_cache,
+                parse_workers=self.rag_config.parse_workers,
+                write_workers=self.rag_config.write_workers,
+                write_documents=self.rag_config.write_batch_documents,
+                queue_size=self.rag_config.pipeline_queue_size,
+                encode_executor=encoder,
+                embed_workers=encoder.workers,
+                progress=self.ingest_progress,
+                on_progress=on_progress,
+                progress_interval=self.rag_config.progress_interval,
+                **options,
+            )
         print("Database population complete.")
+        if self.embedding_cache is not None:
+            print(f"Embedding cache: {self.embedding_cache.stats()}")
+
+    async def build_vector_indexes(self, definitions: List[indexes.IndexDefinition]) -> Dict[str, float]:
+        """
+        Build vector indexes with the memory and parallel workers of the database configuration,
+        HNSW ones with its m and ef_construction. IVFFlat ones get the tuned lists of their table,
+        or lists suggested from the rows it holds now: the lists of a definition captured before a load
+        were picked for the table as it was then, possibly empty.
+        :return: Seconds spent on each index, also kept in index_build_seconds.
+        """
+        hnsw_options = {"m": self.db_config.hnsw_m, "ef_construction": self.db_config.hnsw_ef_construction}
+        async with self.pool.acquire() as conn:
+            batches = [([definition for definition in definitions if definition.method == "hnsw"], hnsw_options)]
+            for definition in definitions:
+                if definition.method == "ivfflat":
+                    # Fresh row estimate for suggested_lists
+                    await conn.execute(f"ANALYZE {definition.table}")
+                    lists = await vector_storage.ivfflat_lists(conn, definition.table, self.vector_tuning)
+                    batches.append(([definition], {"lists": lists}))
+            timings = {}
+            for batch, options in batches:
+                if batch:
+                    timings.update(await indexes.build(
+                        conn,
+                        batch,
+                        options,
+                        maintenance_work_mem=self.db_config.index_build_memory,
+                        parallel_workers=self.db_config.index_build_workers,
+                    ))
+            self.index_build_seconds.update(timings)
+            print(f"Built {len(timings)} vector indexes in {sum(timings.values()):.1f}s")
+            if self.db_config.prewarm_indexes:
+                await _prewarm_vector_indexes(conn, self.db_config.vector_storage)
+        return timings
+
+    async def tune_vector_indexes(
+            self,
+            tables: Optional[Tuple[str, ...]] = None,
+            target_recall: float = 0.95,
+            k: int = 10,
+            queries: int = 50,
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Pick IVFFlat lists and probes for tables, the IVFFlat tables of the storage configuration when None,
+        and write them to db_config.vector_tuning_path. Searches use the new probes right away,
+        the next init_database rebuilds the indexes whose lists changed.
+        Tuning holds a lock on each table while it runs, searches on it wait.
+        """
+        if self.db_config.vector_tuning_path is None:
+            raise ValueError("DBConfig.vector_tuning_path must be set to tune vector indexes")
+        if tables is None:
+            modes = vector_storage.table_modes(self.db_config.vector_storage)
+            tables = tuple(table for table, mode in modes.items() if mode == "ivfflat") or tuple(vector_storage.IVFFLAT_PROFILE)
+        async with self.pool.acquire() as conn:
+            self.vector_tuning = await vector_storage.tune(
+                conn, self.db_config.vector_tuning_path, tables, target_recall, k, queries
+            )
+        return self.vector_tuning
 
-    async def query(self, query_text: str, top_k: int = 5) -> dict:
+    async def query(self, query_text: str, top_k: int = 5, profile: Optional[str] = None) -> dict:
         """
         Query the database using the embedding model to find relevant forms and legislation.
         Combines results from both sources into a unified result set.
@@ -157,35 +584,41 @@ class RAGAgent(metaclass=Singleton):
         Args:
             query_text: The input query string.
             top_k: Number of top results to retrieve per source.
+            profile: "fast", "balanced" or "exhaustive" index search, rag_config.search_profile when None.
+                Applies to the borrowed connection for this query's transaction only.
 
         Returns:
             Dictionary containing combined results from forms and legislation.
         """
-        async with self.db_pool() as pool:
-            # Run both searches in parallel for efficiency
-            form_task = asyncio.create_task(
-                forms.search(self.embedding_model, pool, query_text, top_k)
-            )
+        settings = self._search_settings(profile)
+        candidates = vector_storage.search_candidates(profile or self.rag_config.search_profile)
 
-            legislation_task = asyncio.create_task(
-                legislation.search(self.embedding_model, pool, query_text, top_k)
+        # Run both searches in parallel for efficiency
+        form_task = asyncio.create_task(
+            forms.search(self.embedding_model, self.pool, query_text, top_k, settings=settings, candidates=candidates)
+        )
+
+        legislation_task = asyncio.create_task(
+            legislation.search(
+                self.embedding_model, self.pool, query_text, top_k, settings=settings, candidates=candidates
             )
+        )
 
-            # Wait for both searches to complete
-            form_results, legislation_results = await asyncio.gather(form_task, legislation_task)
+        # Wait for both searches to complete
+        form_results, legislation_results = await asyncio.gather(form_task, legislation_task)
 
-            # Combine the results
-            combined_results = {
-                "query": query_text,
-                "sources": {
-                    "forms": form_results,
-                    "legislation": legislation_results
-                },
-                # Create a unified list of results, sorted by combined_score
-                "combined_results": _merge_and_sort_results(form_results, legislation_results)
-            }
+        # Combine the results
+        combined_results = {
+            "query": query_text,
+            "sources": {
+                "forms": form_results,
+                "legislation": legislation_results
+            },
+            # Create a unified list of results, sorted by combined_score
+            "combined_results": _merge_and_sort_results(form_results, legislation_results)
+        }
 
-            return combined_results
+        return combined_results
 
 
 # Example usage
@@ -202,7 +635,10 @@ async def main():
     rag_config =  Config(
         forms_path = "./uscis-crawler/documents/forms",
         legislation_path = "./uscis-crawler/documents/legislation",
-        chunk_size = 512  # Chunk size for content ingestion
+        chunk_size = 512,  # Chunk size for content ingestion
+        embedding_cache_path = "./.cache/embeddings.sqlite3",
+        embedding_cache_max_bytes = 512 * 1024 * 1024,
+        text_cache_path = "./.cache/text",
     )
 
     # Load the embedding model (SentenceTransformer)
@@ -212,9 +648,10 @@ async def main():
     # Initialize the RAGAgent
     rag_agent = RAGAgent(db_config, rag_config, embedding_model)
 
-    # # Initialize database connection
-    # await rag_agent.init_database()
-    #
+    # Create or upgrade the schema, the searches need its tables, indexes and nearest_* functions
+    await rag_agent.init_database()
+    await rag_agent.startup()
+
     # # Populate the database
     #
     # await rag_agent.populate_database()
@@ -223,6 +660,9 @@ async def main():
     query_string = "what is the replacement fee for Form I-765?"
     results = await rag_agent.query(query_string, top_k=3)
     print("Query Results:", json.dumps(results, indent=4))
+    print("Statement stats:", json.dumps(rag_agent.statement_stats(), indent=4))
+
+    await rag_agent.shutdown()
 
 
 # Run the main function
@@ -0,0 +1,154 @@
+from __future__ import annotations as _annotations
+
+import hashlib
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set
+
+from bs4 import BeautifulSoup, Comment, Doctype, NavigableString, Tag
+
+# Page chrome of uscis.gov, dropped before any text is read
+_CHROME_TAGS = ("header", "footer", "nav", "aside", "script", "style", "noscript", "form", "select", "button", "svg")
+_CHROME_SELECTORS = (
+    "#modal",
+    ".region-content_second",  # "Was this page helpful?" feedback form
+    ".usa-sr-only",  # "Alert Type info" and other screen reader labels
+    ".visually-hidden",
+    ".hide-print",
+    ".breadcrumb",
+    ".reviewed-date",
+)
+
+# Elements whose text forms one block, the unit recognised as boilerplate
+_BLOCK_TAGS = {
+    "p", "li", "h1", "h2", "h3", "h4", "h5", "h6", "td", "th", "dt", "dd",
+    "caption", "figcaption", "blockquote", "pre", "div", "section", "article", "main", "body",
+}
+
+# Repeated blocks shorter than this are headings and labels like "Edition Date", which give chunks context
+DEFAULT_MIN_WORDS = 8
+
+
+def main_content(soup: BeautifulSoup) -> Tag:
+    """
+    The main content element of a uscis.gov page with its chrome removed, or the whole body of other pages.
+    The chrome is removed from soup itself.
+    """
+    root = soup.find("main") or soup.body or soup
+    for tag in root.find_all(_CHROME_TAGS):
+        tag.decompose()
+    for selector in _CHROME_SELECTORS:
+        for tag in root.select(selector):
+            tag.decompose()
+    return root
+
+
+def page_blocks(soup: BeautifulSoup) -> List[str]:
+    """
+    Text blocks of the main content of an HTML page in document order,
+    the strings under the same paragraph, list item, cell or heading make up one block.
+    """
+    blocks: List[str] = []
+    current: Optional[Tag] = None
+    parts: List[str] = []
+    for node in main_content(soup).descendants:
+        if not isinstance(node, NavigableString) or isinstance(node, (Comment, Doctype)):
+            continue
+        text = node.strip()
+        if not text:
+            continue
+        block = next(parent for parent in node.parents if parent.name in _BLOCK_TAGS or parent.parent is None)
+        if block is not current and parts:
+            blocks.append(" ".join(parts))
+            parts = []
+        current = block
+        parts.append(text)
+    if parts:
+        blocks.append(" ".join(parts))
+    return [" ".join(block.split()) for block in blocks]
+
+
+def block_digest(block: str) -> str:
+    return hashlib.sha1(block.lower().encode("utf-8")).hexdigest()
+
+
+def page_digests(blocks: Iterable[str], min_words: int = DEFAULT_MIN_WORDS) -> Set[str]:
+    """
+    Digests of the blocks of a page long enough to count as boilerplate.
+    """
+    return {block_digest(block) for block in blocks if len(block.split()) >= min_words}
+
+
+@dataclass
+class Fingerprint:
+    """
+    How many pages of a corpus each block appears on.
+    A block is boilerplate once it appears on at least min_share of the pages, and on at least min_pages of them.
+    """
+    pages: int = 0
+    counts: Dict[str, int] = field(default_factory=dict)
+    min_share: float = 0.2
+    min_pages: int = 5
+    min_words: int = DEFAULT_MIN_WORDS
+
+    def add(self, digests: Iterable[str]) -> None:
+        self.pages += 1
+        for digest in digests:
+            self.counts[digest] = self.counts.get(digest, 0) + 1
+
+    @property
+    def threshold(self) -> int:
+        return max(self.min_pages, int(self.pages * self.min_share + 0.5))
+
+    def is_boilerplate(self, block: str) -> bool:
+        if len(block.split()) < self.min_words:
+            return False
+        return self.counts.get(block_digest(block), 0) >= self.threshold
+
+    def boilerplate_blocks(self) -> int:
+        threshold = self.threshold
+        return sum(1 for count in self.counts.values() if count >= threshold)
+
+    def pruned(self) -> "Fingerprint":
+        """
+        The same fingerprint holding only the boilerplate blocks, small enough to send to every parse worker.
+        """
+        threshold = self.threshold
+        counts = {digest: count for digest, count in self.counts.items() if count >= threshold}
+        return Fingerprint(self.pages, counts, self.min_share, self.min_pages, self.min_words)
+
+    def digest(self) -> str:
+        """
+        Short digest of what the fingerprint strips, changes whenever a page would be chunked differently.
+        """
+        threshold = self.threshold
+        digests = sorted(digest for digest, count in self.counts.items() if count >= threshold)
+        return hashlib.sha1("\n".join([f"min_words={self.min_words}", *digests]).encode("utf-8")).hexdigest()[:12]
+
+
+def learn(pages: Iterable[Set[str]], min_share: float = 0.2, min_pages: int = 5, min_words: int = DEFAULT_MIN_WORDS) -> Fingerprint:
+    """
+    Build a fingerprint from the block digests of every page of a corpus, see page_digests.
+    """
+    fingerprint = Fingerprint(min_share=min_share, min_pages=min_pages, min_words=min_words)
+    for digests in pages:
+        fingerprint.add(digests)
+    return fingerprint
+
+
+@dataclass
+class Stripped:
+    kept: List[str]
+    removed: List[str]
+
+
+def strip(blocks: Iterable[str], fingerprint: Optional[Fingerprint]) -> Stripped:
+    """
+    Split the blocks of a page into content and the boilerplate the fingerprint recognises.
+    """
+    kept, removed = [], []
+    for block in blocks:
+        if fingerprint is not None and fingerprint.is_boilerplate(block):
+            removed.append(block)
+        else:
+            kept.append(block)
+    return Stripped(kept, removed)
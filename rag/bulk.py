@@ -0,0 +1,48 @@
+from __future__ import annotations as _annotations
+
+from typing import Any, Iterable, List, Sequence, Tuple
+
+import asyncpg
+
+
+async def merge_records(
+        conn: asyncpg.Connection,
+        table: str,
+        columns: Sequence[str],
+        records: Iterable[Tuple[Any, ...]],
+        conflict: str = "DO NOTHING",
+) -> int:
+    """
+    COPY records into a temporary staging table, then merge them into table with
+    INSERT ... SELECT ... ON CONFLICT, which a plain COPY cannot do.
+    Must run inside a transaction, the staging table is dropped on commit.
+    :param conflict: ON CONFLICT clause, e.g. "(content_hash) DO NOTHING".
+    :return: Number of rows actually inserted.
+    """
+    records = list(records)
+    if not records:
+        return 0
+    staging = f"staging_{table}"
+    column_list = ", ".join(columns)
+    await conn.execute(
+        f"CREATE TEMPORARY TABLE IF NOT EXISTS {staging} ON COMMIT DROP AS "
+        f"SELECT {column_list} FROM {table} WITH NO DATA"
+    )
+    await conn.copy_records_to_table(staging, columns=list(columns), records=records)
+    status = await conn.execute(
+        f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging} ON CONFLICT {conflict}"
+    )
+    await conn.execute(f"TRUNCATE {staging}")
+    # Command status looks like "INSERT 0 <rows>"
+    return int(status.split()[-1])
+
+
+def group_records(rows: Iterable[Tuple[str, dict]]) -> List[Tuple[str, List[str], List[Tuple[Any, ...]]]]:
+    """
+    Group (table, values) pairs into one batch of records per table and column set, keeping first-seen order.
+    """
+    groups = {}
+    for table, values in rows:
+        columns = tuple(values)
+        groups.setdefault((table, columns), []).append(tuple(values.values()))
+    return [(table, list(columns), records) for (table, columns), records in groups.items()]
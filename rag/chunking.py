@@ -0,0 +1,131 @@
+from __future__ import annotations as _annotations
+
+import re
+from collections import deque
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Deque, Iterable, Iterator, Optional, Tuple
+
+if TYPE_CHECKING:
+    # Only needed for annotations, keeps this module cheap to import in worker processes
+    from sentence_transformers import SentenceTransformer
+
+DEFAULT_OVERLAP_TOKENS = 32
+
+# Bump when chunk boundaries change, files ingested by an older chunker are re-ingested
+CHUNKER_VERSION = 4
+
+
+def chunker_settings(chunk_size: int, overlap: int) -> str:
+    """
+    Chunking parameters of a source as recorded in the ingest manifest, files chunked with others are re-ingested.
+    """
+    return f"chunk_size={chunk_size},overlap={overlap}"
+
+_WORD = re.compile(r"\S+")
+
+
+class TokenCounter:
+    """
+    Counts how many tokens a word costs for a model's tokenizer.
+
+    Without a tokenizer a word costs its length plus one separating space,
+    which keeps the character-based chunk sizes used before.
+    """
+    def __init__(self, tokenizer=None, max_tokens: Optional[int] = None):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self._count = lru_cache(maxsize=200_000)(self._count_uncached)
+
+    @classmethod
+    def for_model(cls, model: SentenceTransformer) -> "TokenCounter":
+        return _model_counter(model)
+
+    def _count_uncached(self, word: str) -> int:
+        if self.tokenizer is None:
+            return len(word) + 1
+        return len(self.tokenizer.tokenize(word))
+
+    def __call__(self, word: str) -> int:
+        return self._count(word)
+
+    def budget(self, chunk_size: int) -> int:
+        """
+        Chunk budget in tokens, never larger than what the model reads before truncating.
+        """
+        if self.max_tokens is None:
+            return chunk_size
+        return min(chunk_size, self.max_tokens)
+
+
+@lru_cache(maxsize=None)
+def _model_counter(model: SentenceTransformer) -> TokenCounter:
+    tokenizer = getattr(model, "tokenizer", None)
+    max_tokens = getattr(model, "max_seq_length", None)
+    if tokenizer is None or max_tokens is None:
+        return TokenCounter()
+    # Leave room for the [CLS] and [SEP] tokens the model adds
+    return TokenCounter(tokenizer, max_tokens - 2)
+
+
+def iter_words(texts: Iterable[str]) -> Iterator[str]:
+    """
+    Lazily split a stream of text fragments into words.
+    """
+    for text in texts:
+        for match in _WORD.finditer(text):
+            yield match.group()
+
+
+def chunk_words(
+        words: Iterable[str],
+        chunk_size: int = 512,
+        overlap: int = 0,
+        count_tokens: Optional[Callable[[str], int]] = None,
+) -> Iterator[str]:
+    """
+    Group a stream of words into chunks of at most chunk_size tokens.
+
+    Lengths are tracked incrementally, so the whole stream is chunked in linear time,
+    and chunks are yielded as soon as they are full.
+    :param words: Words to chunk, typically from iter_words.
+    :param chunk_size: Token budget of a chunk.
+    :param overlap: Number of tokens from the end of a chunk repeated at the start of the next one.
+    :param count_tokens: Cost of a word, defaults to its character length plus a space.
+    """
+    for text, _, _ in chunk_tagged_words(((word, None) for word in words), chunk_size, overlap, count_tokens):
+        yield text
+
+
+def chunk_tagged_words(
+        words: Iterable[Tuple[str, Any]],
+        chunk_size: int = 512,
+        overlap: int = 0,
+        count_tokens: Optional[Callable[[str], int]] = None,
+) -> Iterator[Tuple[str, Any, Any]]:
+    """
+    Same as chunk_words, for words that carry a tag such as their page number.
+    :return: Iterator of (chunk text, tag of the first word, tag of the last word).
+    """
+    if count_tokens is None:
+        count_tokens = TokenCounter()
+    if overlap >= chunk_size:
+        raise ValueError("overlap must be smaller than chunk_size")
+
+    window: Deque[Tuple[str, int, Any]] = deque()
+    window_tokens = 0
+    fresh = False  # whether the window holds words not emitted yet
+
+    for word, tag in words:
+        tokens = count_tokens(word)
+        if window and window_tokens + tokens > chunk_size:
+            yield " ".join(w for w, _, _ in window), window[0][2], window[-1][2]
+            fresh = False
+            # Keep the tail of the chunk as overlap for the next one
+            while window and (window_tokens > overlap or window_tokens + tokens > chunk_size):
+                window_tokens -= window.popleft()[1]
+        window.append((word, tokens, tag))
+        window_tokens += tokens
+        fresh = True
+
+    if window and fresh:
+        yield " ".join(w for w, _, _ in window), window[0][2], window[-1][2]
@@ -0,0 +1,217 @@
+from __future__ import annotations as _annotations
+
+import argparse
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = Path(__file__).parent / ".cache" / "embeddings.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings
+(
+    model     TEXT    NOT NULL,
+    revision  TEXT    NOT NULL,
+    text_hash BLOB    NOT NULL,
+    vector    BLOB    NOT NULL,
+    last_used REAL    NOT NULL,
+    PRIMARY KEY (model, revision, text_hash)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used);
+"""
+
+
+def normalize_text(text: str) -> str:
+    """
+    Collapse whitespace, the tokenizer ignores it so it must not change the cache key.
+    """
+    return " ".join(text.split())
+
+
+def text_hash(text: str) -> bytes:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).digest()
+
+
+def model_identity(model) -> Tuple[str, str]:
+    """
+    Name and revision of a SentenceTransformer, used to key its cached embeddings.
+    """
+    try:
+        config = model[0].auto_model.config
+        name = getattr(config, "_name_or_path", "") or type(model).__name__
+        revision = getattr(config, "_commit_hash", None) or ""
+    except (AttributeError, IndexError, KeyError, TypeError):
+        name, revision = type(model).__name__, ""
+    return name, revision
+
+
+class EmbeddingCache:
+    """
+    On-disk embedding cache backed by a local SQLite file.
+
+    Embeddings are stored as float32 blobs keyed by (model name, model revision, hash of the normalized text).
+    When max_bytes is set, the least recently used embeddings are evicted once writes take the cache past it.
+    """
+    def __init__(self, path: str | Path = DEFAULT_CACHE_PATH, max_bytes: Optional[int] = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Bytes stored at the last exact count plus the bytes written since, an upper bound as writes
+        # may replace stored embeddings. None until the first write counts them
+        self._bytes: Optional[int] = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def get_many(self, model: str, revision: str, texts: Sequence[str]) -> Dict[int, np.ndarray]:
+        """
+        Look up cached embeddings.
+        :return: Mapping from the index of each cached text to its embedding.
+        """
+        hashes = [text_hash(text) for text in texts]
+        found: Dict[bytes, np.ndarray] = {}
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings "
+                    f"WHERE model = ? AND revision = ? AND text_hash IN ({placeholders})",
+                    (model, revision, *batch),
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND revision = ? AND text_hash = ?",
+                    [(now, model, revision, key) for key in found],
+                )
+                self._conn.commit()
+
+        result = {i: found[key] for i, key in enumerate(hashes) if key in found}
+        self.hits += len(result)
+        self.misses += len(texts) - len(result)
+        return result
+
+    def put_many(self, model: str, revision: str, texts: Sequence[str], vectors: np.ndarray) -> None:
+        """
+        Store embeddings, one row of vectors per text.
+        """
+        now = time.time()
+        rows = [
+            (model, revision, text_hash(text), np.ascontiguousarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, revision, text_hash, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+        if self.max_bytes is None:
+            return
+        if self._bytes is None:
+            self._bytes = self.size_bytes()
+        else:
+            self._bytes += sum(len(row[3]) for row in rows)
+        # Only count exactly, and evict, once the running total passes the limit
+        if self._bytes > self.max_bytes:
+            self.prune(self.max_bytes)
+
+    def size_bytes(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(length(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def prune(self, max_bytes: int) -> int:
+        """
+        Evict the least recently used embeddings until the stored vectors fit in max_bytes.
+        :return: Number of evicted embeddings.
+        """
+        with self._lock:
+            total = self._conn.execute("SELECT COALESCE(SUM(length(vector)), 0) FROM embeddings").fetchone()[0]
+            self._bytes = total
+            if total <= max_bytes:
+                return 0
+            excess = total - max_bytes
+            evicted = 0
+            freed = 0
+            cursor = self._conn.execute(
+                "SELECT model, revision, text_hash, length(vector) FROM embeddings ORDER BY last_used"
+            )
+            keys: List[Tuple[str, str, bytes]] = []
+            for model, revision, key, size in cursor:
+                if freed >= excess:
+                    break
+                keys.append((model, revision, key))
+                freed += size
+                evicted += 1
+            self._conn.executemany(
+                "DELETE FROM embeddings WHERE model = ? AND revision = ? AND text_hash = ?", keys
+            )
+            self._conn.commit()
+            self._bytes = total - freed
+        return evicted
+
+    def clear(self, model: Optional[str] = None) -> int:
+        with self._lock:
+            if model is None:
+                deleted = self._conn.execute("DELETE FROM embeddings").rowcount
+            else:
+                deleted = self._conn.execute("DELETE FROM embeddings WHERE model = ?", (model,)).rowcount
+            self._conn.commit()
+            self._bytes = None
+        return deleted
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "entries": count,
+            "bytes": self.size_bytes(),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and prune the on-disk embedding cache.")
+    parser.add_argument("--path", default=str(DEFAULT_CACHE_PATH), help="Cache file location")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="Show the number of cached embeddings and their size")
+    prune_parser = commands.add_parser("prune", help="Evict least recently used embeddings")
+    prune_parser.add_argument("--max-mb", type=float, required=True, help="Size to shrink the cache to")
+    clear_parser = commands.add_parser("clear", help="Delete cached embeddings")
+    clear_parser.add_argument("--model", default=None, help="Only delete embeddings of this model")
+    args = parser.parse_args()
+
+    cache = EmbeddingCache(args.path)
+    try:
+        if args.command == "prune":
+            evicted = cache.prune(int(args.max_mb * 1024 * 1024))
+            print(f"Evicted {evicted} embeddings.")
+        elif args.command == "clear":
+            print(f"Deleted {cache.clear(args.model)} embeddings.")
+        stats = cache.stats()
+        print(f"{stats['entries']} embeddings, {stats['bytes'] / (1024 * 1024):.2f} MB in {cache.path}")
+    finally:
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+from __future__ import annotations as _annotations
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, List, Optional, Set, Tuple
+
+from PyPDF2 import PdfReader
+from bs4 import BeautifulSoup
+
+import boilerplate
+import chunking
+import text_cache
+import usc
+from chunking import TokenCounter
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+
+@dataclass
+class PdfChunk:
+    content: str
+    page_start: int
+    page_end: int
+
+
+def iter_pdf_pages(pdf_path: str | Path, password: str = "") -> Iterator[Tuple[int, str]]:
+    """
+    Yield (page number, text) for each page of a PDF, starting at page 1.
+    Pages are read through the default text cache when one is configured.
+    Nothing is yielded for an encrypted PDF that cannot be decrypted.
+    """
+    cache = text_cache.get_default()
+    if cache is None:
+        pages = _extract_pages(pdf_path, password)
+    else:
+        pages = cache.read_through(text_cache.file_digest(pdf_path), "pdf", lambda: _extract_pages(pdf_path, password))
+    yield from enumerate(pages, start=1)
+
+
+def _extract_pages(pdf_path: str | Path, password: str = "") -> Iterator[str]:
+    reader = PdfReader(pdf_path)
+    # Check if the PDF is encrypted
+    if reader.is_encrypted:
+        # Decrypt the PDF using the password
+        try:
+            reader.decrypt(password)  # PyCryptodome is required for AES decryption
+        except Exception as e:
+            print(f"Failed to decrypt PDF {pdf_path}: {e}")
+            return
+
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+
+def chunk_pdf(
+        pdf_path: str | Path,
+        chunk_size: int = 512,
+        overlap: int = 0,
+        counter: Optional[TokenCounter] = None,
+        password: str = "",
+) -> List[PdfChunk]:
+    """
+    Chunk a PDF page by page, each chunk records the pages it spans.
+    """
+    if counter is None:
+        counter = TokenCounter()
+    words = (
+        (word, number)
+        for number, text in iter_pdf_pages(pdf_path, password)
+        for word in chunking.iter_words((text,))
+    )
+    return [
+        PdfChunk(content, page_start, page_end)
+        for content, page_start, page_end in chunking.chunk_tagged_words(
+            words, counter.budget(chunk_size), overlap, counter
+        )
+    ]
+
+
+@dataclass
+class HtmlChunks:
+    """
+    Chunks of the main content of an HTML page, and what stripping its boilerplate saved
+    against chunking the text of the whole page.
+    """
+    chunks: List[str]
+    chunks_removed: int
+    bytes_removed: int
+
+
+def read_html_page(content: str, features: str) -> Tuple[List[str], List[str]]:
+    """
+    The text nodes of a whole HTML document and the blocks of its main content, see boilerplate.page_blocks.
+    Both come from a single parse, through the default text cache when one is configured.
+    """
+    cache = text_cache.get_default()
+    digest = text_cache.content_digest(content)
+    blocks_kind = f"{features}-blocks"
+    if cache is not None:
+        text, blocks = cache.load(digest, features), cache.load(digest, blocks_kind)
+        if text is not None and blocks is not None:
+            cache.hits += 1
+            return text, blocks
+        cache.misses += 1
+
+    soup = BeautifulSoup(content, features)
+    # Read the whole text before main_content strips the chrome from the tree
+    text = [text_cache.normalize_page(string) for string in soup.stripped_strings]
+    blocks = boilerplate.page_blocks(soup)
+    if cache is not None:
+        cache.store(digest, features, text)
+        cache.store(digest, blocks_kind, blocks)
+    return text, blocks
+
+
+def html_page_digests(html_path: str | Path, features: str) -> Set[str]:
+    with open(html_path, "r") as f:
+        content = f.read()
+    _, blocks = read_html_page(content, features)
+    return boilerplate.page_digests(blocks)
+
+
+def chunk_html_page(
+        html_path: str | Path,
+        features: str,
+        chunk_size: int = 512,
+        overlap: int = 0,
+        counter: Optional[TokenCounter] = None,
+        fingerprint: Optional[boilerplate.Fingerprint] = None,
+) -> HtmlChunks:
+    """
+    Chunk the main content of an HTML page, without the page chrome or the blocks fingerprint knows as boilerplate.
+    """
+    if counter is None:
+        counter = TokenCounter()
+    with open(html_path, "r") as f:
+        content = f.read()
+    text, blocks = read_html_page(content, features)
+    kept = boilerplate.strip(blocks, fingerprint).kept
+
+    def chunk(strings: Iterable[str]) -> Iterator[str]:
+        return chunking.chunk_words(
+            chunking.iter_words(strings), chunk_size=counter.budget(chunk_size), overlap=overlap, count_tokens=counter
+        )
+
+    chunks = list(chunk(kept))
+    page_chunks = sum(1 for _ in chunk(text))
+    return HtmlChunks(
+        chunks,
+        max(0, page_chunks - len(chunks)),
+        max(0, len(" ".join(text).encode("utf-8")) - len(" ".join(kept).encode("utf-8"))),
+    )
+
+
+# Token counter of the current worker process, set by _init_worker
+_worker_counter: Optional[TokenCounter] = None
+
+
+def _init_worker(tokenizer, max_tokens: Optional[int], text_cache_root: Optional[str]) -> None:
+    global _worker_counter
+    _worker_counter = TokenCounter(tokenizer, max_tokens)
+    if text_cache_root is not None:
+        text_cache.set_default(text_cache.TextCache(text_cache_root))
+
+
+def _counting_cache_use(function: Callable[..., Any], *args: Any) -> Tuple[Any, Tuple[int, int]]:
+    """
+    Result of function and the hits and misses of the worker's text cache while it ran,
+    the parent adds them to its own cache, see _run_in_worker.
+    """
+    cache = text_cache.get_default()
+    if cache is None:
+        return function(*args), (0, 0)
+    hits, misses = cache.hits, cache.misses
+    result = function(*args)
+    return result, (cache.hits - hits, cache.misses - misses)
+
+
+def _chunk_pdf_in_worker(pdf_path: str, chunk_size: int, overlap: int) -> Tuple[List[PdfChunk], Tuple[int, int]]:
+    return _counting_cache_use(chunk_pdf, pdf_path, chunk_size, overlap, _worker_counter)
+
+
+def _chunk_html_page_in_worker(
+        html_path: str, features: str, chunk_size: int, overlap: int, fingerprint: Optional[boilerplate.Fingerprint]
+) -> Tuple[HtmlChunks, Tuple[int, int]]:
+    return _counting_cache_use(chunk_html_page, html_path, features, chunk_size, overlap, _worker_counter, fingerprint)
+
+
+def _chunk_usc_in_worker(path: str, chunk_size: int, overlap: int) -> Tuple[List[usc.UscChunk], Tuple[int, int]]:
+    return _counting_cache_use(usc.chunk_usc, path, chunk_size, overlap, _worker_counter)
+
+
+def _html_page_digests_in_worker(html_path: str, features: str) -> Tuple[Set[str], Tuple[int, int]]:
+    return _counting_cache_use(html_page_digests, html_path, features)
+
+
+async def _run_in_worker(executor: ProcessPoolExecutor, function: Callable[..., Any], *args: Any) -> Any:
+    """
+    Run one of the *_in_worker functions on a process pool and add the text cache hits and misses
+    of the worker to the default cache of this process, where ingest reports them.
+    """
+    result, (hits, misses) = await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+    cache = text_cache.get_default()
+    if cache is not None:
+        cache.hits += hits
+        cache.misses += misses
+    return result
+
+
+def make_executor(model: SentenceTransformer, max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """
+    Process pool for document parsing, each worker gets its own copy of the model's tokenizer
+    and shares the default text cache of the parent process.
+    """
+    counter = TokenCounter.for_model(model)
+    cache = text_cache.get_default()
+    return ProcessPoolExecutor(
+        max_workers=max_workers or os.cpu_count(),
+        # Spawn rather than fork, forking a process that has torch loaded is unsafe
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(counter.tokenizer, counter.max_tokens, str(cache.root) if cache else None),
+    )
+
+
+async def extract_chunks(
+        executor: Optional[Executor],
+        pdf_path: str | Path,
+        chunk_size: int = 512,
+        overlap: int = 0,
+        counter: Optional[TokenCounter] = None,
+) -> List[PdfChunk]:
+    """
+    Parse and chunk a PDF on the executor so the event loop keeps running.
+    Process pool workers use the tokenizer they were initialised with, other executors use counter.
+    """
+    loop = asyncio.get_running_loop()
+    if isinstance(executor, ProcessPoolExecutor):
+        return await _run_in_worker(executor, _chunk_pdf_in_worker, str(pdf_path), chunk_size, overlap)
+    return await loop.run_in_executor(executor, chunk_pdf, str(pdf_path), chunk_size, overlap, counter)
+
+
+async def extract_html_page_chunks(
+        executor: Optional[Executor],
+        html_path: str | Path,
+        features: str,
+        chunk_size: int = 512,
+        overlap: int = 0,
+        counter: Optional[TokenCounter] = None,
+        fingerprint: Optional[boilerplate.Fingerprint] = None,
+) -> HtmlChunks:
+    """
+    Read and chunk the main content of an HTML page on the executor, see chunk_html_page.
+    """
+    loop = asyncio.get_running_loop()
+    if isinstance(executor, ProcessPoolExecutor):
+        return await _run_in_worker(
+            executor, _chunk_html_page_in_worker, str(html_path), features, chunk_size, overlap, fingerprint
+        )
+    return await loop.run_in_executor(
+        executor, chunk_html_page, str(html_path), features, chunk_size, overlap, counter, fingerprint
+    )
+
+
+async def learn_boilerplate(
+        executor: Optional[Executor],
+        html_paths: List[Path],
+        features: str,
+) -> boilerplate.Fingerprint:
+    """
+    Learn which blocks repeat across a corpus of HTML pages, reading the pages on the executor.
+    """
+    loop = asyncio.get_running_loop()
+    if isinstance(executor, ProcessPoolExecutor):
+        pages = await asyncio.gather(*(
+            _run_in_worker(executor, _html_page_digests_in_worker, str(html_path), features)
+            for html_path in html_paths
+        ))
+    else:
+        pages = await asyncio.gather(*(
+            loop.run_in_executor(executor, html_page_digests, str(html_path), features)
+            for html_path in html_paths
+        ))
+    return boilerplate.learn(pages)
+
+
+async def extract_usc_chunks(
+        executor: Optional[Executor],
+        path: str | Path,
+        chunk_size: int = 512,
+        overlap: int = 0,
+        counter: Optional[TokenCounter] = None,
+) -> List[usc.UscChunk]:
+    """
+    Stream and chunk a U.S. Code section page on the executor, see usc.chunk_usc.
+    """
+    loop = asyncio.get_running_loop()
+    if isinstance(executor, ProcessPoolExecutor):
+        return await _run_in_worker(executor, _chunk_usc_in_worker, str(path), chunk_size, overlap)
+    return await loop.run_in_executor(executor, usc.chunk_usc, str(path), chunk_size, overlap, counter)
@@ -1,16 +1,26 @@
 from __future__ import annotations as _annotations
 
 import asyncio
-import json
+import dataclasses
+import functools
+from concurrent.futures import Executor
 from dataclasses import dataclass
 from pathlib import Path
 from typing import List, Dict, Optional
 
 import asyncpg
-import pydantic_core
 from sentence_transformers import SentenceTransformer
 from pydantic import BaseModel, TypeAdapter
+import extract
 import helpers
+import ingest
+import manifest
+import statements
+import text_cache
+import vector_storage
+from boilerplate import Fingerprint
+from chunking import TokenCounter, DEFAULT_OVERLAP_TOKENS, chunker_settings
+from embedding_cache import EmbeddingCache
 
 @dataclass
 class Deps:
@@ -48,316 +58,301 @@ class FormMetadata(BaseModel):
 
 form_metadata_adapter = TypeAdapter(FormMetadata)
 
-async def populate_db(model: SentenceTransformer, pool: asyncpg.Pool, forms_dir: Path) -> None:
-    """Build the forms database from JSON files."""
-    print("Populating Forms tables...")
-    # If no JSON files exist yet, create a sample file
-    metadata_paths = list(forms_dir.rglob("*.json"))
-
-    print(f"Found {len(metadata_paths)} forms to process.")
-
-    print("Processing form data files...")
-    sem = asyncio.Semaphore(5)  # Limit concurrent processing
-
-    async with asyncio.TaskGroup() as tg:
-        for path in metadata_paths:
-            tg.create_task(process_form_files(sem, model, pool, path))
-    
-    print("Database build complete.")
-
-async def process_form_files(
-    sem: asyncio.Semaphore,
-    model: SentenceTransformer,
-    pool: asyncpg.Pool,
-    metadata_path: Path,
-) -> None:
-    """Process a single form JSON file and insert its data into the database."""
-    async with sem:
-        try:
-            print(f"Processing {metadata_path}...")
-
-            # Load and validate the JSON data
-            with open(metadata_path, 'r') as f:
-                json_data = dict(json.load(f))
+# Tables holding the rows of a form, all keyed by form_id
+FORM_TABLES = ("form_pdfs", "form_pdf_chunks", "form_fees", "form_filings", "form_html_chunks")
 
-            metadata = form_metadata_adapter.validate_python(json_data)
-            await process_form_filings(model, pool, metadata)
-            await process_form_pdfs(model, pool, metadata_path, metadata)
-            await process_form_html(model, pool, metadata_path, metadata)
+HTML_FEATURES = "html.parser"
 
 
-        except Exception as e:
-            print(f"Error processing {metadata_path}: {e}")
+class Boilerplate:
+    """
+    Fingerprint of the blocks repeated across the HTML pages of the forms corpus,
+    learned from every page the first time a form needs it.
+    With a text cache the pruned fingerprint is stored under the digest of the set of pages,
+    so processes and workers only learn it again once a page changes.
+    """
+    def __init__(self, forms_dir: Path, executor: Optional[Executor] = None):
+        self.forms_dir = forms_dir
+        self.executor = executor
+        self._learning: Optional[asyncio.Future] = None
+
+    async def fingerprint(self) -> Fingerprint:
+        # Forms parsed concurrently all wait on the same learning pass
+        if self._learning is None:
+            self._learning = asyncio.ensure_future(self._learn())
+        return await self._learning
+
+    async def settings(self) -> str:
+        """
+        The part of the chunker settings of the forms source the fingerprint decides, see ingest.Source.learned_settings.
+        """
+        fingerprint = await self.fingerprint()
+        return f"boilerplate={fingerprint.digest()}"
+
+    async def _learn(self) -> Fingerprint:
+        html_paths = sorted(self.forms_dir.rglob("*.html"))
+        cache = text_cache.get_default()
+        kind = f"{HTML_FEATURES}-boilerplate"
+        corpus = None
+        if cache is not None:
+            corpus = await asyncio.to_thread(text_cache.corpus_digest, html_paths)
+            stored = cache.load(corpus, kind)
+            if stored is not None:
+                return Fingerprint(**stored)
+
+        fingerprint = await extract.learn_boilerplate(self.executor, html_paths, HTML_FEATURES)
+        print(f"Learned HTML boilerplate from {fingerprint.pages} pages: {fingerprint.boilerplate_blocks()} repeated blocks")
+        fingerprint = fingerprint.pruned()
+        if cache is not None:
+            cache.store(corpus, kind, dataclasses.asdict(fingerprint))
+        return fingerprint
+
+
+def source(
+        forms_dir: Path,
+        executor: Optional[Executor] = None,
+        counter: Optional[TokenCounter] = None,
+        chunk_size: int = 512,
+        overlap: int = DEFAULT_OVERLAP_TOKENS,
+) -> ingest.Source:
+    """The forms corpus as an ingest source, chunked into chunk_size tokens overlapping by overlap."""
+    boilerplate = Boilerplate(forms_dir, executor)
+    return ingest.Source(
+        "forms",
+        forms_dir,
+        functools.partial(parse_form, executor, counter, boilerplate, chunk_size=chunk_size, overlap=overlap),
+        refresh_summaries,
+        chunker_settings(chunk_size, overlap),
+        boilerplate.settings,
+    )
+
+
+async def refresh_summaries(conn: asyncpg.Connection, entries: Optional[List[manifest.Entry]] = None) -> int:
+    """
+    Rebuild the form_summaries rows of the forms of manifest entries, or of every form without entries.
+    :return: Number of summaries written.
+    """
+    form_ids = None
+    if entries is not None:
+        form_ids = [entry.owner["form_pdfs"]["form_id"] for entry in entries if "form_pdfs" in entry.owner]
+    rows = await statements.catalog.fetch(conn, "refresh-form-summaries", form_ids)
+    return len(rows)
 
-async  def process_form_pdfs(
+async def populate_db(
         model: SentenceTransformer,
         pool: asyncpg.Pool,
-        metadata_path: Path,
-        metadata: FormMetadata,
+        forms_dir: Path,
+        batch_size: int = helpers.DEFAULT_BATCH_SIZE,
+        cache: Optional[EmbeddingCache] = None,
+        pdf_executor: Optional[Executor] = None,
 ) -> None:
+    """Build the forms database from JSON files."""
+    print("Populating Forms tables...")
+    await ingest.populate(
+        model,
+        pool,
+        [source(forms_dir, pdf_executor, TokenCounter.for_model(model))],
+        batch_size,
+        cache,
+    )
+    print("Database build complete.")
 
-    print(f"Generating description embedding for: {metadata.id}")
-    description_embedding_json = helpers.generate_embeddings(model, metadata.description)
-    for form in metadata.forms:
-        print(f"Generating title embedding for: {metadata.id} - {form.id}")
-        title_embedding_json = helpers.generate_embeddings(model, form.title)
-        # Check if this pdf already exists
-        exists = await pool.fetchval(
-            'SELECT 1 FROM form_pdfs WHERE form_id = $1 AND file_name = $2',
-            metadata.id, form.id
-        )
-
-        if exists:
-            print(f"Skipping existing entry: {metadata.id} - {form.id}")
-            continue
-
-        async with pool.acquire() as conn:
-           async with conn.transaction():
-                try:
-                    await conn.execute(
-                            '''
-                            INSERT INTO form_pdfs (form_id, file_name, file_url, title, description, metadata, is_instructions, title_embedding, description_embedding)
-                            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-                            ''',
-                                        metadata.id,
-                                        form.id,
-                                        form.link,
-                                        form.title,
-                                        metadata.description,
-                                        form.description,
-                                        "Instructions" in form.title or "instr" in form.id,
-                                        title_embedding_json,
-                                        description_embedding_json,
-                                    )
-
-                    print(f"Inserted: {metadata.id} - {form.id}")
-                    try:
-                        chunks = helpers.read_and_chunk_pdf(f"{metadata_path.parent}/{form.id}")
-                    except Exception as e:
-                        print(f"An error occurred reading PDF, {metadata.id} - {form.id}", e)
-                        raise
-
-                    # Process each chunk in the pdf
-                    for i, chunk in enumerate(chunks):
-                        # Check if this filing already exists
-                        exists = await conn.fetchval(
-                            'SELECT 1 FROM form_pdf_chunks WHERE form_name = $1 AND content_chunk = $2',
-                            form.id, chunk
-                        )
-
-                        if exists:
-                            print(f"Skipping existing entry: {metadata.id} - {form.id} - chunk: {i}")
-                            continue
-
-                        # Generate embedding for the category text
-                        print(f"Generating embedding for: {metadata.id} - {form.id} - chunk: {i}")
-
-                        context = {
-                            "form_id": [metadata.id, form.id],
-                            "form_title": [metadata.title, form.title],
-                            "description": metadata.description,
-
-                        }
-                        embedding_json = helpers.generate_embeddings(model, chunk)
-
-                        # Insert into database
-                        await conn.execute(
-                            '''
-                            INSERT INTO form_pdf_chunks (form_id, form_name, content_chunk, chunk_embedding)
-                            VALUES ($1, $2, $3, $4)
-                            ''',
-                            metadata.id,
-                            form.id,
-                            chunk,
-                            embedding_json,
-                        )
-                        print(f"Inserted: {metadata.id} - {form.id} - chunk: {i}")
-                    print(f"Processed {metadata.id} - {form.id} ({len(chunks)} chunks)")
-                except Exception as e:
-                    print("An error occurred, rolling back the transaction:", e)
-                    raise
-
-
-async def process_form_filings(
-    model: SentenceTransformer,
-    pool: asyncpg.Pool,
-    metadata: FormMetadata,
-) -> None:
+async def parse_form(
+    executor: Optional[Executor],
+    counter: Optional[TokenCounter],
+    boilerplate: Optional[Boilerplate],
+    metadata_path: Path,
+    chunk_size: int = 512,
+    overlap: int = DEFAULT_OVERLAP_TOKENS,
+) -> ingest.Document:
+    """Parse a single form JSON file and the documents next to it into the rows to insert."""
+    print(f"Processing {metadata_path}...")
+
+    # Load and validate the JSON data
+    json_data = await asyncio.to_thread(ingest.load_json, metadata_path)
+    metadata = form_metadata_adapter.validate_python(json_data)
+
+    rows = form_filing_rows(metadata)
+    rows += await form_pdf_rows(executor, counter, metadata_path, metadata, chunk_size, overlap)
+    fingerprint = await boilerplate.fingerprint() if boilerplate is not None else None
+    rows += await form_html_rows(executor, counter, metadata_path, metadata, fingerprint, chunk_size, overlap)
+    owner = {table: {"form_id": metadata.id} for table in FORM_TABLES}
+    return ingest.Document(metadata_path, metadata.id, rows, owner)
+
+async  def form_pdf_rows(
+        executor: Optional[Executor],
+        counter: Optional[TokenCounter],
+        metadata_path: Path,
+        metadata: FormMetadata,
+        chunk_size: int = 512,
+        overlap: int = DEFAULT_OVERLAP_TOKENS,
+) -> List[ingest.Row]:
+    # Parse every PDF of the form at once, the executor spreads them over the cores
+    pdf_chunks = await asyncio.gather(*(
+        extract.extract_chunks(executor, metadata_path.parent / form.id, chunk_size, overlap, counter)
+        for form in metadata.forms
+    ))
+
+    rows = []
+    for form, chunks in zip(metadata.forms, pdf_chunks):
+        rows.append(ingest.Row(
+            "form_pdfs",
+            {
+                "form_id": metadata.id,
+                "file_name": form.id,
+                "file_url": form.link,
+                "title": form.title,
+                "description": metadata.description,
+                "metadata": form.description,
+                "is_instructions": "Instructions" in form.title or "instr" in form.id,
+            },
+            key=("form_id", "file_name"),
+            embed={"title_embedding": form.title, "description_embedding": metadata.description},
+        ))
+        for chunk in chunks:
+            rows.append(ingest.Row(
+                "form_pdf_chunks",
+                {
+                    "form_id": metadata.id,
+                    "form_name": form.id,
+                    "content_chunk": chunk.content,
+                    "page_start": chunk.page_start,
+                    "page_end": chunk.page_end,
+                },
+                key=("form_name", "content_chunk"),
+                embed={"chunk_embedding": chunk.content},
+            ))
+        print(f"Parsed {metadata.id} - {form.id} ({len(chunks)} chunks)")
+    return rows
+
+
+def form_filing_rows(metadata: FormMetadata) -> List[ingest.Row]:
+    rows = []
     # Process each filing in the form
     for fee in metadata.fees.values():
-        # Check if this filing already exists
-        exists = await pool.fetchval(
-            'SELECT 1 FROM form_fees WHERE form_id = $1 AND topic_id = $2',
-            metadata.id, fee.topic_id
+        rows.append(ingest.Row(
+            "form_fees",
+            {"form_id": metadata.id, "topic_id": fee.topic_id, "fee_link": fee.link},
+            key=("form_id", "topic_id"),
+        ))
+        for filing in fee.filings or []:
+            rows.append(ingest.Row(
+                "form_filings",
+                {
+                    "form_id": metadata.id,
+                    "topic_id": fee.topic_id,
+                    "category": filing.category,
+                    "paper_fee": filing.paper_fee,
+                    "online_fee": filing.online_fee,
+                },
+                key=("form_id", "topic_id", "category"),
+                embed={"category_embedding": filing.category},
+            ))
+    return rows
+
+
+async def form_html_rows(
+        executor: Optional[Executor],
+        counter: Optional[TokenCounter],
+        metadata_path: Path,
+        metadata: FormMetadata,
+        fingerprint: Optional[Fingerprint] = None,
+        chunk_size: int = 512,
+        overlap: int = DEFAULT_OVERLAP_TOKENS,
+) -> List[ingest.Row]:
+
+    html_paths = list(metadata_path.parent.glob("*.html"))
+    # Read and chunk the main content of the HTML pages in the executor, without their boilerplate
+    html_chunks = await asyncio.gather(*(
+        extract.extract_html_page_chunks(
+            executor, html_path, HTML_FEATURES, chunk_size, overlap, counter, fingerprint
         )
-
-        if exists:
-            print(f"Skipping existing entry: {metadata.id} - {fee.topic_id}")
-            continue
-        async with pool.acquire() as conn:
-            async with conn.transaction():
-                try:
-                    await conn.execute(
-                        '''
-                          INSERT INTO form_fees (form_id, topic_id, fee_link)
-                          VALUES ($1, $2, $3)
-                          ''',
-                                metadata.id,
-                                fee.topic_id,
-                                fee.link,
-                    )
-                    for filing in fee.filings:
-                        # Check if this filing already exists
-                        exists = await conn.fetchval(
-                            'SELECT 1 FROM form_filings WHERE form_id = $1 AND topic_id = $2 AND category = $3',
-                            metadata.id,
-                            fee.topic_id,
-                            filing.category
-                        )
-
-                        if exists:
-                            print(f"Skipping existing entry: {metadata.id} - {filing.category}")
-                            continue
-
-                        # Generate embedding for the category text
-                        print(f"Generating embedding for: {filing.category}")
-                        context = {
-                            "form_id": metadata.id,
-                            "form_title": metadata.title,
-                            "description": metadata.description,
-                        }
-                        embedding_json = helpers.generate_embeddings(model, filing.category)
-
-                        # Insert into database
-                        await conn.execute(
-                            '''
-                            INSERT INTO form_filings (form_id, topic_id, category, paper_fee, online_fee, category_embedding)
-                            VALUES ($1, $2, $3, $4, $5, $6)
-                            ''',
-                            metadata.id,
-                            fee.topic_id,
-                            filing.category,
-                            filing.paper_fee,
-                            filing.online_fee,
-                            embedding_json,
-                        )
-
-                        print(f"Inserted: {metadata.id} - {filing.category}")
-                    print(
-                        f"Processed {metadata.id} - {metadata.title} ({len(fee.filings)} filings)")
-                except Exception as e:
-                    print("An error occurred, rolling back the transaction:", e)
-                    raise
-
-
-async def process_form_html(
+        for html_path in html_paths
+    ))
+
+    rows = []
+    for html_path, page in zip(html_paths, html_chunks):
+        print(
+            f"Stripped {metadata.id} - {html_path.name}: {page.chunks_removed} chunks, "
+            f"{page.bytes_removed} bytes of boilerplate ({len(page.chunks)} chunks kept)"
+        )
+        for chunk in page.chunks:
+            rows.append(ingest.Row(
+                "form_html_chunks",
+                {"form_id": metadata.id, "file_name": html_path.name, "content_chunk": chunk},
+                key=("form_id", "file_name", "content_chunk"),
+                embed={"chunk_embedding": chunk},
+            ))
+    return rows
+
+async def search(
         model: SentenceTransformer,
         pool: asyncpg.Pool,
-        metadata_path: Path,
-        metadata: FormMetadata) -> None:
-
-    html_paths = metadata_path.parent.glob("*.html")
-    for html_path in html_paths:
-        # Step 1: Read the HTML content
-        html_content = helpers.read_file_to_string(html_path)
-
-        # Step 2: Chunk the HTML content
-        for i, chunk in enumerate(helpers.chunk_html_content(html_content, "html.parser")):
-            async with pool.acquire() as conn:
-                async with conn.transaction():
-                    try:
-                        # Check if this pdf already exists
-                        exists = await conn.fetchval(
-                            'SELECT 1 FROM form_html_chunks WHERE form_id = $1 AND file_name = $2 AND content_chunk = $3',
-                            metadata.id, html_path.name, ""
-                        )
-
-                        if exists:
-                            print(f"Skipping existing entry: {metadata.id} - {html_path.name} - chunk: {i}")
-                            continue
-
-                        # Generate embedding for the category text
-                        print(f"Generating embedding for: {metadata.id} - {html_path.name} - chunk: {i}")
-
-                        context = {
-                            "form_id": metadata.id,
-                            "form_title": metadata.title,
-                            "description": metadata.description,
-                        }
-                        embedding_json = helpers.generate_embeddings(model, chunk)
-
-                        # Insert into database
-                        await conn.execute(
-                            '''
-                            INSERT INTO form_html_chunks (form_id, file_name, content_chunk, chunk_embedding)
-                            VALUES ($1, $2, $3, $4)
-                            ''',
-                            metadata.id,
-                            html_path.name,
-                            chunk,
-                            embedding_json,
-                        )
-                        print(f"Inserted: {metadata.id} - {html_path.name} - chunk: {i}")
-                    except Exception as e:
-                        print("An error occurred, rolling back the transaction:", e)
-                        raise
-
-async def search(model: SentenceTransformer,  pool: asyncpg.Pool, search_query: str, limit: int = 10):
+        search_query: str,
+        limit: int = 10,
+        executor: Optional[Executor] = None,
+        settings: Optional[Dict[str, str]] = None,
+        candidates: int = vector_storage.DEFAULT_CANDIDATES,
+):
     """
     Search for immigration forms based on query similarity.
     Returns form objects with form ID, links, relevant chunks, and appropriate fees.
+    :param settings: Server settings for the search query only, see vector_storage.search_settings.
+    :param candidates: Nearest chunks taken per chunk table, and half as many titles, see vector_storage.search_candidates.
     """
     print(f"Searching for: {search_query}")
 
 
     # Generate embedding for the search query
-    embedding_json = helpers.generate_embeddings(model, search_query)
-
-    async with pool:
-        # Execute the optimized query that fetches forms, chunks, links and fees
-        rows = await pool.fetch(
-            helpers.read_file_to_string("./sql/search-forms.sql"),
-            embedding_json,
-            limit
-        )
-
-        forms_dict = {}
-
-        for row in rows:
-            form_id = row['form_id']
-
-            # Create a new form object if it doesn't exist
-            if form_id not in forms_dict:
-                forms_dict[form_id] = {
-                    'form_id': form_id,
-                    'form_title': row['form_title'],
-                    # 'form_description': row['form_description'],
-                    'form_url': row['form_url'],
-                    'instructions_url': row['instructions_url'],
-                    'fee_category': row['category'],
-                    'paper_fee': row['paper_fee'],
-                    'online_fee': row['online_fee'],
-                    'topic_id': row['topic_id'],
-                    'chunks': [],
-                    'title_similarity': row['title_similarity'],
-                    # 'description_similarity': row['description_similarity'],
-                    'combined_score': row['combined_score'],
-                    # 'match_source': row['match_source']
-                }
-
-            # Add the chunk to the form (if not NULL)
-            if row['content_chunk']:
-                forms_dict[form_id]['chunks'].append({
-                    'content': row['content_chunk'],
-                    'similarity_score': row['content_similarity']
-                })
-
-        # Convert the dictionary to a list of form objects
-        results = list(forms_dict.values())
-
-        # Sort by the form's combined similarity score
-        results.sort(key=lambda x: x['combined_score'])
-
-        print(f"\nFound {len(results)} matching forms")
-
-        return results
\ No newline at end of file
+    embedding = await helpers.generate_embeddings_async(executor, model, search_query)
+
+    # Borrow a connection from the shared pool and execute the optimized query that fetches forms, chunks, links and fees
+    rows = await statements.catalog.fetch_pooled(
+        pool,
+        "search-forms",
+        embedding,
+        limit,
+        candidates,
+        settings=settings,
+    )
+
+    forms_dict = {}
+
+    for row in rows:
+        form_id = row['form_id']
+
+        # Create a new form object if it doesn't exist
+        if form_id not in forms_dict:
+            forms_dict[form_id] = {
+                'form_id': form_id,
+                'form_title': row['form_title'],
+                # 'form_description': row['form_description'],
+                'form_url': row['form_url'],
+                'instructions_url': row['instructions_url'],
+                'fee_category': row['category'],
+                'paper_fee': row['paper_fee'],
+                'online_fee': row['online_fee'],
+                'topic_id': row['topic_id'],
+                'chunks': [],
+                'title_similarity': row['title_similarity'],
+                # 'description_similarity': row['description_similarity'],
+                'combined_score': row['combined_score'],
+                # 'match_source': row['match_source']
+            }
+
+        # Add the chunk to the form (if not NULL)
+        if row['content_chunk']:
+            forms_dict[form_id]['chunks'].append({
+                'content': row['content_chunk'],
+                'similarity_score': row['content_similarity']
+            })
+
+    # Convert the dictionary to a list of form objects
+    results = list(forms_dict.values())
+
+    # Sort by the form's combined similarity score
+    results.sort(key=lambda x: x['combined_score'])
+
+    print(f"\nFound {len(results)} matching forms")
+
+    return results
\ No newline at end of file
@@ -1,12 +1,16 @@
+import asyncio
 import json
-from pathlib import Path
-from typing import Dict, Any
+import os
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, Any, Iterable, Optional
 
-import pydantic_core
-from PyPDF2 import PdfReader
-from bs4 import BeautifulSoup
+import numpy as np
+import torch
 from sentence_transformers import SentenceTransformer
 
+from embedding_cache import EmbeddingCache, model_identity
+from monitor import TimedExecutor
+
 
 def read_file_to_string(file_path):
     try:
@@ -20,61 +24,97 @@ def read_file_to_string(file_path):
         print(f"An error occurred: {e}")
         return None
 
-def read_and_chunk_pdf(pdf_path:str | Path, password: str = "", chunk_size=500):
-    reader = PdfReader(pdf_path)
-    # Check if the PDF is encrypted
-    if reader.is_encrypted:
-        # Decrypt the PDF using the password
-        try:
-            reader.decrypt(password)  # PyCryptodome is required for AES decryption
-            print("PDF decrypted successfully!")
-        except Exception as e:
-            print(f"Failed to decrypt PDF: {e}")
-            return
-
-    full_text = ""
-    for page in reader.pages:
-        full_text += page.extract_text()
-
-    # Chunk the text
-    chunks = [full_text[i:i + chunk_size] for i in range(0, len(full_text), chunk_size)]
-    return chunks
-
-def chunk_html_content(content: str, features: str, chunk_size: int = 512) -> list[str]:
+def generate_embeddings(model: SentenceTransformer, content: str) -> np.ndarray:
+    """
+    Encode a single text into a float32 embedding.
+    The array is passed to asyncpg as is, the registered pgvector codec sends it in binary form.
+    """
+    return np.asarray(model.encode(content), dtype=np.float32)
+
+DEFAULT_BATCH_SIZE = 64
+
+def generate_embeddings_batch(
+        model: SentenceTransformer,
+        contents: Iterable[str],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        cache: Optional[EmbeddingCache] = None,
+) -> np.ndarray:
+    """
+    Encode many texts at once into a contiguous float32 matrix, one row per input text.
+    Identical texts are encoded once, and inputs are sorted by length so each batch pads as little as possible.
+    :param model: The embedding model.
+    :param contents: Texts to encode, in the order the rows are returned.
+    :param batch_size: Number of texts passed to the model per forward pass.
+    :param cache: Optional on-disk cache checked before calling the model.
+    :return: Array of shape (len(contents), embedding dimension).
+    """
+    contents = list(contents)
+    if not contents:
+        return np.empty((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+    # Deduplicate, keeping the row of each distinct text
+    unique_index: Dict[str, int] = {}
+    rows = [unique_index.setdefault(content, len(unique_index)) for content in contents]
+    unique_contents = list(unique_index)
+
+    unique_embeddings = np.empty((len(unique_contents), model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+    # Serve what we can from the cache
+    missing = list(range(len(unique_contents)))
+    if cache is not None:
+        model_name, revision = model_identity(model)
+        cached = cache.get_many(model_name, revision, unique_contents)
+        for i, embedding in cached.items():
+            unique_embeddings[i] = embedding
+        missing = [i for i in missing if i not in cached]
+
+    if missing:
+        # Encode longest first so similar lengths share a batch
+        missing.sort(key=lambda i: len(unique_contents[i]), reverse=True)
+        encoded = model.encode(
+            [unique_contents[i] for i in missing],
+            batch_size=batch_size,
+            convert_to_numpy=True,
+        )
+        unique_embeddings[missing] = encoded
+        if cache is not None:
+            cache.put_many(model_name, revision, [unique_contents[i] for i in missing], encoded)
+
+    return np.ascontiguousarray(unique_embeddings[rows])
+
+
+def make_encode_executor(max_workers: Optional[int] = None) -> TimedExecutor:
+    """
+    Threads that run model.encode off the event loop.
+    Torch releases the GIL and spreads each call over its own intra-op threads,
+    so by default there are only as many workers as the cores can feed at torch's thread count.
+    """
+    if max_workers is None:
+        max_workers = max(1, (os.cpu_count() or 1) // torch.get_num_threads())
+    return TimedExecutor(ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="encode"), max_workers)
+
+
+async def generate_embeddings_async(
+        executor: Optional[Executor],
+        model: SentenceTransformer,
+        content: str,
+) -> np.ndarray:
+    """
+    generate_embeddings on the executor, or on the default one when executor is None.
+    """
+    return await asyncio.get_running_loop().run_in_executor(executor, generate_embeddings, model, content)
+
+
+async def generate_embeddings_batch_async(
+        executor: Optional[Executor],
+        model: SentenceTransformer,
+        contents: Iterable[str],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        cache: Optional[EmbeddingCache] = None,
+) -> np.ndarray:
     """
-    Splits HTML content into smaller chunks.
-    :param features:
-    :param content: The raw HTML content.
-    :param chunk_size: Maximum number of characters per chunk.
-    :return: List of text chunks.
+    generate_embeddings_batch on the executor, so the event loop keeps serving database I/O while the model runs.
     """
-    soup = BeautifulSoup(content, features)
-    text_content = soup.get_text(separator=" ", strip=True)  # Strips tags, keeps readable text
-
-    # Create chunks
-    chunks = []
-    current_chunk = []
-
-    for word in text_content.split():
-        if len(" ".join(current_chunk)) + len(word) < chunk_size:
-            current_chunk.append(word)
-        else:
-            chunks.append(" ".join(current_chunk))
-            current_chunk = [word]
-
-    if current_chunk:
-        chunks.append(" ".join(current_chunk))
-
-    return chunks
-
-def generate_embeddings(model: SentenceTransformer, content: str) -> str:
-    # if context is None:
-    #     context = {}
-    #
-    # context[content] = content
-    # Use sentence-transformers to generate the embedding
-    embedding_vector = model.encode(content)
-
-    # Convert numpy array to list for JSON serialization
-    embedding_list = embedding_vector.tolist()
-    return pydantic_core.to_json(embedding_list).decode()
\ No newline at end of file
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, generate_embeddings_batch, model, list(contents), batch_size, cache
+    )
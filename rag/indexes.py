@@ -0,0 +1,89 @@
+from __future__ import annotations as _annotations
+
+import re
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import asyncpg
+
+# Vector index methods provided by pgvector
+VECTOR_METHODS = ("hnsw", "ivfflat")
+
+_WITH = re.compile(r"\s+WITH\s*\(.*\)\s*$", re.IGNORECASE | re.DOTALL)
+
+
+@dataclass
+class IndexDefinition:
+    name: str
+    table: str
+    method: str
+    definition: str
+
+    def create_statement(self, options: Optional[Dict[str, int]] = None) -> str:
+        """
+        The stored CREATE INDEX statement, with its storage parameters replaced by options when given.
+        """
+        if not options:
+            return self.definition
+        params = ", ".join(f"{key} = {value}" for key, value in options.items())
+        return f"{_WITH.sub('', self.definition)} WITH ({params})"
+
+
+async def vector_indexes(conn: asyncpg.Connection, method: str = "hnsw") -> List[IndexDefinition]:
+    """
+    Definitions of the vector indexes of the current schema using method.
+    """
+    rows = await conn.fetch(
+        """
+        SELECT c.relname AS name, t.relname AS table_name, am.amname AS method, pg_get_indexdef(c.oid) AS definition
+        FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_class t ON t.oid = i.indrelid
+            JOIN pg_am am ON am.oid = c.relam
+            JOIN pg_namespace n ON n.oid = t.relnamespace
+        WHERE am.amname = $1
+          AND n.nspname = current_schema()
+        ORDER BY t.relname, c.relname
+        """,
+        method,
+    )
+    return [IndexDefinition(row["name"], row["table_name"], row["method"], row["definition"]) for row in rows]
+
+
+async def drop(conn: asyncpg.Connection, indexes: List[IndexDefinition]) -> None:
+    for index in indexes:
+        await conn.execute(f"DROP INDEX IF EXISTS {index.name}")
+        print(f"Dropped vector index {index.name}")
+
+
+async def build(
+        conn: asyncpg.Connection,
+        indexes: List[IndexDefinition],
+        options: Optional[Dict[str, int]] = None,
+        maintenance_work_mem: Optional[str] = None,
+        parallel_workers: Optional[int] = None,
+) -> Dict[str, float]:
+    """
+    Build indexes one after another, each can use all of maintenance_work_mem and the parallel workers.
+    A graph that fits in maintenance_work_mem builds much faster, pgvector warns when it does not.
+    :param options: Storage parameters, e.g. {"m": 16, "ef_construction": 64} for HNSW.
+    :param maintenance_work_mem: Memory per build, e.g. "2GB". The server setting when None.
+    :param parallel_workers: max_parallel_maintenance_workers. The server setting when None.
+    :return: Seconds spent building each index, by name.
+    """
+    if maintenance_work_mem is not None:
+        await conn.execute(f"SET maintenance_work_mem = '{maintenance_work_mem}'")
+    if parallel_workers is not None:
+        await conn.execute(f"SET max_parallel_maintenance_workers = {int(parallel_workers)}")
+
+    timings = {}
+    for index in indexes:
+        start = time.perf_counter()
+        # Index builds can take far longer than the default command timeout
+        await conn.execute(index.create_statement(options), timeout=None)
+        timings[index.name] = time.perf_counter() - start
+        print(f"Built vector index {index.name} on {index.table} in {timings[index.name]:.1f}s")
+    await conn.execute("RESET maintenance_work_mem")
+    await conn.execute("RESET max_parallel_maintenance_workers")
+    return timings
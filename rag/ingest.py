@@ -0,0 +1,464 @@
+from __future__ import annotations as _annotations
+
+import asyncio
+import hashlib
+import itertools
+import json
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import asyncpg
+from sentence_transformers import SentenceTransformer
+
+import bulk
+import helpers
+import jobs
+import manifest
+import shards
+import text_cache
+from chunking import CHUNKER_VERSION
+from embedding_cache import EmbeddingCache, model_identity
+from monitor import LoopMonitor, Progress, TimedExecutor
+from pipeline import Pipeline
+
+
+@dataclass
+class Row:
+    """
+    A row to insert, with the columns that still need an embedding.
+    """
+    table: str
+    values: Dict[str, Any]
+    # Columns identifying an already stored row
+    key: Tuple[str, ...]
+    # Embedding column -> text to encode into it
+    embed: Dict[str, str] = field(default_factory=dict)
+
+    def key_values(self) -> Tuple[Any, ...]:
+        return tuple(self.values[column] for column in self.key)
+
+    def content_hash(self) -> str:
+        """
+        SHA-256 of the key columns joined by a unit separator, stored in the table's content_hash column.
+        Must match the backfill expression in forms-db-init.sql.
+        """
+        joined = "\x1f".join(str(value) for value in self.key_values())
+        return hashlib.sha256(joined.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class Document:
+    """
+    Everything parsed from one metadata file, its rows are written in a single transaction.
+    """
+    source: Path
+    label: str
+    rows: List[Row]
+    # Table -> column values selecting every row this file produces, recorded in the manifest
+    owner: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    entry: Optional[manifest.Entry] = None
+    # Delete the rows owner selects in the transaction writing rows, for files without a manifest entry
+    # whose rows may have been stored before the manifest existed
+    replace: bool = False
+
+    def texts(self) -> Iterator[Tuple[Row, str, str]]:
+        for row in self.rows:
+            for column, text in row.embed.items():
+                yield row, column, text
+
+
+@dataclass
+class Source:
+    """
+    A corpus to ingest: where its metadata files are and how to parse one of them.
+    """
+    name: str
+    root: Path
+    parse: Callable[[Path], Awaitable[Optional[Document]]]
+    # Updates what the source derives from the rows of the given files, in the transaction that wrote or deleted them
+    refresh: Optional[Callable[[asyncpg.Connection, List[manifest.Entry]], Awaitable[None]]] = None
+    # Chunk size and overlap parse uses, see chunking.chunker_settings
+    chunker_settings: str = ""
+    # Settings parse learns from the whole corpus, like the HTML boilerplate, added to chunker_settings
+    learned_settings: Optional[Callable[[], Awaitable[str]]] = None
+
+    async def settings(self) -> str:
+        """
+        The chunker settings recorded in the manifest entries of the source.
+        """
+        if self.learned_settings is None:
+            return self.chunker_settings
+        return ",".join(part for part in (self.chunker_settings, await self.learned_settings()) if part)
+
+    def discover(self) -> List[Path]:
+        return sorted(self.root.rglob("*.json"))
+
+    async def forget(self, pool: asyncpg.Pool, entry: manifest.Entry) -> int:
+        """
+        Delete the rows of a file and its manifest entry.
+        :return: Number of rows deleted.
+        """
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                deleted = await manifest.delete_rows(conn, entry)
+                if self.refresh is not None:
+                    await self.refresh(conn, [entry])
+        return deleted
+
+
+def load_json(path: Path) -> Dict[str, Any]:
+    with open(path, 'r') as f:
+        return dict(json.load(f))
+
+
+async def drop_existing(pool: asyncpg.Pool, rows: List[Row], stored: bool = True) -> List[Row]:
+    """
+    Stamp every row with its content hash and remove the rows repeated within rows and, with stored,
+    the rows that are already stored, so they are neither embedded nor written.
+    Runs one lookup against the unique content_hash index per table.
+    """
+    by_table: Dict[str, Dict[str, Row]] = {}
+    for row in rows:
+        digest = row.content_hash()
+        row.values["content_hash"] = digest
+        by_table.setdefault(row.table, {}).setdefault(digest, row)
+
+    if not stored:
+        return [row for candidates in by_table.values() for row in candidates.values()]
+    new_rows = []
+    async with pool.acquire() as conn:
+        for table, candidates in by_table.items():
+            stored = await conn.fetch(
+                f"SELECT content_hash FROM {table} WHERE content_hash = ANY($1::text[])", list(candidates)
+            )
+            for record in stored:
+                candidates.pop(record["content_hash"])
+            new_rows.extend(candidates.values())
+    return new_rows
+
+
+def _interleave(groups: List[List[Any]]) -> Iterator[Any]:
+    """
+    Alternate between the sources, so every corpus makes progress from the start.
+    """
+    for batch in itertools.zip_longest(*groups):
+        for item in batch:
+            if item is not None:
+                yield item
+
+
+def _embedding_model(model: SentenceTransformer) -> str:
+    return "@".join(part for part in model_identity(model) if part)
+
+
+async def _remove(pool: asyncpg.Pool, sources: List[Source], removed: List[manifest.Entry]) -> None:
+    by_name = {source.name: source for source in sources}
+    for entry in removed:
+        deleted = await by_name[entry.source].forget(pool, entry)
+        print(f"Removed: {entry.source}/{entry.path} ({deleted} rows)")
+
+
+async def plan(pool: asyncpg.Pool, sources: List[Source], embedding_model: str) -> manifest.Plan:
+    """
+    Crawl the sources and diff the result against the ingest manifest.
+    """
+    settings = {source.name: await source.settings() for source in sources}
+
+    def crawl() -> List[manifest.Entry]:
+        entries = []
+        for source in sources:
+            paths = source.discover()
+            print(f"Found {len(paths)} {source.name} files.")
+            entries += [
+                manifest.stat(source.name, source.root, path, CHUNKER_VERSION, embedding_model, settings[source.name])
+                for path in paths
+            ]
+        return entries
+
+    entries = await asyncio.to_thread(crawl)
+    previous = await manifest.load(pool)
+    return manifest.diff(entries, previous, [source.name for source in sources])
+
+
+async def populate(
+        model: SentenceTransformer,
+        pool: asyncpg.Pool,
+        sources: List[Source],
+        batch_size: int = helpers.DEFAULT_BATCH_SIZE,
+        cache: Optional[EmbeddingCache] = None,
+        parse_workers: int = 8,
+        write_workers: int = 4,
+        queue_size: int = 16,
+        embed_documents: int = 8,
+        write_documents: int = 32,
+        encode_executor: Optional[Executor] = None,
+        embed_workers: int = 1,
+        progress: Optional[Progress] = None,
+        on_progress: Optional[Callable[[Progress], None]] = print,
+        progress_interval: float = 10.0,
+        shard: Optional[Tuple[int, int]] = None,
+        items: Optional[AsyncIterable[Tuple[manifest.Entry, Optional[manifest.Entry]]]] = None,
+        on_settled: Optional[Callable[[manifest.Entry, Optional[str]], Awaitable[None]]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Ingest the new and changed files of the sources through a parse -> embed -> write pipeline.
+
+    The crawl is diffed against the ingest manifest first: rows of files that disappeared are deleted,
+    files whose size, mtime, content and versions are unchanged are skipped, and the rows of
+    changed files are deleted before they are parsed again. Files new to the manifest replace any rows
+    of theirs stored before the manifest existed, in the transaction writing their new rows.
+    Parsing runs in parse_workers concurrent tasks (the heavy lifting happens in their executor),
+    embed_workers tasks encode the texts of up to embed_documents documents per model call on encode_executor,
+    off the event loop, so writes overlap with encoding,
+    and write_workers tasks write up to write_documents documents at a time to the database,
+    one binary COPY and content_hash merge per table and one transaction per batch,
+    together with the manifest entries of those documents and the sources' refresh of what they derive from them.
+
+    The manifest doubles as the checkpoint: a file is recorded only once its rows are committed,
+    so an interrupted run resumes with the files it did not finish. A batch that fails to write
+    is retried one document at a time, a failing document is reported and left for the next run.
+    :param progress: Counters to update while running, so callers can report live status.
+    :param on_progress: Called with progress every progress_interval seconds and at the end.
+    :param shard: (index, count) to only handle the files that shards.shard_of assigns to index.
+    :param items: (entry, previous entry) pairs to ingest instead of crawling the sources, e.g. from a job queue.
+    :param on_settled: Awaited with each file's entry once it is written or skipped (error None), or failed.
+    :return: Per-stage counters, the manifest diff under "manifest", how busy the event loop was under
+        "event_loop", when encode_executor is a TimedExecutor its utilization under "encode_executor",
+        and the hits and misses of the default text cache during the run under "text_cache".
+    """
+    by_name = {source.name: source for source in sources}
+    if progress is None:
+        progress = Progress()
+    extracted = text_cache.get_default()
+    extracted_before = extracted.stats() if extracted is not None else {}
+    changes = None
+    if items is None:
+        changes = await plan(pool, sources, _embedding_model(model))
+        if shard is not None:
+            index, count = shard
+            changes = changes.shard(lambda entry: shards.shard_of(f"{entry.source}/{entry.path}", count) == index)
+        print(f"Manifest: {changes.summary()}")
+        progress.files_total = len(changes.pending)
+        await _remove(pool, sources, changes.removed)
+
+    async def settle(entry: manifest.Entry, error: Optional[str] = None):
+        if error is not None:
+            progress.files_failed += 1
+        if on_settled is not None:
+            await on_settled(entry, error)
+
+    async def parse(item: Tuple[manifest.Entry, Optional[manifest.Entry]]) -> List[Document]:
+        entry, previous = item
+        source = by_name[entry.source]
+        path = source.root / entry.path
+        try:
+            entry.content_hash = await asyncio.to_thread(manifest.content_hash, path)
+            if previous is not None:
+                if previous.content_hash == entry.content_hash and previous.same_versions(entry):
+                    # Only touched, remember the new mtime so the next crawl skips it
+                    await manifest.touch(pool, entry)
+                    progress.files_unchanged += 1
+                    await settle(entry)
+                    return []
+                deleted = await source.forget(pool, previous)
+                print(f"Re-ingesting changed {entry.source}/{entry.path} ({deleted} rows replaced)")
+            document = await source.parse(path)
+        except Exception as e:
+            await settle(entry, str(e))
+            raise
+        if document is None:
+            await settle(entry, "nothing parsed")
+            return []
+        # A file new to the manifest replaces whatever its owner selects, rows stored by an older ingest included,
+        # so none of its rows can be skipped as already stored
+        document.replace = previous is None
+        document.rows = await drop_existing(pool, document.rows, stored=not document.replace)
+        entry.owner = document.owner
+        document.entry = entry
+        return [document]
+
+    async def embed(documents: List[Document]) -> List[Document]:
+        texts = [(row, column, text) for document in documents for row, column, text in document.texts()]
+        try:
+            embeddings = await helpers.generate_embeddings_batch_async(
+                encode_executor, model, [text for _, _, text in texts], batch_size, cache
+            )
+        except Exception as e:
+            for document in documents:
+                await settle(document.entry, str(e))
+            raise
+        for (row, column, _), embedding in zip(texts, embeddings):
+            row.values[column] = embedding
+        progress.embeddings += len(texts)
+        return documents
+
+    async def write_batch(documents: List[Document]) -> None:
+        rows = [(row.table, row.values) for document in documents for row in document.rows]
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                for document in documents:
+                    if document.replace:
+                        await manifest.delete_owned(conn, document.owner)
+                for table, columns, records in bulk.group_records(rows):
+                    # Another writer may have stored the same rows since drop_existing checked
+                    await bulk.merge_records(conn, table, columns, records, "(content_hash) DO NOTHING")
+                entries = [document.entry for document in documents]
+                await manifest.record(conn, entries)
+                for source in sources:
+                    if source.refresh is not None:
+                        written = [entry for entry in entries if entry.source == source.name]
+                        if written:
+                            await source.refresh(conn, written)
+        progress.files_done += len(documents)
+        progress.chunks += sum(1 for _, values in rows if "content_chunk" in values)
+
+    async def settle_written(document: Document, error: Optional[str] = None) -> None:
+        # Outside the retry path: the rows are committed, or the document is given up on, either way it is not written again
+        try:
+            await settle(document.entry, error)
+        except Exception as e:
+            print(f"Failed to settle {document.label} from {document.source}: {e}")
+
+    async def write(documents: List[Document]) -> List[Document]:
+        try:
+            await write_batch(documents)
+        except Exception as e:
+            print(f"Writing a batch of {len(documents)} documents failed ({e}), writing them one by one")
+        else:
+            for document in documents:
+                await settle_written(document)
+            return documents
+        written = []
+        for document in documents:
+            try:
+                await write_batch([document])
+            except Exception as e:
+                print(f"Failed to write {document.label} from {document.source}: {e}")
+                await settle_written(document, str(e))
+                continue
+            written.append(document)
+            await settle_written(document)
+        return written
+
+    async def report():
+        while True:
+            await asyncio.sleep(progress_interval)
+            on_progress(progress)
+
+    pipeline = (
+        Pipeline("ingest")
+        .stage("parse", parse, workers=parse_workers, queue_size=queue_size)
+        .stage("embed", embed, workers=embed_workers, queue_size=queue_size, batch_size=embed_documents)
+        .stage("write", write, workers=write_workers, queue_size=queue_size, batch_size=write_documents)
+    )
+    if items is None:
+        by_source: Dict[str, List[Any]] = {source.name: [] for source in sources}
+        for entry, previous in changes.pending:
+            by_source[entry.source].append((entry, previous))
+        items = _interleave(list(by_source.values()))
+    reporter = asyncio.create_task(report()) if on_progress is not None else None
+    try:
+        async with LoopMonitor() as loop_monitor:
+            stats = await pipeline.run(items)
+    finally:
+        progress.finished = time.perf_counter()
+        if reporter is not None:
+            reporter.cancel()
+            on_progress(progress)
+    for name, stage in stats.items():
+        print(f"Stage {name}: {stage}")
+    if changes is not None:
+        stats["manifest"] = changes.summary()
+    stats["progress"] = progress.as_dict()
+    stats["event_loop"] = loop_monitor.as_dict()
+    print(f"Event loop: {stats['event_loop']}")
+    if isinstance(encode_executor, TimedExecutor):
+        stats["encode_executor"] = encode_executor.as_dict()
+        print(f"Encode executor: {stats['encode_executor']}")
+    if extracted is not None:
+        # Includes the hits and misses of the parse workers, they report theirs with every result
+        stats["text_cache"] = {name: count - extracted_before[name] for name, count in extracted.stats().items()}
+        print(f"Text cache: {stats['text_cache']}")
+    return stats
+
+
+async def enqueue(
+        model: SentenceTransformer,
+        pool: asyncpg.Pool,
+        sources: List[Source],
+        max_attempts: int = 3,
+) -> int:
+    """
+    Diff the crawl against the manifest like populate, delete the rows of vanished files,
+    and queue the new and changed files as ingest jobs for work to pick up.
+    :return: Number of jobs queued.
+    """
+    changes = await plan(pool, sources, _embedding_model(model))
+    print(f"Manifest: {changes.summary()}")
+    await _remove(pool, sources, changes.removed)
+    queued = await jobs.enqueue(pool, [(entry.source, entry.path) for entry, _ in changes.pending], max_attempts)
+    print(f"Queued {queued} ingest jobs.")
+    return queued
+
+
+async def work(
+        model: SentenceTransformer,
+        pool: asyncpg.Pool,
+        sources: List[Source],
+        worker: Optional[str] = None,
+        claim_batch: int = 8,
+        lease_seconds: float = 300.0,
+        retry_delay: float = 30.0,
+        stop_when_empty: bool = True,
+        **options: Any,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Ingest queued jobs through the populate pipeline until the queue is empty, or forever without stop_when_empty.
+    Any number of workers, on any number of machines, can run against the same queue.
+    A job is completed once its file is written or found unchanged; failures are retried after
+    retry_delay seconds per attempt, jobs of a worker that dies are retried when their lease expires.
+    :param options: Passed on to populate.
+    """
+    worker = worker or jobs.worker_name()
+    by_name = {source.name: source for source in sources}
+    embedding_model = _embedding_model(model)
+    settings = {source.name: await source.settings() for source in sources}
+    claimed: Dict[Tuple[str, str], jobs.Job] = {}
+
+    async def entries():
+        async for job in jobs.stream(pool, worker, claim_batch, lease_seconds, stop_when_empty=stop_when_empty):
+            source = by_name.get(job.source)
+            if source is None:
+                await jobs.fail(pool, job, worker, f"unknown source {job.source}", retry_delay)
+                continue
+            path = source.root / job.path
+            previous = await manifest.get(pool, job.source, job.path)
+            if not path.exists():
+                # Vanished since it was queued
+                if previous is not None:
+                    await source.forget(pool, previous)
+                await jobs.complete(pool, job, worker)
+                continue
+            entry = await asyncio.to_thread(
+                manifest.stat, source.name, source.root, path, CHUNKER_VERSION, embedding_model, settings[source.name]
+            )
+            claimed[entry.identity] = job
+            yield entry, previous
+
+    async def settled(entry: manifest.Entry, error: Optional[str]):
+        job = claimed.pop(entry.identity, None)
+        if job is None:
+            # Already settled
+            return
+        if error is None:
+            await jobs.complete(pool, job, worker)
+        else:
+            await jobs.fail(pool, job, worker, error, retry_delay)
+
+    progress = options.pop("progress", None) or Progress()
+    progress.files_total = (await jobs.counts(pool)).get("queued", 0)
+    print(f"Ingest worker {worker} started, {progress.files_total} jobs queued.")
+    return await populate(model, pool, sources, items=entries(), on_settled=settled, progress=progress, **options)
@@ -0,0 +1,76 @@
+from __future__ import annotations as _annotations
+
+import argparse
+import asyncio
+import json
+
+import asyncpg
+from sentence_transformers import SentenceTransformer
+
+import jobs
+from agent import Config, DBConfig, RAGAgent
+from chunking import DEFAULT_OVERLAP_TOKENS
+
+
+async def status(args: argparse.Namespace) -> None:
+    pool = await asyncpg.create_pool(f"{args.dsn}/{args.database}", min_size=1, max_size=1)
+    try:
+        print(f"Ingest jobs: {json.dumps(await jobs.counts(pool))}")
+    finally:
+        await pool.close()
+
+
+async def run(args: argparse.Namespace) -> None:
+    if args.command == "status":
+        await status(args)
+        return
+    db_config = DBConfig(dsn=args.dsn, database=args.database, pool_size=(1, args.pool_size))
+    rag_config = Config(
+        forms_path=args.forms_path,
+        legislation_path=args.legislation_path,
+        embedding_cache_path=args.embedding_cache,
+        text_cache_path=args.text_cache,
+        parse_processes=args.parse_processes,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+    )
+    print(f"Loading SentenceTransformer model {args.model}...")
+    model = SentenceTransformer(args.model)
+    async with RAGAgent(db_config, rag_config, model) as agent:
+        if args.command == "enqueue":
+            await agent.enqueue_ingest(args.max_attempts)
+        else:
+            await agent.run_ingest_worker(
+                stop_when_empty=not args.forever, lease_seconds=args.lease_seconds, worker=args.worker
+            )
+        print(f"Ingest jobs: {json.dumps(await jobs.counts(agent.pool))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Queue ingest jobs, or process them. Start any number of workers, on any number of machines."
+    )
+    parser.add_argument("--dsn", default="postgresql://@localhost:5432", help="Server to connect to")
+    parser.add_argument("--database", default="maia")
+    parser.add_argument("--pool-size", type=int, default=10, help="Connections of this process")
+    parser.add_argument("--forms-path", default="./uscis-crawler/documents/forms")
+    parser.add_argument("--legislation-path", default="./uscis-crawler/documents/legislation")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2", help="SentenceTransformer to embed with")
+    parser.add_argument("--embedding-cache", default=None, help="Embedding cache file, shared by the workers of a machine")
+    parser.add_argument("--text-cache", default=None, help="Extracted text cache directory")
+    parser.add_argument("--chunk-size", type=int, default=512, help="Tokens per chunk, the same for every worker")
+    parser.add_argument("--chunk-overlap", type=int, default=DEFAULT_OVERLAP_TOKENS, help="Tokens shared by neighbouring chunks")
+    parser.add_argument("--parse-processes", type=int, default=None, help="Parse processes of this worker")
+    commands = parser.add_subparsers(dest="command", required=True)
+    enqueue_parser = commands.add_parser("enqueue", help="Queue the new and changed files and delete vanished ones")
+    enqueue_parser.add_argument("--max-attempts", type=int, default=3)
+    work_parser = commands.add_parser("work", help="Process queued jobs until none is queued or running")
+    work_parser.add_argument("--forever", action="store_true", help="Keep polling for new jobs instead of stopping")
+    work_parser.add_argument("--lease-seconds", type=float, default=300.0, help="Lease of a claimed job without heartbeat")
+    work_parser.add_argument("--worker", default=None, help="Worker name, host:pid when not given")
+    commands.add_parser("status", help="Show the number of jobs per status")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
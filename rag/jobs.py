@@ -0,0 +1,196 @@
+from __future__ import annotations as _annotations
+
+import asyncio
+import os
+import socket
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Tuple
+
+import asyncpg
+
+
+@dataclass
+class Job:
+    id: int
+    source: str
+    path: str
+    attempts: int
+    max_attempts: int
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def enqueue(pool: asyncpg.Pool, items: List[Tuple[str, str]], max_attempts: int = 3) -> int:
+    """
+    Queue (source, path) files for ingest. Files already queued or running are left alone,
+    finished or failed ones are queued again with fresh attempts.
+    :return: Number of jobs queued.
+    """
+    if not items:
+        return 0
+    rows = await pool.fetch(
+        """
+        INSERT INTO ingest_jobs (source, path, max_attempts)
+        SELECT source, path, $3 FROM unnest($1::text[], $2::text[]) AS t (source, path)
+        ON CONFLICT (source, path) DO UPDATE
+            SET status       = 'queued',
+                attempts     = 0,
+                max_attempts = excluded.max_attempts,
+                available_at = now(),
+                last_error   = NULL,
+                enqueued_at  = now()
+            WHERE ingest_jobs.status IN ('done', 'failed')
+        RETURNING id
+        """,
+        [source for source, _ in items],
+        [path for _, path in items],
+        max_attempts,
+    )
+    return len(rows)
+
+
+async def claim(pool: asyncpg.Pool, worker: str, limit: int, lease_seconds: float) -> List[Job]:
+    """
+    Lease up to limit queued jobs, or running jobs whose lease expired, to worker.
+    SKIP LOCKED lets any number of workers claim concurrently without waiting on each other.
+    """
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            # Jobs whose worker vanished on their last attempt
+            await conn.execute(
+                """
+                UPDATE ingest_jobs
+                SET status = 'failed', last_error = coalesce(last_error, 'lease expired'), finished_at = now()
+                WHERE status = 'running' AND lease_expires < now() AND attempts >= max_attempts
+                """
+            )
+            rows = await conn.fetch(
+                """
+                UPDATE ingest_jobs
+                SET status        = 'running',
+                    attempts      = attempts + 1,
+                    leased_by     = $1,
+                    lease_expires = now() + make_interval(secs => $3::float8),
+                    started_at    = now()
+                WHERE id IN (SELECT id
+                             FROM ingest_jobs
+                             WHERE (status = 'queued' AND available_at <= now())
+                                OR (status = 'running' AND lease_expires < now())
+                             ORDER BY id
+                             LIMIT $2 FOR UPDATE SKIP LOCKED)
+                RETURNING id, source, path, attempts, max_attempts
+                """,
+                worker,
+                limit,
+                lease_seconds,
+            )
+    return [Job(row["id"], row["source"], row["path"], row["attempts"], row["max_attempts"]) for row in rows]
+
+
+async def heartbeat(pool: asyncpg.Pool, worker: str, lease_seconds: float) -> int:
+    """
+    Extend the leases of every job worker is running.
+    :return: Number of leases extended.
+    """
+    status = await pool.execute(
+        """
+        UPDATE ingest_jobs
+        SET lease_expires = now() + make_interval(secs => $2::float8)
+        WHERE status = 'running' AND leased_by = $1
+        """,
+        worker,
+        lease_seconds,
+    )
+    return int(status.split()[-1])
+
+
+async def complete(pool: asyncpg.Pool, job: Job, worker: str) -> bool:
+    """
+    Mark a job worker is running as done.
+    :return: False when worker no longer holds the lease, another worker re-claimed the job after it expired.
+    """
+    status = await pool.execute(
+        """
+        UPDATE ingest_jobs
+        SET status = 'done', finished_at = now(), last_error = NULL
+        WHERE id = $1 AND status = 'running' AND leased_by = $2
+        """,
+        job.id,
+        worker,
+    )
+    return _owned(status, job, worker)
+
+
+async def fail(pool: asyncpg.Pool, job: Job, worker: str, error: str, retry_delay: float = 30.0) -> bool:
+    """
+    Record a failed attempt of a job worker is running. The job is queued again after retry_delay seconds
+    per attempt so far, until it runs out of attempts.
+    :return: False when worker no longer holds the lease, see complete.
+    """
+    status = await pool.execute(
+        """
+        UPDATE ingest_jobs
+        SET status       = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+            available_at = now() + make_interval(secs => $3::float8 * attempts),
+            finished_at  = CASE WHEN attempts >= max_attempts THEN now() END,
+            last_error   = $2
+        WHERE id = $1 AND status = 'running' AND leased_by = $4
+        """,
+        job.id,
+        error,
+        retry_delay,
+        worker,
+    )
+    return _owned(status, job, worker)
+
+
+def _owned(status: str, job: Job, worker: str) -> bool:
+    if int(status.split()[-1]) == 0:
+        print(f"Ingest job {job.id} ({job.source}/{job.path}) is no longer leased to {worker}, leaving it alone")
+        return False
+    return True
+
+
+async def counts(pool: asyncpg.Pool) -> Dict[str, int]:
+    rows = await pool.fetch("SELECT status, count(*) AS jobs FROM ingest_jobs GROUP BY status")
+    return {row["status"]: row["jobs"] for row in rows}
+
+
+async def stream(
+        pool: asyncpg.Pool,
+        worker: str,
+        batch_size: int = 8,
+        lease_seconds: float = 300.0,
+        idle_seconds: float = 5.0,
+        stop_when_empty: bool = True,
+) -> AsyncIterator[Job]:
+    """
+    Claim jobs in batches as the consumer asks for them, leases are kept alive by a heartbeat
+    every third of lease_seconds until the stream is closed.
+    With stop_when_empty the stream ends once no job is queued or running anywhere.
+    """
+    async def beat():
+        while True:
+            await asyncio.sleep(lease_seconds / 3)
+            try:
+                await heartbeat(pool, worker, lease_seconds)
+            except Exception as e:
+                print(f"Ingest job heartbeat failed: {e}")
+
+    heart = asyncio.create_task(beat())
+    try:
+        while True:
+            claimed = await claim(pool, worker, batch_size, lease_seconds)
+            if claimed:
+                for job in claimed:
+                    yield job
+                continue
+            if stop_when_empty:
+                open_jobs = await counts(pool)
+                if not open_jobs.get("queued") and not open_jobs.get("running"):
+                    return
+            await asyncio.sleep(idle_seconds)
+    finally:
+        heart.cancel()
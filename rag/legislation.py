@@ -1,16 +1,24 @@
 from __future__ import annotations as _annotations
 
 import asyncio
-import json
+import functools
+from concurrent.futures import Executor
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Dict, List, Optional
 
 
 import asyncpg
 from sentence_transformers import SentenceTransformer
 from pydantic import BaseModel, TypeAdapter
 
+import extract
 import helpers
+import ingest
+import statements
+import vector_storage
+from chunking import TokenCounter, DEFAULT_OVERLAP_TOKENS, chunker_settings
+from embedding_cache import EmbeddingCache
 
 
 @dataclass
@@ -26,115 +34,116 @@ class LegislationMetadata(BaseModel):
 
 legislation_metadata_adapter = TypeAdapter(LegislationMetadata)
 
-async def populate_db(model:SentenceTransformer, pool: asyncpg.Pool, forms_dir: Path) -> None:
-    """Build the forms database from JSON files."""
-    print("Populating Legislation tables...")
-    # If no JSON files exist yet, create a sample file
-    metadata_paths = list(forms_dir.rglob("*.json"))
-
-    print(f"Found {len(metadata_paths)} forms to process.")
-
-    print("Processing legislation data files...")
-    sem = asyncio.Semaphore(5)  # Limit concurrent processing
-
-    async with asyncio.TaskGroup() as tg:
-        for path in metadata_paths:
-            tg.create_task(process_legislation_files(sem, model, pool, path))
-
-    print("Legislation tables build complete.")
+# Tables holding the rows of a legislation section, all keyed by act and code
+LEGISLATION_TABLES = ("legislation_html", "legislation_html_chunks")
+
+def source(
+        legislation_dir: Path,
+        executor: Optional[Executor] = None,
+        counter: Optional[TokenCounter] = None,
+        chunk_size: int = 512,
+        overlap: int = DEFAULT_OVERLAP_TOKENS,
+) -> ingest.Source:
+    """The legislation corpus as an ingest source, chunked into chunk_size tokens overlapping by overlap."""
+    return ingest.Source(
+        "legislation",
+        legislation_dir,
+        functools.partial(parse_legislation, executor, counter, chunk_size=chunk_size, overlap=overlap),
+        chunker_settings=chunker_settings(chunk_size, overlap),
+    )
 
-async def process_legislation_files(
-        sem: asyncio.Semaphore,
+async def populate_db(
         model: SentenceTransformer,
         pool: asyncpg.Pool,
-        metadata_path: Path,
+        forms_dir: Path,
+        batch_size: int = helpers.DEFAULT_BATCH_SIZE,
+        cache: Optional[EmbeddingCache] = None,
+        executor: Optional[Executor] = None,
 ) -> None:
-    """Process a single form JSON file and insert its data into the database."""
-    async with sem:
-        try:
-            print(f"Processing {metadata_path}...")
-
-            # Load and validate the JSON data
-            with open(metadata_path, 'r') as f:
-                json_data = dict(json.load(f))
-
-            metadata = legislation_metadata_adapter.validate_python(json_data)
-            await process_legislation_xhtml(model, pool, metadata_path, metadata)
-        except Exception as e:
-            print(f"Error processing {metadata_path}: {e}")
+    """Build the legislation tables from JSON files."""
+    print("Populating Legislation tables...")
+    await ingest.populate(
+        model,
+        pool,
+        [source(forms_dir, executor, TokenCounter.for_model(model))],
+        batch_size,
+        cache,
+    )
+    print("Legislation tables build complete.")
 
-async def process_legislation_xhtml(
+async def parse_legislation(
+        executor: Optional[Executor],
+        counter: Optional[TokenCounter],
+        metadata_path: Path,
+        chunk_size: int = 512,
+        overlap: int = DEFAULT_OVERLAP_TOKENS,
+) -> ingest.Document:
+    """Parse a single legislation JSON file and its XHTML text into the rows to insert."""
+    print(f"Processing {metadata_path}...")
+
+    # Load and validate the JSON data
+    json_data = await asyncio.to_thread(ingest.load_json, metadata_path)
+    metadata = legislation_metadata_adapter.validate_python(json_data)
+
+    label = f"{metadata.act} - {metadata.code}"
+    owner = {table: {"act": metadata.act, "code": metadata.code} for table in LEGISLATION_TABLES}
+    rows = [ingest.Row(
+        "legislation_html",
+        {
+            "act": metadata.act,
+            "code": metadata.code,
+            "description": metadata.description,
+            "link": metadata.link,
+        },
+        key=("act", "code"),
+        embed={"description_embedding": metadata.description},
+    )]
+    rows += await legislation_xhtml_rows(executor, counter, metadata_path, metadata, chunk_size, overlap)
+    return ingest.Document(metadata_path, label, rows, owner)
+
+async def legislation_xhtml_rows(
+        executor: Optional[Executor],
+        counter: Optional[TokenCounter],
+        metadata_path: Path,
+        metadata: LegislationMetadata,
+        chunk_size: int = 512,
+        overlap: int = DEFAULT_OVERLAP_TOKENS,
+) -> List[ingest.Row]:
+
+    # The crawler stores each section as an .xhtml page next to its metadata
+    html_paths = list(metadata_path.parent.glob("*.xhtml"))
+    html_chunks = await asyncio.gather(*(
+        extract.extract_usc_chunks(executor, html_path, chunk_size, overlap, counter)
+        for html_path in html_paths
+    ))
+
+    rows = []
+    for chunks in html_chunks:
+        for chunk in chunks:
+            rows.append(ingest.Row(
+                "legislation_html_chunks",
+                {
+                    "act": metadata.act,
+                    "code": metadata.code,
+                    "content_chunk": chunk.content,
+                    "section": chunk.section,
+                    "citation": chunk.citation,
+                    "part": chunk.field,
+                },
+                key=("act", "code", "content_chunk"),
+                embed={"chunk_embedding": chunk.content},
+            ))
+    return rows
+
+async def search(
         model: SentenceTransformer,
         pool: asyncpg.Pool,
-        metadata_path: Path,
-        metadata: LegislationMetadata) -> None:
-
-    html_paths = metadata_path.parent.glob("*.html")
-    for html_path in html_paths:
-        # Step 1: Read the HTML content
-        html_content = helpers.read_file_to_string(html_path)
-        async with pool.acquire() as conn:
-            async with conn.transaction():
-                try:
-                    exists = await conn.fetchval(
-                        'SELECT 1 FROM legislation_html WHERE act = $1 AND code = $2' ,
-                        metadata.act, metadata.code,
-                    )
-                    if exists:
-                        print(f"Skipping existing entry: {metadata.act} - {metadata.code} - chunk: {i}")
-                        continue
-
-                    context = {
-                        "act": metadata.act,
-                        "code": metadata.code,
-                        "description": metadata.description,
-                    }
-                    embedding_json = helpers.generate_embeddings(model, metadata.description, context)
-                    # Insert into database
-                    await conn.execute(
-                        '''
-                        INSERT INTO legislation_html (act, code, description, link, description_embedding)
-                        VALUES ($1, $2, $3)
-                        ''',
-                        metadata.act,
-                        metadata.code,
-                        metadata.description,
-                        metadata.link,
-                        embedding_json,
-                    )
-                    # Step 2: Chunk the HTML content
-                    for i, chunk in enumerate(helpers.chunk_html_content(html_content, "lxml-xml")):
-                        # Check if this pdf already exists
-                        exists = await conn.fetchval(
-                            'SELECT 1 FROM legislation_html_chunks WHERE act = $1 AND code = $2 AND content_chunk = $3',
-                            metadata.act, metadata.code, chunk
-                        )
-
-                        if exists:
-                            print(f"Skipping existing entry: {metadata.act} - {metadata.code} - chunk: {i}")
-                            continue
-
-                        # Generate embedding for the category text
-                        print(f"Generating embedding for: {metadata.act} - {metadata.code} - chunk: {i}")
-
-                        embedding_json = helpers.generate_embeddings(model, chunk)
-                        # Insert into database
-                        await conn.execute(
-                            '''
-                            INSERT INTO legislation_html_chunks (act, code, content_chunk, chunk_embedding)
-                            VALUES ($1, $2, $3, $4)
-                            ''',
-                            metadata.act,
-                            metadata.code,
-                            chunk,
-                            embedding_json,
-                        )
-                        print(f"Inserted: {metadata.id} - {html_path.name} - chunk: {i}")
-                except Exception as e:
-                    print("An error occurred, rolling back the transaction:", e)
-                    raise
-
-async def search(model: SentenceTransformer, pool: asyncpg.Pool, search_query: str, limit: int = 10):
+        search_query: str,
+        limit: int = 10,
+        executor: Optional[Executor] = None,
+        settings: Optional[Dict[str, str]] = None,
+        candidates: int = vector_storage.DEFAULT_CANDIDATES,
+):
     """
     Search for immigration legislation based on query similarity.
     Returns legislation objects with act, code, description, relevant chunks, and links.
@@ -145,6 +154,9 @@ async def search(model: SentenceTransformer, pool: asyncpg.Pool, search_query: s
         pool: Database connection pool
         search_query: Query string to search for
         limit: Maximum number of results to return
+        executor: Executor encoding the query, the loop's default one when None
+        settings: Server settings for the search query only, see vector_storage.search_settings
+        candidates: Nearest chunks taken, and half as many descriptions, see vector_storage.search_candidates
 
     Returns:
         List of legislation objects with relevant content and metadata
@@ -152,13 +164,16 @@ async def search(model: SentenceTransformer, pool: asyncpg.Pool, search_query: s
     print(f"Searching legislation for: {search_query}")
 
     # Generate embedding for the search query
-    embedding_json = helpers.generate_embeddings(model, search_query)
+    embedding = await helpers.generate_embeddings_async(executor, model, search_query)
 
     # Execute the query that fetches legislation, chunks, and links
-    rows = await pool.fetch(
-        helpers.read_file_to_string("./sql/search-legislation.sql"),
-        embedding_json,
-        limit
+    rows = await statements.catalog.fetch_pooled(
+        pool,
+        "search-legislation",
+        embedding,
+        limit,
+        candidates,
+        settings=settings,
     )
 
     # Process and organize the results
@@ -184,6 +199,8 @@ async def search(model: SentenceTransformer, pool: asyncpg.Pool, search_query: s
         if row['content_chunk']:
             legislation_dict[key]['chunks'].append({
                 'content': row['content_chunk'],
+                'section': row['section'],
+                'citation': row['citation'],
                 'similarity_score': row['content_similarity']
             })
 
@@ -0,0 +1,229 @@
+from __future__ import annotations as _annotations
+
+import hashlib
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import asyncpg
+
+
+@dataclass
+class Entry:
+    """
+    What was ingested from one metadata file: the state of its folder at the time,
+    the versions that produced its rows, and the filters selecting those rows.
+    """
+    source: str
+    path: str
+    size: int
+    mtime: float
+    content_hash: Optional[str]
+    chunker_version: int
+    embedding_model: str
+    # Table -> column values owned by this file, used to delete its rows
+    owner: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    # Chunk size and overlap of the source and what it learned from the corpus, see ingest.Source.settings
+    chunker_settings: str = ""
+
+    @property
+    def identity(self) -> Tuple[str, str]:
+        return self.source, self.path
+
+    def same_versions(self, other: "Entry") -> bool:
+        return (
+            self.chunker_version == other.chunker_version
+            and self.chunker_settings == other.chunker_settings
+            and self.embedding_model == other.embedding_model
+        )
+
+    def same_stat(self, other: "Entry") -> bool:
+        return self.size == other.size and self.mtime == other.mtime
+
+
+@dataclass
+class Plan:
+    """
+    Result of diffing a crawl against the manifest.
+    """
+    # (entry, previous entry or None) for the files that may need ingesting, content_hash is filled in later
+    pending: List[Tuple[Entry, Optional[Entry]]]
+    removed: List[Entry]
+    unchanged: int
+
+    def shard(self, keep: Callable[[Entry], bool]) -> "Plan":
+        """
+        The part of the plan whose entries keep accepts, unchanged files are not broken down.
+        """
+        return Plan(
+            [(entry, previous) for entry, previous in self.pending if keep(entry)],
+            [entry for entry in self.removed if keep(entry)],
+            self.unchanged,
+        )
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            "new": sum(1 for _, previous in self.pending if previous is None),
+            "changed": sum(1 for _, previous in self.pending if previous is not None),
+            "unchanged": self.unchanged,
+            "removed": len(self.removed),
+        }
+
+
+def document_files(metadata_path: Path) -> List[Path]:
+    """
+    The files a metadata file stands for: itself and the documents the crawler stored next to it.
+    """
+    return sorted(path for path in metadata_path.parent.iterdir() if path.is_file())
+
+
+def stat(
+        source: str,
+        root: Path,
+        metadata_path: Path,
+        chunker_version: int,
+        embedding_model: str,
+        chunker_settings: str = "",
+) -> Entry:
+    """
+    Entry for a metadata file from its folder's total size and latest mtime, without reading any content.
+    """
+    size, mtime = 0, 0.0
+    for path in document_files(metadata_path):
+        info = path.stat()
+        size += info.st_size
+        mtime = max(mtime, info.st_mtime)
+    relative = metadata_path.relative_to(root).as_posix()
+    return Entry(source, relative, size, mtime, None, chunker_version, embedding_model, chunker_settings=chunker_settings)
+
+
+def content_hash(metadata_path: Path) -> str:
+    """
+    SHA-256 over the names and contents of the files a metadata file stands for.
+    """
+    digest = hashlib.sha256()
+    for path in document_files(metadata_path):
+        digest.update(path.name.encode("utf-8") + b"\0")
+        with open(path, "rb") as f:
+            digest.update(hashlib.file_digest(f, "sha256").digest())
+    return digest.hexdigest()
+
+
+def _entry(record: asyncpg.Record) -> Entry:
+    return Entry(
+        record["source"],
+        record["path"],
+        record["size"],
+        record["mtime"],
+        record["content_hash"],
+        record["chunker_version"],
+        record["embedding_model"],
+        json.loads(record["owner"]),
+        record["chunker_settings"],
+    )
+
+
+async def load(pool: asyncpg.Pool) -> Dict[Tuple[str, str], Entry]:
+    records = await pool.fetch(
+        "SELECT source, path, size, mtime, content_hash, chunker_version, embedding_model, owner, chunker_settings "
+        "FROM ingest_manifest"
+    )
+    entries = (_entry(record) for record in records)
+    return {entry.identity: entry for entry in entries}
+
+
+async def get(pool: asyncpg.Pool, source: str, path: str) -> Optional[Entry]:
+    record = await pool.fetchrow(
+        "SELECT source, path, size, mtime, content_hash, chunker_version, embedding_model, owner, chunker_settings "
+        "FROM ingest_manifest WHERE source = $1 AND path = $2",
+        source,
+        path,
+    )
+    return _entry(record) if record is not None else None
+
+
+def diff(crawl: List[Entry], previous: Dict[Tuple[str, str], Entry], sources: List[str]) -> Plan:
+    """
+    Compare the crawled files with the manifest.
+    Files whose size, mtime and versions all match are unchanged without hashing them.
+    Only entries of the crawled sources can be reported as removed.
+    """
+    pending = []
+    unchanged = 0
+    seen = set()
+    for entry in crawl:
+        seen.add(entry.identity)
+        old = previous.get(entry.identity)
+        if old is not None and old.same_versions(entry) and old.same_stat(entry):
+            unchanged += 1
+        else:
+            pending.append((entry, old))
+    removed = [
+        entry for identity, entry in previous.items()
+        if identity not in seen and entry.source in sources
+    ]
+    return Plan(pending, removed, unchanged)
+
+
+async def delete_owned(conn: asyncpg.Connection, owner: Dict[str, Dict[str, Any]]) -> int:
+    """
+    Delete the rows selected by owner, table -> column values.
+    :return: Number of rows deleted.
+    """
+    deleted = 0
+    for table, where in owner.items():
+        conditions = " AND ".join(f"{column} = ${i}" for i, column in enumerate(where, start=1))
+        status = await conn.execute(f"DELETE FROM {table} WHERE {conditions}", *where.values())
+        deleted += int(status.split()[-1])
+    return deleted
+
+
+async def delete_rows(conn: asyncpg.Connection, entry: Entry) -> int:
+    """
+    Delete the rows a manifest entry owns, and the entry itself. Run inside a transaction.
+    :return: Number of rows deleted.
+    """
+    deleted = await delete_owned(conn, entry.owner)
+    await conn.execute("DELETE FROM ingest_manifest WHERE source = $1 AND path = $2", entry.source, entry.path)
+    return deleted
+
+
+async def record(conn: asyncpg.Connection, entries: List[Entry]) -> None:
+    """
+    Insert or update manifest entries, in the transaction that wrote their rows.
+    """
+    await conn.executemany(
+        """
+        INSERT INTO ingest_manifest (
+            source, path, size, mtime, content_hash, chunker_version, embedding_model, owner, chunker_settings
+        )
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8::jsonb, $9)
+        ON CONFLICT (source, path) DO UPDATE
+            SET size             = excluded.size,
+                mtime            = excluded.mtime,
+                content_hash     = excluded.content_hash,
+                chunker_version  = excluded.chunker_version,
+                embedding_model  = excluded.embedding_model,
+                owner            = excluded.owner,
+                chunker_settings = excluded.chunker_settings,
+                ingested_at      = now()
+        """,
+        [
+            (
+                e.source, e.path, e.size, e.mtime, e.content_hash, e.chunker_version, e.embedding_model,
+                json.dumps(e.owner), e.chunker_settings,
+            )
+            for e in entries
+        ],
+    )
+
+
+async def touch(pool: asyncpg.Pool, entry: Entry) -> None:
+    """
+    Store the new size and mtime of a file whose content did not change.
+    """
+    await pool.execute(
+        "UPDATE ingest_manifest SET size = $3, mtime = $4 WHERE source = $1 AND path = $2",
+        entry.source, entry.path, entry.size, entry.mtime,
+    )
@@ -0,0 +1,160 @@
+from __future__ import annotations as _annotations
+
+import asyncio
+import threading
+import time
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+
+class LoopMonitor:
+    """
+    Estimates how busy the running event loop is.
+
+    A background task sleeps for interval and measures how late it wakes up;
+    the lateness is time the loop spent running other callbacks instead of waiting for I/O.
+    """
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples = 0
+        self.lag_seconds = 0.0
+        self.max_lag = 0.0
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _sample(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            self.samples += 1
+            self.lag_seconds += lag
+            self.max_lag = max(self.max_lag, lag)
+
+    async def __aenter__(self) -> "LoopMonitor":
+        self.started = time.perf_counter()
+        self._task = asyncio.create_task(self._sample())
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.finished = time.perf_counter()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def busy(self) -> float:
+        """Fraction of wall time the loop was blocked."""
+        return min(1.0, self.lag_seconds / self.elapsed) if self.elapsed else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "seconds": round(self.elapsed, 3),
+            "busy": round(self.busy, 3),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+        }
+
+
+class TimedExecutor(Executor):
+    """
+    Executor wrapper that records how long submitted calls ran, to report how busy its workers were.
+    """
+    def __init__(self, executor: Executor, workers: int):
+        self.executor = executor
+        self.workers = workers
+        self.calls = 0
+        self.busy_seconds = 0.0
+        self.created = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+        def timed():
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.calls += 1
+                    self.busy_seconds += time.perf_counter() - start
+        return self.executor.submit(timed)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        self.executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def as_dict(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.created
+        capacity = elapsed * self.workers
+        return {
+            "workers": self.workers,
+            "calls": self.calls,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "utilization": round(self.busy_seconds / capacity, 3) if capacity else 0.0,
+        }
+
+
+@dataclass
+class Progress:
+    """
+    Live counters of an ingest run, safe to read from other tasks while it runs.
+    """
+    files_total: int = 0
+    files_done: int = 0
+    files_unchanged: int = 0
+    files_failed: int = 0
+    chunks: int = 0
+    embeddings: int = 0
+    started: float = field(default_factory=time.perf_counter)
+    finished: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def files_settled(self) -> int:
+        return self.files_done + self.files_unchanged + self.files_failed
+
+    def rate(self, count: int) -> float:
+        return count / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        """Time left at the file rate so far, None until the first file is settled."""
+        settled = self.files_settled
+        if not settled or self.finished is not None:
+            return None
+        return (self.files_total - settled) / self.rate(settled)
+
+    def as_dict(self) -> Dict[str, Any]:
+        eta = self.eta_seconds
+        return {
+            "files_total": self.files_total,
+            "files_done": self.files_done,
+            "files_unchanged": self.files_unchanged,
+            "files_failed": self.files_failed,
+            "chunks": self.chunks,
+            "embeddings": self.embeddings,
+            "seconds": round(self.elapsed, 1),
+            "chunks_per_second": round(self.rate(self.chunks), 1),
+            "embeddings_per_second": round(self.rate(self.embeddings), 1),
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+            "finished": self.finished is not None,
+        }
+
+    def __str__(self) -> str:
+        eta = self.eta_seconds
+        return (
+            f"{self.files_settled}/{self.files_total} files ({self.files_failed} failed), "
+            f"{self.rate(self.chunks):.0f} chunks/s, {self.rate(self.embeddings):.0f} embeddings/s, "
+            f"ETA {'-' if eta is None else f'{eta:.0f}s'}"
+        )
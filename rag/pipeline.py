@@ -0,0 +1,163 @@
+from __future__ import annotations as _annotations
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Iterable, List, Optional
+
+# Marks the end of a stage's input
+_DONE = object()
+
+StageFn = Callable[[Any], Awaitable[Optional[Iterable[Any]]]]
+
+
+@dataclass
+class StageStats:
+    name: str
+    workers: int
+    processed: int = 0
+    emitted: int = 0
+    failed: int = 0
+    busy_seconds: float = 0.0
+    started: Optional[float] = None
+    finished: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        """Items processed per second of wall time."""
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def utilization(self) -> float:
+        """Fraction of the stage's worker time spent processing rather than waiting for input."""
+        capacity = self.elapsed * self.workers
+        return self.busy_seconds / capacity if capacity else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "processed": self.processed,
+            "emitted": self.emitted,
+            "failed": self.failed,
+            "seconds": round(self.elapsed, 3),
+            "per_second": round(self.throughput, 2),
+            "utilization": round(self.utilization, 3),
+        }
+
+
+@dataclass
+class Stage:
+    name: str
+    fn: StageFn
+    workers: int = 1
+    queue_size: int = 16
+    # When above one, workers pass lists of up to batch_size queued items to fn
+    batch_size: int = 1
+    stats: StageStats = field(init=False)
+
+    def __post_init__(self):
+        self.stats = StageStats(self.name, self.workers)
+
+
+class Pipeline:
+    """
+    Chain of asynchronous stages connected by bounded queues.
+
+    Each stage runs its own workers; a full queue blocks the stage feeding it, so a slow stage
+    throttles everything upstream instead of letting work pile up in memory.
+    A stage function receives one item (or a list of items for batched stages) and returns
+    the items to pass downstream, or None. Failures are reported and counted, the item is dropped.
+    """
+    def __init__(self, name: str = "pipeline"):
+        self.name = name
+        self.stages: List[Stage] = []
+
+    def stage(self, name: str, fn: StageFn, workers: int = 1, queue_size: int = 16, batch_size: int = 1) -> "Pipeline":
+        self.stages.append(Stage(name, fn, workers, queue_size, batch_size))
+        return self
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {stage.name: stage.stats.as_dict() for stage in self.stages}
+
+    async def run(self, source: Iterable[Any] | AsyncIterable[Any]) -> Dict[str, Dict[str, Any]]:
+        """
+        Feed every item of source through the stages and wait for all of them to drain.
+        :return: Per-stage counters, see StageStats.as_dict.
+        """
+        if not self.stages:
+            raise ValueError("pipeline has no stages")
+        queues = [asyncio.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        remaining = [stage.workers for stage in self.stages]
+
+        async def feed():
+            if isinstance(source, AsyncIterable):
+                async for item in source:
+                    await queues[0].put(item)
+            else:
+                for item in source:
+                    await queues[0].put(item)
+            for _ in range(self.stages[0].workers):
+                await queues[0].put(_DONE)
+
+        async def work(index: int):
+            stage = self.stages[index]
+            inbox = queues[index]
+            outbox = queues[index + 1] if index + 1 < len(queues) else None
+            stats = stage.stats
+            if stats.started is None:
+                stats.started = time.perf_counter()
+
+            done = False
+            while not done:
+                item = await inbox.get()
+                if item is _DONE:
+                    break
+                items = [item]
+                # Batched stages take whatever else is already waiting
+                while len(items) < stage.batch_size and not inbox.empty():
+                    extra = inbox.get_nowait()
+                    if extra is _DONE:
+                        done = True
+                        break
+                    items.append(extra)
+
+                start = time.perf_counter()
+                try:
+                    outputs = await stage.fn(items if stage.batch_size > 1 else item)
+                except Exception as e:
+                    stats.failed += len(items)
+                    print(f"[{self.name}] {stage.name} failed on {_describe(items)}: {e}")
+                    outputs = None
+                stats.busy_seconds += time.perf_counter() - start
+                stats.processed += len(items)
+
+                for output in outputs or ():
+                    stats.emitted += 1
+                    if outbox is not None:
+                        await outbox.put(output)
+
+            remaining[index] -= 1
+            if remaining[index] == 0:
+                stats.finished = time.perf_counter()
+                if outbox is not None:
+                    for _ in range(self.stages[index + 1].workers):
+                        await outbox.put(_DONE)
+
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(feed())
+            for index, stage in enumerate(self.stages):
+                for _ in range(stage.workers):
+                    tg.create_task(work(index))
+
+        return self.stats()
+
+
+def _describe(items: List[Any]) -> str:
+    if len(items) == 1:
+        return repr(items[0])
+    return f"a batch of {len(items)} items"
@@ -0,0 +1,146 @@
+from __future__ import annotations as _annotations
+
+import asyncio
+import copy
+import hashlib
+import multiprocessing
+import os
+import queue
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
+
+from monitor import Progress
+
+if TYPE_CHECKING:
+    from agent import Config, DBConfig
+
+# Progress counters summed over the shards
+_COUNTERS = ("files_total", "files_done", "files_unchanged", "files_failed", "chunks", "embeddings")
+
+
+def shard_of(key: str, shards: int) -> int:
+    """
+    Stable shard of a key, the same in every process and run unlike hash().
+    """
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big") % shards
+
+
+def threads_per_shard(shards: int) -> int:
+    return max(1, (os.cpu_count() or 1) // shards)
+
+
+def _run_shard(
+        index: int,
+        shards: int,
+        db_config: DBConfig,
+        rag_config: Config,
+        model: Tuple[str, str],
+        updates: "queue.Queue[Tuple[int, Dict[str, Any]]]",
+) -> Dict[str, Any]:
+    """
+    Worker process: load a model replica limited to its share of the cores
+    and ingest the files of one shard through its own connection pool.
+    :param model: Resolved path and revision of the model of the parent, see embedding_cache.model_identity.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    from agent import RAGAgent
+    from embedding_cache import model_identity
+
+    threads = threads_per_shard(shards)
+    torch.set_num_threads(threads)
+    name, revision = model
+    replica = SentenceTransformer(name, revision=revision or None)
+    # Embeddings of another model would mix with the parent's in the same tables and cache
+    if model_identity(replica) != model:
+        raise RuntimeError(f"Shard {index} loaded model {model_identity(replica)}, the parent uses {model}")
+
+    async def run() -> Dict[str, Any]:
+        agent = RAGAgent(db_config, rag_config, replica)
+        async with agent:
+            await agent.populate_database(
+                on_progress=lambda progress: updates.put((index, progress.as_dict())),
+                shard=(index, shards),
+            )
+            return agent.ingest_stats
+
+    print(f"Shard {index}/{shards} started with {threads} torch threads")
+    return asyncio.run(run())
+
+
+def _aggregate(progress: Progress, latest: Dict[int, Dict[str, Any]]) -> None:
+    for counter in _COUNTERS:
+        setattr(progress, counter, sum(update[counter] for update in latest.values()))
+
+
+async def populate(
+        db_config: DBConfig,
+        rag_config: Config,
+        model: Tuple[str, str],
+        shards: int,
+        progress: Progress,
+        on_progress: Optional[Callable[[Progress], None]] = print,
+) -> Tuple[Dict[int, Dict[str, Any]], Dict[int, BaseException]]:
+    """
+    Ingest with one worker process per shard, files are assigned to shards by a stable hash of their path.
+    Workers report their progress to this process, which sums it into progress.
+    :param model: Name and revision of the model to load in every worker, see embedding_cache.model_identity.
+    :return: Ingest stats of the shards that finished and the errors of those that did not, by shard.
+    """
+    # Workers ingest plain files, vector index handling and index prewarming stay with the parent
+    worker_db_config = copy.copy(db_config)
+    worker_db_config.prewarm_indexes = False
+    worker_rag_config = copy.copy(rag_config)
+    worker_rag_config.ingest_processes = 1
+    if worker_rag_config.parse_processes is None:
+        worker_rag_config.parse_processes = threads_per_shard(shards)
+
+    context = multiprocessing.get_context("spawn")
+    latest: Dict[int, Dict[str, Any]] = {}
+    results: Dict[int, Dict[str, Any]] = {}
+    errors: Dict[int, BaseException] = {}
+    with context.Manager() as manager, ProcessPoolExecutor(
+            # A fresh process per shard, each gets its own RAGAgent and model
+            max_workers=shards, mp_context=context, max_tasks_per_child=1,
+    ) as executor:
+        updates = manager.Queue()
+        loop = asyncio.get_running_loop()
+        futures = {
+            index: loop.run_in_executor(
+                executor, _run_shard, index, shards, worker_db_config, worker_rag_config, model, updates
+            )
+            for index in range(shards)
+        }
+
+        async def collect():
+            while True:
+                try:
+                    index, update = await asyncio.to_thread(updates.get, timeout=1.0)
+                except queue.Empty:
+                    continue
+                latest[index] = update
+                _aggregate(progress, latest)
+                if on_progress is not None:
+                    on_progress(progress)
+
+        collector = asyncio.create_task(collect())
+        try:
+            for index, future in futures.items():
+                try:
+                    results[index] = await future
+                except Exception as e:
+                    errors[index] = e
+                    print(f"Shard {index} failed: {e}")
+        finally:
+            collector.cancel()
+        # Pick up the final reports
+        while True:
+            try:
+                index, update = updates.get_nowait()
+            except queue.Empty:
+                break
+            latest[index] = update
+    _aggregate(progress, latest)
+    return results, errors
+
@@ -1,4 +1,15 @@
 CREATE EXTENSION IF NOT EXISTS vector;
+-- Prewarming the vector indexes is best-effort: pg_prewarm ships with contrib and needs superuser rights to install
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_prewarm;
+EXCEPTION
+    WHEN OTHERS THEN RAISE NOTICE 'pg_prewarm not installed, vector indexes will not be prewarmed: %', SQLERRM;
+END
+$$;
+
+-- The HNSW indexes on the embedding columns, and the nearest_* functions searches read them through,
+-- are created by vector_storage.apply according to DBConfig.vector_storage
 
 CREATE TABLE IF NOT EXISTS form_pdfs
 (
@@ -11,12 +22,13 @@ CREATE TABLE IF NOT EXISTS form_pdfs
     metadata             TEXT NOT NULL,
     is_instructions      BOOLEAN DEFAULT false,
     title_embedding      VECTOR(384) NOT NULL,
-    description_embedding VECTOR(384) NOT NULL
+    description_embedding VECTOR(384) NOT NULL,
+    content_hash         TEXT
 );
 
+ALTER TABLE form_pdfs ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
 CREATE INDEX IF NOT EXISTS idx_form_pdfs_form_id ON form_pdfs (form_id);
-CREATE INDEX IF NOT EXISTS idx_form_pdf_title_embedding ON form_pdfs USING hnsw (title_embedding vector_cosine_ops);
-CREATE INDEX IF NOT EXISTS idx_form_pdf_description_embedding ON form_pdfs USING hnsw (description_embedding vector_cosine_ops);
 
 
 CREATE TABLE IF NOT EXISTS form_pdf_chunks
@@ -25,20 +37,29 @@ CREATE TABLE IF NOT EXISTS form_pdf_chunks
     form_id         TEXT        NOT NULL,
     form_name       TEXT        NOT NULL,
     content_chunk   TEXT        NOT NULL,
-    chunk_embedding VECTOR(384) NOT NULL
+    page_start      INTEGER,
+    page_end        INTEGER,
+    chunk_embedding VECTOR(384) NOT NULL,
+    content_hash    TEXT
 );
 
+ALTER TABLE form_pdf_chunks ADD COLUMN IF NOT EXISTS page_start INTEGER;
+ALTER TABLE form_pdf_chunks ADD COLUMN IF NOT EXISTS page_end INTEGER;
+ALTER TABLE form_pdf_chunks ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
 CREATE INDEX IF NOT EXISTS idx_form_pdf_chunks_form_id ON form_pdf_chunks (form_id);
-CREATE INDEX IF NOT EXISTS idx_form_pdf_chunks_chunk_embedding ON form_pdf_chunks USING hnsw (chunk_embedding vector_cosine_ops);
 
 CREATE TABLE IF NOT EXISTS form_fees
 (
     id       SERIAL PRIMARY KEY,
     form_id  TEXT NOT NULL,
     topic_id TEXT NOT NULL,
-    fee_link TEXT NOT NULL
+    fee_link TEXT NOT NULL,
+    content_hash TEXT
 );
 
+ALTER TABLE form_fees ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
 CREATE INDEX IF NOT EXISTS idx_form_fees_form_id ON form_fees (form_id);
 
 CREATE TABLE IF NOT EXISTS form_filings
@@ -49,11 +70,13 @@ CREATE TABLE IF NOT EXISTS form_filings
     category           TEXT        NOT NULL,
     paper_fee          TEXT,
     online_fee         TEXT,
-    category_embedding vector(384) NOT NULL
+    category_embedding vector(384) NOT NULL,
+    content_hash       TEXT
 );
 
+ALTER TABLE form_filings ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
 CREATE INDEX IF NOT EXISTS idx_form_filings_form_id ON form_filings (form_id);
-CREATE INDEX IF NOT EXISTS idx_form_filings_embedding ON form_filings USING hnsw (category_embedding vector_cosine_ops);
 
 CREATE TABLE IF NOT EXISTS form_html_chunks
 (
@@ -61,11 +84,27 @@ CREATE TABLE IF NOT EXISTS form_html_chunks
     form_id         TEXT        NOT NULL,
     file_name       TEXT        NOT NULL,
     content_chunk   TEXT        NOT NULL,
-    chunk_embedding VECTOR(384) NOT NULL
+    chunk_embedding VECTOR(384) NOT NULL,
+    content_hash    TEXT
 );
 
+ALTER TABLE form_html_chunks ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
 CREATE INDEX IF NOT EXISTS idx_form_html_chunks_form_id ON form_html_chunks (form_id);
-CREATE INDEX IF NOT EXISTS idx_form_html_chunks_chunk_embedding ON form_html_chunks USING hnsw (chunk_embedding vector_cosine_ops);
+
+-- One row per form with its links and title, so searches do not aggregate form_pdfs.
+-- Ingest refreshes the rows of the forms it writes or deletes, see refresh-form-summaries.sql
+CREATE TABLE IF NOT EXISTS form_summaries
+(
+    form_id          TEXT PRIMARY KEY,
+    form_url         TEXT,
+    instructions_url TEXT,
+    form_title       TEXT,
+    refreshed_at     TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Searches take the closest title over all the PDFs of a form, not the one title a summary kept
+ALTER TABLE form_summaries DROP COLUMN IF EXISTS title_embedding;
 
 CREATE TABLE IF NOT EXISTS legislation_html
 (
@@ -74,11 +113,13 @@ CREATE TABLE IF NOT EXISTS legislation_html
     code                  TEXT        NOT NULL,
     description           TEXT        NOT NULL,
     link                  TEXT        NOT NULL,
-    description_embedding VECTOR(384) NOT NULL
+    description_embedding VECTOR(384) NOT NULL,
+    content_hash          TEXT
 );
 
+ALTER TABLE legislation_html ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
 CREATE INDEX IF NOT EXISTS idx_legislation_html_act_code ON legislation_html (act, code);
-CREATE INDEX IF NOT EXISTS idx_legislation_html_description_embedding ON legislation_html USING hnsw (description_embedding vector_cosine_ops);
 
 CREATE TABLE IF NOT EXISTS legislation_html_chunks
 (
@@ -86,8 +127,87 @@ CREATE TABLE IF NOT EXISTS legislation_html_chunks
     act             TEXT        NOT NULL,
     code            TEXT        NOT NULL,
     content_chunk   TEXT        NOT NULL,
-    chunk_embedding VECTOR(384) NOT NULL
+    section         TEXT,
+    citation        TEXT,
+    part            TEXT,
+    chunk_embedding VECTOR(384) NOT NULL,
+    content_hash    TEXT
 );
 
+ALTER TABLE legislation_html_chunks ADD COLUMN IF NOT EXISTS content_hash TEXT;
+-- U.S.C. section number, citation like "8 U.S.C. 1323(a)" and field (statute, sourcecredit, notes) of the chunk
+ALTER TABLE legislation_html_chunks ADD COLUMN IF NOT EXISTS section TEXT;
+ALTER TABLE legislation_html_chunks ADD COLUMN IF NOT EXISTS citation TEXT;
+ALTER TABLE legislation_html_chunks ADD COLUMN IF NOT EXISTS part TEXT;
+
 CREATE INDEX IF NOT EXISTS idx_legislation_html_chunks_act_code ON legislation_html_chunks (act, code);
-CREATE INDEX IF NOT EXISTS idx_legislation_html_chunks_chunk_embedding ON legislation_html_chunks USING hnsw (chunk_embedding vector_cosine_ops);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_legislation_html_chunks_section ON legislation_html_chunks (section);
+
+-- One entry per ingested metadata file, see manifest.py
+CREATE TABLE IF NOT EXISTS ingest_manifest
+(
+    source          TEXT             NOT NULL,
+    path            TEXT             NOT NULL,
+    size            BIGINT           NOT NULL,
+    mtime           DOUBLE PRECISION NOT NULL,
+    content_hash    TEXT,
+    chunker_version INTEGER          NOT NULL,
+    embedding_model TEXT             NOT NULL,
+    owner           JSONB            NOT NULL DEFAULT '{}',
+    ingested_at     TIMESTAMPTZ      NOT NULL DEFAULT now(),
+    PRIMARY KEY (source, path)
+);
+ALTER TABLE ingest_manifest ADD COLUMN IF NOT EXISTS chunker_settings TEXT NOT NULL DEFAULT '';
+
+-- Queue of files to ingest, claimed by workers with FOR UPDATE SKIP LOCKED, see jobs.py
+CREATE TABLE IF NOT EXISTS ingest_jobs
+(
+    id            BIGSERIAL PRIMARY KEY,
+    source        TEXT        NOT NULL,
+    path          TEXT        NOT NULL,
+    status        TEXT        NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'done', 'failed')),
+    attempts      INTEGER     NOT NULL DEFAULT 0,
+    max_attempts  INTEGER     NOT NULL DEFAULT 3,
+    leased_by     TEXT,
+    lease_expires TIMESTAMPTZ,
+    available_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+    last_error    TEXT,
+    enqueued_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+    started_at    TIMESTAMPTZ,
+    finished_at   TIMESTAMPTZ,
+    UNIQUE (source, path)
+);
+
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_open ON ingest_jobs (id) WHERE status IN ('queued', 'running');
+
+-- Ingest deduplicates on content_hash: SHA-256 of the identifying columns joined by a unit separator,
+-- computed by ingest.Row.content_hash. Rows stored before the column existed are hashed here,
+-- duplicates among them removed, then the unique index is built once.
+DO
+$$
+DECLARE
+    target RECORD;
+BEGIN
+    FOR target IN
+        SELECT *
+        FROM (VALUES ('form_pdfs', 'form_id, file_name'),
+                     ('form_pdf_chunks', 'form_name, content_chunk'),
+                     ('form_fees', 'form_id, topic_id'),
+                     ('form_filings', 'form_id, topic_id, category'),
+                     ('form_html_chunks', 'form_id, file_name, content_chunk'),
+                     ('legislation_html', 'act, code'),
+                     ('legislation_html_chunks', 'act, code, content_chunk')) AS t (table_name, key_columns)
+        LOOP
+            IF to_regclass('uq_' || target.table_name || '_content_hash') IS NULL THEN
+                EXECUTE format(
+                        'UPDATE %I SET content_hash = encode(sha256(convert_to(concat_ws(E''\x1f'', %s), ''UTF8'')), ''hex'') WHERE content_hash IS NULL',
+                        target.table_name, target.key_columns);
+                EXECUTE format(
+                        'DELETE FROM %I a USING %I b WHERE a.content_hash = b.content_hash AND a.id > b.id',
+                        target.table_name, target.table_name);
+                EXECUTE format('CREATE UNIQUE INDEX %I ON %I (content_hash)',
+                               'uq_' || target.table_name || '_content_hash', target.table_name);
+            END IF;
+        END LOOP;
+END
+$$;
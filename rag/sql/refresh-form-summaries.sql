@@ -0,0 +1,22 @@
+-- Rebuild the form_summaries rows of the forms in $1, or of every form when $1 is NULL,
+-- and drop the rows of forms that no longer have any PDF
+WITH removed AS (
+    DELETE FROM form_summaries s
+    WHERE ($1::text[] IS NULL OR s.form_id = ANY ($1::text[]))
+      AND NOT EXISTS (SELECT 1 FROM form_pdfs p WHERE p.form_id = s.form_id)
+)
+INSERT INTO form_summaries (form_id, form_url, instructions_url, form_title)
+SELECT
+    p.form_id,
+    MAX(CASE WHEN NOT p.is_instructions THEN p.file_url END) AS form_url,
+    MAX(CASE WHEN p.is_instructions THEN p.file_url END) AS instructions_url,
+    MAX(CASE WHEN NOT p.is_instructions THEN p.title END) AS form_title
+FROM form_pdfs p
+WHERE $1::text[] IS NULL OR p.form_id = ANY ($1::text[])
+GROUP BY p.form_id
+ON CONFLICT (form_id) DO UPDATE
+    SET form_url         = excluded.form_url,
+        instructions_url = excluded.instructions_url,
+        form_title       = excluded.form_title,
+        refreshed_at     = now()
+RETURNING form_id
@@ -1,51 +1,101 @@
-WITH title_matches AS (
+-- Nearest neighbours come first, from the nearest_* functions of vector_storage.py: they order by the
+-- HNSW-indexed expression with a LIMIT, and re-rank quantized candidates exactly.
+-- Thresholds, per-form ranking, links and fees are then only computed for those candidates.
+-- $3 is the number of chunk candidates per table, half as many titles, set by the search profile
+-- together with an hnsw.ef_search covering it: an index scan returns no more rows than that.
+WITH title_candidates AS (
     SELECT
-        form_id,
-        title,
-        file_url,
-        is_instructions,
-        title_embedding <=> $1 AS title_similarity_score,
-    ROW_NUMBER() OVER (ORDER BY title_embedding <=> $1) AS title_rank
-FROM form_pdfs
-WHERE title_embedding <=> $1 < 0.4  -- Title similarity threshold
+        p.form_id,
+        p.title,
+        p.file_url,
+        p.is_instructions,
+        n.distance AS title_similarity_score
+    FROM nearest_form_pdf_titles($1, $3::integer / 2) n
+        JOIN form_pdfs p ON p.id = n.id
+),
+    title_matches AS (
+SELECT
+    tc.*,
+    ROW_NUMBER() OVER (ORDER BY tc.title_similarity_score) AS title_rank
+FROM title_candidates tc
+WHERE tc.title_similarity_score < 0.4  -- Title similarity threshold
     ),
-    ranked_chunks AS (
+    chunk_candidates AS (
 SELECT
     c.form_id,
     c.content_chunk,
-    c.chunk_embedding <=> $1 AS similarity_score,
-    ROW_NUMBER() OVER (PARTITION BY c.form_id ORDER BY c.chunk_embedding <=> $1) AS rank
-FROM form_pdf_chunks c
-WHERE c.chunk_embedding <=> $1 < 0.3  -- Content similarity threshold
+    'form_pdf_chunks' AS source_table,
+    n.distance AS similarity_score
+FROM nearest_form_pdf_chunks($1, $3::integer) n
+    JOIN form_pdf_chunks c ON c.id = n.id
 UNION ALL
 SELECT
     h.form_id,
     h.content_chunk,
-    h.chunk_embedding <=> $1 AS similarity_score,
-    ROW_NUMBER() OVER (PARTITION BY h.form_id ORDER BY h.chunk_embedding <=> $1) AS rank
-FROM form_html_chunks h
-WHERE h.chunk_embedding <=> $1 < 0.3  -- Content similarity threshold
+    'form_html_chunks' AS source_table,
+    n.distance AS similarity_score
+FROM nearest_form_html_chunks($1, $3::integer) n
+    JOIN form_html_chunks h ON h.id = n.id
+    ),
+    ranked_chunks AS (
+SELECT
+    cc.form_id,
+    cc.content_chunk,
+    cc.similarity_score,
+    -- Ranked per table, so a form returns its top PDF chunks and its top HTML chunks
+    ROW_NUMBER() OVER (PARTITION BY cc.form_id, cc.source_table ORDER BY cc.similarity_score) AS rank
+FROM chunk_candidates cc
+WHERE cc.similarity_score < 0.3  -- Content similarity threshold
+    ),
+    candidate_forms AS (
+SELECT form_id FROM ranked_chunks WHERE rank <= 3
+UNION
+SELECT form_id FROM title_matches WHERE title_rank <= 5
     ),
     form_links AS (
+-- Links and title of each candidate form from the per-form summary, one primary key lookup each,
+-- and the distance of the closest of its PDF titles
 SELECT
-    p.form_id,
-    MAX(CASE WHEN NOT p.is_instructions THEN p.file_url END) AS form_url,
-    MAX(CASE WHEN p.is_instructions THEN p.file_url END) AS instructions_url,
-    MAX(CASE WHEN NOT p.is_instructions THEN p.title END) AS form_title,
-    MIN(CASE WHEN p.title_embedding <=> $1 < 0.4 THEN p.title_embedding <=> $1 ELSE 1 END) AS best_title_score
-FROM form_pdfs p
-GROUP BY p.form_id
+    s.form_id,
+    s.form_url,
+    s.instructions_url,
+    s.form_title,
+    t.best_title_score
+FROM form_summaries s
+    CROSS JOIN LATERAL (
+        -- Closest title over every PDF of the form, read through idx_form_pdfs_form_id
+        SELECT MIN(CASE WHEN p.title_embedding <=> $1 < 0.4 THEN p.title_embedding <=> $1 ELSE 1 END) AS best_title_score
+        FROM form_pdfs p
+        WHERE p.form_id = s.form_id
+    ) t
+WHERE s.form_id IN (SELECT form_id FROM candidate_forms)
     ),
     closest_fees AS (
+-- Nearest filing category of each candidate form, read through idx_form_filings_form_id
 SELECT
-    f.form_id,
-    f.topic_id,
-    f.category,
-    f.paper_fee,
-    f.online_fee,
-    f.category_embedding <=> $1 AS fee_similarity_score,
-    ROW_NUMBER() OVER (PARTITION BY f.form_id ORDER BY f.category_embedding <=> $1) AS fee_rank
-FROM form_filings f
+    cand.form_id,
+    fee.topic_id,
+    fee.category,
+    fee.paper_fee,
+    fee.online_fee,
+    fee.fee_similarity_score
+FROM candidate_forms cand
+    CROSS JOIN LATERAL (
+        SELECT *
+        FROM (
+            SELECT
+                f.topic_id,
+                f.category,
+                f.paper_fee,
+                f.online_fee,
+                f.category_embedding <=> $1 AS fee_similarity_score
+            FROM form_filings f
+            WHERE f.form_id = cand.form_id
+            OFFSET 0  -- Keeps the form filter first, a filtered HNSW scan could miss the form's filings
+        ) filings
+        ORDER BY filings.fee_similarity_score
+        LIMIT 1
+    ) fee
     ),
     combined_results AS (
 -- Results from content chunks
@@ -66,7 +116,7 @@ SELECT
     rc.rank
 FROM ranked_chunks rc
     JOIN form_links fl ON rc.form_id = fl.form_id
-    LEFT JOIN closest_fees cf ON rc.form_id = cf.form_id AND cf.fee_rank = 1
+    LEFT JOIN closest_fees cf ON rc.form_id = cf.form_id
 WHERE rc.rank <= 3  -- Return top 3 chunks per form
 
 UNION ALL
@@ -88,7 +138,7 @@ SELECT
     cf.fee_similarity_score,
     1 AS rank
 FROM title_matches tm
-    LEFT JOIN closest_fees cf ON tm.form_id = cf.form_id AND cf.fee_rank = 1
+    LEFT JOIN closest_fees cf ON tm.form_id = cf.form_id
 WHERE tm.title_rank <= 5  -- Get top 5 title matches
   AND NOT EXISTS (
     SELECT 1 FROM ranked_chunks rc
@@ -97,4 +147,4 @@ WHERE tm.title_rank <= 5  -- Get top 5 title matches
     )
 SELECT * FROM combined_results
 ORDER BY combined_score, form_id, rank
-    LIMIT $2
\ No newline at end of file
+    LIMIT $2
@@ -1,23 +1,42 @@
-WITH description_matches AS (
+-- Nearest neighbours come first, from the nearest_* functions of vector_storage.py: they order by the
+-- HNSW-indexed expression with a LIMIT, and re-rank quantized candidates exactly.
+-- Thresholds and per-legislation ranking are then only computed for those candidates.
+-- $3 is the number of chunk candidates, half as many descriptions, set by the search profile
+-- together with an hnsw.ef_search covering it: an index scan returns no more rows than that.
+WITH description_candidates AS (
     SELECT
-        act,
-        code,
-        description,
-        link,
-        description_embedding <=> $1 AS description_similarity,
-        ROW_NUMBER() OVER (ORDER BY description_embedding <=> $1) AS description_rank
-    FROM legislation_html
-    WHERE description_embedding <=> $1 < 0.4  -- Description similarity threshold
+        l.act,
+        l.code,
+        l.description,
+        l.link,
+        n.distance AS description_similarity
+    FROM nearest_legislation_descriptions($1, $3::integer / 2) n
+        JOIN legislation_html l ON l.id = n.id
 ),
+     description_matches AS (
+         SELECT
+             dc.*,
+             ROW_NUMBER() OVER (ORDER BY dc.description_similarity) AS description_rank
+         FROM description_candidates dc
+         WHERE dc.description_similarity < 0.4  -- Description similarity threshold
+     ),
+     chunk_candidates AS (
+         SELECT
+             c.act,
+             c.code,
+             c.content_chunk,
+             c.section,
+             c.citation,
+             n.distance AS similarity_score
+         FROM nearest_legislation_chunks($1, $3::integer) n
+                  JOIN legislation_html_chunks c ON c.id = n.id
+     ),
      ranked_chunks AS (
          SELECT
-             act,
-             code,
-             content_chunk,
-             chunk_embedding <=> $1 AS similarity_score,
-             ROW_NUMBER() OVER (PARTITION BY act, code ORDER BY chunk_embedding <=> $1) AS rank
-         FROM legislation_html_chunks
-         WHERE chunk_embedding <=> $1 < 0.3  -- Content similarity threshold
+             cc.*,
+             ROW_NUMBER() OVER (PARTITION BY cc.act, cc.code ORDER BY cc.similarity_score) AS rank
+         FROM chunk_candidates cc
+         WHERE cc.similarity_score < 0.3  -- Content similarity threshold
      ),
      combined_results AS (
          -- Results from content chunks
@@ -26,6 +45,8 @@ WITH description_matches AS (
              rc.code,
              l.description,
              rc.content_chunk,
+             rc.section,
+             rc.citation,
              rc.similarity_score AS content_similarity,
              l.description_embedding <=> $1 AS description_similarity,
              CASE
@@ -50,6 +71,8 @@ WITH description_matches AS (
              dm.code,
              dm.description,
              NULL AS content_chunk,
+             NULL AS section,
+             NULL AS citation,
              1 AS content_similarity,  -- Default content similarity
              dm.description_similarity,
              dm.description_similarity AS combined_score,
@@ -65,4 +88,4 @@ WITH description_matches AS (
      )
 SELECT * FROM combined_results
 ORDER BY combined_score, act, code, rank
-LIMIT $2
\ No newline at end of file
+LIMIT $2
@@ -0,0 +1,163 @@
+from __future__ import annotations as _annotations
+
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+import asyncpg
+from asyncpg.prepared_stmt import PreparedStatement
+
+SQL_DIR = Path(__file__).parent / "sql"
+
+
+@dataclass
+class StatementStats:
+    calls: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def record(self, elapsed: float) -> None:
+        self.calls += 1
+        self.total_seconds += elapsed
+        self.max_seconds = max(self.max_seconds, elapsed)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "total_ms": round(self.total_seconds * 1000, 3),
+            "mean_ms": round(self.total_seconds * 1000 / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 3),
+        }
+
+
+async def apply_settings(conn: asyncpg.Connection, settings: Dict[str, str]) -> None:
+    """
+    SET LOCAL every setting in one round trip, they are reset when the surrounding transaction ends.
+    """
+    if not settings:
+        return
+    calls = ", ".join(f"set_config(${i}, ${i + 1}, true)" for i in range(1, 2 * len(settings), 2))
+    await conn.execute(f"SELECT {calls}", *(part for item in settings.items() for part in item))
+
+
+class CatalogConnection(asyncpg.Connection):
+    """
+    asyncpg connection that keeps the catalog statements prepared on it.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements: Dict[str, PreparedStatement] = {}
+
+
+class StatementCatalog:
+    """
+    Registry of the SQL files under rag/sql.
+
+    Files are read once by load(). Every query file is prepared on each pooled connection
+    through the pool init hook, so searches only bind parameters and execute.
+    Queries reading objects the schema does not have yet are prepared on first use instead.
+    Files ending in "-init.sql" are schema scripts and are only available through text().
+    """
+    def __init__(self, sql_dir: Path = SQL_DIR):
+        self.sql_dir = sql_dir
+        self._sources: Dict[str, str] = {}
+        self._stats: Dict[str, StatementStats] = {}
+        # Queries reported as not preparable on connect, reported once
+        self._deferred: Set[str] = set()
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self._sources)
+
+    def load(self) -> None:
+        """
+        Read every SQL file in the catalog directory, keyed by file name without extension.
+        """
+        self._sources = {
+            path.stem: path.read_text()
+            for path in sorted(self.sql_dir.glob("*.sql"))
+        }
+        self._stats = {name: StatementStats() for name in self.queries()}
+        print(f"Loaded {len(self._sources)} SQL files from {self.sql_dir}")
+
+    def text(self, name: str) -> str:
+        if not self.loaded:
+            self.load()
+        try:
+            return self._sources[name]
+        except KeyError:
+            raise KeyError(f"Unknown SQL statement: {name}") from None
+
+    def queries(self) -> List[str]:
+        return [name for name in self._sources if not name.endswith("-init")]
+
+    async def init_connection(self, conn: asyncpg.Connection) -> None:
+        """
+        Pool init hook: prepare every catalog query on a freshly opened connection.
+        """
+        if not self.loaded:
+            self.load()
+        if not isinstance(conn, CatalogConnection):
+            return
+        for name in self.queries():
+            try:
+                conn.statements[name] = await conn.prepare(self._sources[name])
+            except (asyncpg.UndefinedTableError, asyncpg.UndefinedFunctionError, asyncpg.UndefinedColumnError) as e:
+                # E.g. a database init_database has not upgraded yet, the connection must still open
+                if name not in self._deferred:
+                    self._deferred.add(name)
+                    print(f"Deferring statement {name} to its first use: {e}")
+
+    async def _statement(self, conn: asyncpg.Connection, name: str) -> PreparedStatement:
+        statements = getattr(conn, "statements", None)
+        if statements is None:
+            # Connection was not created through the catalog pool, prepare on demand.
+            return await conn.prepare(self.text(name))
+        statement = statements.get(name)
+        if statement is None:
+            statement = statements[name] = await conn.prepare(self.text(name))
+        return statement
+
+    async def fetch(self, conn: asyncpg.Connection, name: str, *args) -> List[asyncpg.Record]:
+        """
+        Run a prepared catalog query by name on the given connection.
+        """
+        statement = await self._statement(conn, name)
+        start = time.perf_counter()
+        try:
+            return await statement.fetch(*args)
+        finally:
+            self._stats.setdefault(name, StatementStats()).record(time.perf_counter() - start)
+
+    async def fetch_pooled(
+            self, pool: asyncpg.Pool, name: str, *args, settings: Optional[Dict[str, str]] = None
+    ) -> List[asyncpg.Record]:
+        """
+        Borrow a connection from the pool and run a prepared catalog query by name.
+        :param settings: Server settings for this query only, applied with SET LOCAL in a transaction around it.
+        """
+        async with pool.acquire() as conn:
+            if not settings:
+                return await self.fetch(conn, name, *args)
+            async with conn.transaction():
+                await apply_settings(conn, settings)
+                return await self.fetch(conn, name, *args)
+
+    async def explain(self, conn: asyncpg.Connection, name: str, *args, analyze: bool = False) -> List[str]:
+        """
+        Query plan of a catalog query for the given arguments, one line per plan node.
+        With analyze the query is run and the plan carries actual timings.
+        """
+        options = "ANALYZE, BUFFERS" if analyze else "COSTS"
+        rows = await conn.fetch(f"EXPLAIN ({options}) {self.text(name)}", *args)
+        return [row[0] for row in rows]
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Execution counts and timings for every catalog query.
+        """
+        return {name: stats.as_dict() for name, stats in self._stats.items()}
+
+
+catalog = StatementCatalog()
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import re
+import uuid
+
+import pytest
+
+import jobs
+import statements
+
+DATABASE_URL = os.environ.get("DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(DATABASE_URL is None, reason="DATABASE_URL not set, needs a local Postgres")
+
+
+def _queue_schema() -> str:
+    # The ingest_jobs table and its indexes from the init script, without the vector tables
+    init = statements.catalog.text("forms-db-init")
+    table = re.search(r"CREATE TABLE IF NOT EXISTS ingest_jobs\b.*?\n\);", init, re.S).group(0)
+    indexes = re.findall(r"^CREATE INDEX IF NOT EXISTS \w+ ON ingest_jobs\b.*?;$", init, re.M)
+    return "\n".join([table, *indexes])
+
+
+async def _with_workers(test, workers: int = 2):
+    """
+    Run test with one pool per worker, all on a schema of their own that is dropped afterwards.
+    """
+    import asyncpg
+
+    schema = f"test_jobs_{uuid.uuid4().hex[:8]}"
+    admin = await asyncpg.connect(DATABASE_URL)
+    await admin.execute(f"CREATE SCHEMA {schema}")
+    pools = []
+    try:
+        for _ in range(workers):
+            pools.append(await asyncpg.create_pool(
+                DATABASE_URL, min_size=1, max_size=2, server_settings={"search_path": schema}
+            ))
+        await pools[0].execute(_queue_schema())
+        await test(*pools)
+    finally:
+        for pool in pools:
+            await pool.close()
+        await admin.execute(f"DROP SCHEMA {schema} CASCADE")
+        await admin.close()
+
+
+def test_workers_claim_disjoint_jobs_and_complete_them():
+    async def test(pool_a, pool_b):
+        await jobs.enqueue(pool_a, [("forms", f"form-{i}/metadata.json") for i in range(6)])
+        claimed_a, claimed_b = await asyncio.gather(
+            jobs.claim(pool_a, "worker-a", 3, lease_seconds=60),
+            jobs.claim(pool_b, "worker-b", 3, lease_seconds=60),
+        )
+        assert len(claimed_a) == len(claimed_b) == 3
+        assert not {job.id for job in claimed_a} & {job.id for job in claimed_b}
+        # A worker cannot settle a job leased to another one
+        assert not await jobs.complete(pool_a, claimed_b[0], "worker-a")
+        assert not await jobs.fail(pool_a, claimed_b[0], "worker-a", "not mine")
+        for job in claimed_a:
+            assert await jobs.complete(pool_a, job, "worker-a")
+        for job in claimed_b:
+            assert await jobs.complete(pool_b, job, "worker-b")
+        assert await jobs.counts(pool_a) == {"done": 6}
+
+    asyncio.run(_with_workers(test))
+
+
+def test_expired_lease_moves_the_job_to_another_worker():
+    async def test(pool_a, pool_b):
+        await jobs.enqueue(pool_a, [("legislation", "INA 348/metadata.json")])
+        [job_a] = await jobs.claim(pool_a, "worker-a", 1, lease_seconds=0.2)
+        assert await jobs.claim(pool_b, "worker-b", 1, lease_seconds=60) == []
+        await asyncio.sleep(0.5)
+        [job_b] = await jobs.claim(pool_b, "worker-b", 1, lease_seconds=60)
+        assert job_b.id == job_a.id
+        assert job_b.attempts == 2
+        # The worker whose lease expired must not touch the job any more
+        assert not await jobs.fail(pool_a, job_a, "worker-a", "late failure", retry_delay=0)
+        assert not await jobs.complete(pool_a, job_a, "worker-a")
+        assert await jobs.counts(pool_a) == {"running": 1}
+        assert await jobs.complete(pool_b, job_b, "worker-b")
+        assert await jobs.counts(pool_b) == {"done": 1}
+
+    asyncio.run(_with_workers(test))
+
+
+def test_failed_job_is_retried_until_it_runs_out_of_attempts():
+    async def test(pool_a, pool_b):
+        await jobs.enqueue(pool_a, [("forms", "i-765/metadata.json")], max_attempts=2)
+        [job] = await jobs.claim(pool_a, "worker-a", 1, lease_seconds=60)
+        assert await jobs.fail(pool_a, job, "worker-a", "parse error", retry_delay=0)
+        [job] = await jobs.claim(pool_b, "worker-b", 1, lease_seconds=60)
+        assert job.attempts == 2
+        assert await jobs.fail(pool_b, job, "worker-b", "parse error", retry_delay=0)
+        assert await jobs.counts(pool_a) == {"failed": 1}
+        assert await jobs.claim(pool_a, "worker-a", 1, lease_seconds=60) == []
+
+    asyncio.run(_with_workers(test))
@@ -0,0 +1,28 @@
+from pathlib import Path
+
+import pytest
+
+import usc
+
+LEGISLATION_DIR = Path(__file__).resolve().parent.parent / "uscis-crawler" / "documents" / "legislation"
+PAGES = sorted(LEGISLATION_DIR.rglob("*.xhtml"))
+
+
+@pytest.mark.skipif(not PAGES, reason="no crawled legislation pages")
+@pytest.mark.parametrize("path", PAGES, ids=lambda path: path.name)
+def test_every_section_is_chunked(path):
+    sections = []
+    list(usc.iter_usc_blocks(path, sections))
+    chunks = usc.chunk_usc(path)
+    assert sections
+    assert usc.missing_sections(sections, chunks) == []
+
+
+def test_repealed_section_is_chunked():
+    path = LEGISLATION_DIR / "INA 348" / "INA 348-8 U.S.C. 1459.xhtml"
+    if not path.exists():
+        pytest.skip("no crawled legislation pages")
+    chunks = usc.chunk_usc(path)
+    assert chunks
+    assert {chunk.field for chunk in chunks} <= {"repealedhead", "repealsummary"}
+    assert chunks[0].citation == "8 U.S.C. 1459"
@@ -0,0 +1,110 @@
+from __future__ import annotations as _annotations
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+DEFAULT_TEXT_CACHE_DIR = Path(__file__).parent / ".cache" / "text"
+
+# Bump when the extraction or normalization changes, so stale entries are ignored
+EXTRACTOR_VERSION = 1
+
+
+def file_digest(path: str | Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def content_digest(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def corpus_digest(paths: Iterable[str | Path]) -> str:
+    """
+    Digest of the set of contents of files, the same whatever their paths or order.
+    """
+    return content_digest("\n".join(sorted({file_digest(path) for path in paths})))
+
+
+def normalize_page(text: str) -> str:
+    return " ".join(text.split())
+
+
+class TextCache:
+    """
+    On-disk cache of extracted text, one gzip-compressed JSON list of pages per source file.
+
+    Entries are keyed by the SHA-256 of the source content and the extractor that produced them,
+    so re-chunking an unchanged file never has to parse it again.
+    Entries hold any JSON value, usually the pages of a file.
+    Writes go through a temporary file and an atomic rename, several processes can share a cache.
+    """
+    def __init__(self, root: str | Path = DEFAULT_TEXT_CACHE_DIR):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _path(self, digest: str, kind: str) -> Path:
+        return self.root / digest[:2] / f"{digest}-{kind}-v{EXTRACTOR_VERSION}.json.gz"
+
+    def load(self, digest: str, kind: str) -> Optional[Any]:
+        try:
+            with gzip.open(self._path(digest, kind), "rt", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, json.JSONDecodeError) as e:
+            print(f"Ignoring corrupt text cache entry {digest}-{kind}: {e}")
+            return None
+
+    def store(self, digest: str, kind: str, pages: Any) -> None:
+        path = self._path(digest, kind)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                f.write(json.dumps(pages, ensure_ascii=False).encode("utf-8"))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def read_through(self, digest: str, kind: str, extract: Callable[[], Iterable[str]]) -> Iterator[str]:
+        """
+        Yield the normalized pages of a source, from the cache when present,
+        otherwise from extract(), storing them once extraction completes.
+        """
+        pages = self.load(digest, kind)
+        if pages is not None:
+            self.hits += 1
+            yield from pages
+            return
+
+        self.misses += 1
+        pages = []
+        for page in extract():
+            page = normalize_page(page)
+            pages.append(page)
+            yield page
+        self.store(digest, kind, pages)
+
+
+# Cache used by the loaders in extract, None disables caching
+_default: Optional[TextCache] = None
+
+
+def set_default(cache: Optional[TextCache]) -> None:
+    global _default
+    _default = cache
+
+
+def get_default() -> Optional[TextCache]:
+    return _default
@@ -0,0 +1,183 @@
+from __future__ import annotations as _annotations
+
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from lxml import etree
+
+import chunking
+from chunking import TokenCounter
+
+# Top-level fields of a uscode.house.gov section page, delimited by <!-- field-start:... --> comments.
+# A repealed section has only its repealedhead and repealsummary
+FIELDS = ("statute", "sourcecredit", "notes", "repealedhead", "repealsummary")
+
+# Elements holding text, read whole once they end
+_BLOCK_CLASSES = ("statutory-body", "note-body", "source-credit", "section-head", "subsection-head",
+                  "paragraph-head", "subparagraph-head", "clause-head", "subclause-head", "subsubclause-head",
+                  "note-head", "note-sub-head")
+
+# Containers that can be freed once they end, inline elements are freed with their block
+_FREE_TAGS = ("p", "h3", "h4", "div", "form", "script", "select", "head")
+
+_ANCHOR_PREFIX = "substructure-location_"
+_SECTION_HEAD = re.compile(r"^§\s*([\w.\-–]+?)\.?\s+(.*)$")
+_EXPCITE_TITLE = re.compile(r"^expcite:\s*TITLE\s+(\w+)", re.IGNORECASE)
+
+
+@dataclass
+class UscBlock:
+    """
+    One heading or paragraph of a section, with where it sits in the Code.
+    """
+    text: str
+    title: Optional[str]
+    section: Optional[str]
+    # Subsection path, e.g. ("a", "1") for (a)(1)
+    location: Tuple[str, ...]
+    field: str
+    # Heading of the enclosing subsection or note
+    heading: Optional[str]
+
+    @property
+    def citation(self) -> str:
+        cite = f"{self.title or '?'} U.S.C. {self.section or '?'}"
+        if self.field == "notes":
+            return f"{cite} note"
+        return cite + "".join(f"({part})" for part in self.location)
+
+
+@dataclass
+class UscChunk:
+    content: str
+    section: Optional[str]
+    citation: str
+    field: str
+    heading: Optional[str]
+
+
+def _text(element) -> str:
+    return " ".join("".join(element.itertext()).split())
+
+
+def _free(element) -> None:
+    """Drop an element's content and everything before it, so the tree never grows."""
+    element.clear(keep_tail=True)
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def iter_usc_blocks(path: str | Path, sections: Optional[List[Optional[str]]] = None) -> Iterator[UscBlock]:
+    """
+    Stream the headings and paragraphs of a U.S. Code section page.
+    Page chrome outside the FIELDS is skipped, elements are freed as soon as they are read.
+    :param sections: Appended with every section the page's itempath comments announce.
+    """
+    title: Optional[str] = None
+    section: Optional[str] = None
+    location: Tuple[str, ...] = ()
+    field: Optional[str] = None
+    heading: Optional[str] = None
+
+    for event, element in etree.iterparse(str(path), events=("end", "comment"), html=True, recover=True, huge_tree=True):
+        if event == "comment":
+            comment = (element.text or "").strip()
+            if comment.startswith("itempath:"):
+                # e.g. itempath:/080/CHAPTER 12/SUBCHAPTER II/Part VIII/Sec. 1323
+                parts = comment[len("itempath:"):].strip("/ ").split("/")
+                section = parts[-1][len("Sec. "):].strip() if parts[-1].startswith("Sec. ") else None
+                location, heading = (), None
+                if sections is not None:
+                    sections.append(section)
+            elif _EXPCITE_TITLE.match(comment):
+                # e.g. expcite:TITLE 8-ALIENS AND NATIONALITY!@!...
+                title = _EXPCITE_TITLE.match(comment).group(1)
+            elif comment.startswith("field-start:") and comment[len("field-start:"):].strip() in FIELDS:
+                field = comment[len("field-start:"):].strip()
+                location, heading = (), None
+            elif comment.startswith("field-end:") and comment[len("field-end:"):].strip() == field:
+                field = None
+            continue
+
+        tag = element.tag
+        if tag == "a":
+            name = element.get("name") or ""
+            if name.startswith(_ANCHOR_PREFIX):
+                location = tuple(name[len(_ANCHOR_PREFIX):].split("_"))
+            continue
+
+        css = element.get("class") or ""
+        if css.startswith(_BLOCK_CLASSES):
+            text = _text(element)
+            if css == "section-head":
+                match = _SECTION_HEAD.match(text)
+                if match:
+                    section = section or match.group(1)
+                    heading = match.group(2)
+            elif css.endswith("-head"):
+                heading = text
+            if text and field is not None:
+                yield UscBlock(text, title, section, location, field, heading)
+
+        if tag in _FREE_TAGS:
+            _free(element)
+
+
+def chunk_usc(
+        path: str | Path,
+        chunk_size: int = 512,
+        overlap: int = 0,
+        counter: Optional[TokenCounter] = None,
+) -> List[UscChunk]:
+    """
+    Chunk a U.S. Code section page along its structure: a chunk never spans two top-level subsections,
+    two notes or two fields, and carries the citation of the paragraphs it covers.
+    """
+    if counter is None:
+        counter = TokenCounter()
+    budget = counter.budget(chunk_size)
+
+    chunks: List[UscChunk] = []
+    unit: List[UscBlock] = []
+
+    def flush():
+        if not unit:
+            return
+        words = ((word, index) for index, block in enumerate(unit) for word in chunking.iter_words((block.text,)))
+        for content, first, last in chunking.chunk_tagged_words(words, budget, overlap, counter):
+            start, end = unit[first], unit[last]
+            # Cite the deepest subsection containing every paragraph of the chunk
+            common = 0
+            while common < min(len(start.location), len(end.location)) and start.location[common] == end.location[common]:
+                common += 1
+            block = UscBlock(content, start.title, start.section, start.location[:common], start.field, start.heading)
+            chunks.append(UscChunk(content, start.section, block.citation, start.field, start.heading))
+        unit.clear()
+
+    def unit_key(block: UscBlock):
+        if block.field == "statute":
+            return block.section, block.field, block.location[:1]
+        return block.section, block.field, block.heading
+
+    sections: List[Optional[str]] = []
+    for block in iter_usc_blocks(path, sections):
+        if unit and unit_key(unit[-1]) != unit_key(block):
+            flush()
+        unit.append(block)
+    flush()
+    missing = missing_sections(sections, chunks)
+    if missing:
+        print(f"No text found for sections {missing} of {path}, their fields are not in usc.FIELDS")
+    return chunks
+
+
+def missing_sections(sections: List[Optional[str]], chunks: List[UscChunk]) -> List[Optional[str]]:
+    """
+    Sections a page announces that none of its chunks cover.
+    """
+    chunked = {chunk.section for chunk in chunks}
+    return [section for section in sections if section not in chunked]
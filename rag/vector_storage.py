@@ -0,0 +1,484 @@
+from __future__ import annotations as _annotations
+
+import json
+import math
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import asyncpg
+import numpy as np
+
+import indexes
+
+# How a table's embeddings are indexed:
+# vector  - full-precision float32 graph, searched exactly as stored
+# halfvec - graph over a float16 cast of the embeddings, half the size
+# binary  - graph over one bit per dimension, 1/32 of the size, recall relies on the re-rank
+# ivfflat - full-precision IVFFlat lists, much faster to build than a graph, recall depends on ivfflat.probes
+STORAGE_MODES = ("vector", "halfvec", "binary", "ivfflat")
+
+# Schema profile for batch jobs that rebuild often: IVFFlat on the chunk tables, the small tables keep HNSW
+IVFFLAT_PROFILE = {
+    "form_pdf_chunks": "ivfflat",
+    "form_html_chunks": "ivfflat",
+    "legislation_html_chunks": "ivfflat",
+}
+
+DIMENSIONS = 384
+
+# Candidates the quantized first pass fetches per result, re-ranked against the full-precision vectors
+DEFAULT_RERANK_FACTOR = 4
+
+
+@dataclass(frozen=True)
+class VectorColumn:
+    table: str
+    column: str
+    # Name of the full-precision index, the quantized ones get the mode appended
+    index: str
+    # nearest_* function searches go through, None for columns only compared row by row
+    function: Optional[str] = None
+
+    def index_name(self, mode: str) -> str:
+        return self.index if mode == "vector" else f"{self.index}_{mode}"
+
+    @staticmethod
+    def method(mode: str) -> str:
+        return "ivfflat" if mode == "ivfflat" else "hnsw"
+
+    def index_expression(self, mode: str) -> str:
+        if mode == "halfvec":
+            return f"(({self.column}::halfvec({DIMENSIONS})) halfvec_cosine_ops)"
+        if mode == "binary":
+            return f"((binary_quantize({self.column})::bit({DIMENSIONS})) bit_hamming_ops)"
+        return f"({self.column} vector_cosine_ops)"
+
+    def index_definition(self, mode: str) -> indexes.IndexDefinition:
+        name, method = self.index_name(mode), self.method(mode)
+        return indexes.IndexDefinition(
+            name, self.table, method, f"CREATE INDEX {name} ON {self.table} USING {method} {self.index_expression(mode)}"
+        )
+
+    def nearest_query(self, mode: str, query: str = "$1", k: str = "$2", rerank_factor: int = DEFAULT_RERANK_FACTOR) -> str:
+        """
+        SELECT of the ids and cosine distances of the k rows nearest to query, through the index of mode.
+        Quantized modes over-fetch k * rerank_factor candidates from their index and re-rank them exactly.
+        """
+        exact = f"{self.column} <=> {query}"
+        if mode in ("vector", "ivfflat"):
+            return f"SELECT id, {exact} AS distance FROM {self.table} ORDER BY {exact} LIMIT {k}"
+        if mode == "halfvec":
+            approximate = f"{self.column}::halfvec({DIMENSIONS}) <=> {query}::halfvec({DIMENSIONS})"
+        else:
+            approximate = f"binary_quantize({self.column})::bit({DIMENSIONS}) <~> binary_quantize({query})"
+        return (
+            f"SELECT c.id, c.{exact} AS distance "
+            f"FROM (SELECT id, {self.column} FROM {self.table} ORDER BY {approximate} LIMIT {k} * {rerank_factor}) c "
+            f"ORDER BY distance LIMIT {k}"
+        )
+
+    def function_statement(self, mode: str, rerank_factor: int = DEFAULT_RERANK_FACTOR) -> str:
+        # A single-SELECT STABLE SQL function is inlined into the calling search, so the index is still used
+        return (
+            f"CREATE OR REPLACE FUNCTION {self.function}(query vector, k integer) "
+            f"RETURNS TABLE (id integer, distance double precision) LANGUAGE sql STABLE AS $$ "
+            f"{self.nearest_query(mode, 'query', 'k', rerank_factor)} $$"
+        )
+
+
+# Every embedding column of the schema in forms-db-init.sql
+COLUMNS = (
+    VectorColumn("form_pdfs", "title_embedding", "idx_form_pdf_title_embedding", "nearest_form_pdf_titles"),
+    VectorColumn("form_pdfs", "description_embedding", "idx_form_pdf_description_embedding"),
+    VectorColumn("form_pdf_chunks", "chunk_embedding", "idx_form_pdf_chunks_chunk_embedding", "nearest_form_pdf_chunks"),
+    VectorColumn("form_filings", "category_embedding", "idx_form_filings_embedding"),
+    VectorColumn("form_html_chunks", "chunk_embedding", "idx_form_html_chunks_chunk_embedding", "nearest_form_html_chunks"),
+    VectorColumn(
+        "legislation_html", "description_embedding", "idx_legislation_html_description_embedding",
+        "nearest_legislation_descriptions",
+    ),
+    VectorColumn(
+        "legislation_html_chunks", "chunk_embedding", "idx_legislation_html_chunks_chunk_embedding",
+        "nearest_legislation_chunks",
+    ),
+)
+
+
+def table_modes(storage: Optional[Dict[str, str]]) -> Dict[str, str]:
+    """
+    Storage mode of every table with embeddings, tables missing from storage stay full precision.
+    """
+    storage = storage or {}
+    tables = {column.table for column in COLUMNS}
+    for table, mode in storage.items():
+        if table not in tables:
+            raise ValueError(f"Unknown vector table {table}, expected one of {sorted(tables)}")
+        if mode not in STORAGE_MODES:
+            raise ValueError(f"Unknown vector storage mode {mode} for {table}, expected one of {STORAGE_MODES}")
+    return {table: storage.get(table, "vector") for table in sorted(tables)}
+
+
+def index_names(storage: Optional[Dict[str, str]]) -> List[str]:
+    """
+    Names of the indexes apply gives the embedding columns, HNSW or IVFFlat according to storage.
+    """
+    modes = table_modes(storage)
+    return [column.index_name(modes[column.table]) for column in COLUMNS]
+
+
+# Nearest rows the search statements take per chunk table without a profile, half as many titles and descriptions.
+# Within the default hnsw.ef_search of 40, an HNSW scan returns no more rows than that.
+DEFAULT_CANDIDATES = 40
+
+
+@dataclass(frozen=True)
+class SearchProfile:
+    # Nearest rows the search statements take per chunk table, half as many titles and descriptions
+    candidates: int
+    # HNSW candidate list each graph scan keeps, at least candidates
+    ef_search: int
+
+
+# Recall / latency trade-offs a search can pick
+SEARCH_PROFILES: Dict[str, SearchProfile] = {
+    "fast": SearchProfile(candidates=20, ef_search=20),
+    "balanced": SearchProfile(candidates=40, ef_search=100),
+    "exhaustive": SearchProfile(candidates=100, ef_search=400),
+}
+
+
+def search_profile(profile: Optional[str]) -> Optional[SearchProfile]:
+    if profile is None:
+        return None
+    if profile not in SEARCH_PROFILES:
+        raise ValueError(f"Unknown search profile {profile}, expected one of {list(SEARCH_PROFILES)}")
+    return SEARCH_PROFILES[profile]
+
+
+def search_candidates(profile: Optional[str]) -> int:
+    """
+    Candidates the search statements take under a profile, passed to them as a parameter.
+    """
+    chosen = search_profile(profile)
+    return chosen.candidates if chosen is not None else DEFAULT_CANDIDATES
+
+
+def search_settings(
+        storage: Optional[Dict[str, str]],
+        rerank_factor: int = DEFAULT_RERANK_FACTOR,
+        profile: Optional[str] = None,
+        tuning: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Dict[str, str]:
+    """
+    Settings for a search transaction: the hnsw.ef_search of the search profile, the server default without one,
+    raised as far as quantized first passes need: an HNSW scan returns at most hnsw.ef_search rows,
+    which has to cover the candidates * rerank_factor rows they over-fetch.
+    IVFFlat tables scan the tuned ivfflat.probes, the most any of them needs as the setting is shared.
+    """
+    chosen = search_profile(profile)
+    candidates = search_candidates(profile)
+    settings = {"hnsw.ef_search": chosen.ef_search} if chosen is not None else {}
+    modes = table_modes(storage)
+    if any(modes[column.table] in ("halfvec", "binary") for column in COLUMNS if column.function is not None):
+        settings["hnsw.ef_search"] = max(settings.get("hnsw.ef_search", 0), candidates * rerank_factor)
+    probes = [
+        tuning[table]["probes"]
+        for table, mode in modes.items()
+        if mode == "ivfflat" and table in (tuning or {}) and "probes" in tuning[table]
+    ]
+    if probes:
+        settings["ivfflat.probes"] = max(probes)
+    return {setting: str(value) for setting, value in settings.items()}
+
+
+async def _existing_indexes(conn: asyncpg.Connection) -> Dict[str, str]:
+    """
+    Definitions of the vector indexes of every method, by name.
+    """
+    existing = {}
+    for method in indexes.VECTOR_METHODS:
+        existing.update({index.name: index.definition for index in await indexes.vector_indexes(conn, method)})
+    return existing
+
+
+async def suggested_lists(conn: asyncpg.Connection, table: str) -> int:
+    """
+    pgvector's starting point for IVFFlat lists: rows / 1000 up to a million rows, sqrt(rows) beyond,
+    from the row estimate of the table's last ANALYZE sample.
+    """
+    rows = await conn.fetchval("SELECT reltuples::bigint FROM pg_class WHERE oid = $1::regclass", table)
+    if rows is None or rows < 0:
+        # Never analyzed
+        rows = await conn.fetchval(f"SELECT count(*) FROM {table}")
+    return max(1, rows // 1000) if rows <= 1_000_000 else int(math.sqrt(rows))
+
+
+async def ivfflat_lists(conn: asyncpg.Connection, table: str, tuning: Optional[Dict[str, Dict[str, Any]]] = None) -> int:
+    """
+    Lists of a table's IVFFlat index: the tuned ones, suggested_lists for an untuned table.
+    """
+    return (tuning or {}).get(table, {}).get("lists") or await suggested_lists(conn, table)
+
+
+async def apply(
+        conn: asyncpg.Connection,
+        storage: Optional[Dict[str, str]] = None,
+        rerank_factor: int = DEFAULT_RERANK_FACTOR,
+        options: Optional[Dict[str, int]] = None,
+        maintenance_work_mem: Optional[str] = None,
+        parallel_workers: Optional[int] = None,
+        tuning: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Dict[str, float]:
+    """
+    Give every embedding column the index of its table's storage mode, drop the indexes of the other modes,
+    and point the nearest_* search functions at the new indexes. Indexes that already exist are kept,
+    unless an IVFFlat index has a different number of lists than tuning asks for.
+    :param storage: Table -> storage mode, see STORAGE_MODES.
+    :param options: HNSW storage parameters, see indexes.build.
+    :param tuning: Table -> tuned IVFFlat parameters, see tune. Untuned tables get suggested_lists.
+    :return: Seconds spent building each new index, by name.
+    """
+    modes = table_modes(storage)
+    tuning = tuning or {}
+    existing = await _existing_indexes(conn)
+    timings = {}
+    for column in COLUMNS:
+        mode = modes[column.table]
+        definition = column.index_definition(mode)
+        build_options = options
+        if mode == "ivfflat":
+            lists = await ivfflat_lists(conn, column.table, tuning)
+            build_options = {"lists": lists}
+            if definition.name in existing and f"lists='{lists}'" not in existing[definition.name]:
+                await indexes.drop(conn, [definition])
+                del existing[definition.name]
+        if definition.name not in existing:
+            timings.update(await indexes.build(conn, [definition], build_options, maintenance_work_mem, parallel_workers))
+        stale = [
+            indexes.IndexDefinition(column.index_name(other), column.table, column.method(other), "")
+            for other in STORAGE_MODES
+            if other != mode and column.index_name(other) in existing
+        ]
+        await indexes.drop(conn, stale)
+        if column.function is not None:
+            await conn.execute(column.function_statement(mode, rerank_factor))
+    print(f"Vector storage: {modes}")
+    return timings
+
+
+async def benchmark(
+        conn: asyncpg.Connection,
+        table: str,
+        modes: Tuple[str, ...] = ("vector", "halfvec", "binary"),
+        queries: int = 50,
+        k: int = 10,
+        rerank_factor: int = DEFAULT_RERANK_FACTOR,
+        options: Optional[Dict[str, int]] = None,
+) -> Dict[str, Dict[str, float]]:
+    """
+    Compare storage modes on a table: recall@k against an exact scan, index size and p95 latency,
+    with stored embeddings sampled from the table as queries. Missing indexes are built for the run and dropped after.
+    Each mode orders by its own expression, so only that mode's index can serve its queries.
+    """
+    column = _searched_column(table)
+    samples = await _sample_embeddings(conn, column, queries)
+    async with conn.transaction():
+        truth = await _exact_neighbours(conn, column, samples, k)
+
+    existing = set(await _existing_indexes(conn))
+    results = {}
+    for mode in modes:
+        definition = column.index_definition(mode)
+        built = definition.name not in existing
+        if built:
+            await indexes.build(conn, [definition], options)
+        try:
+            size = await conn.fetchval("SELECT pg_relation_size($1::regclass)", definition.name)
+            statement = await conn.prepare(column.nearest_query(mode, rerank_factor=rerank_factor))
+            latencies, recalls = [], []
+            for (sample_id, sample), expected in zip(samples, truth):
+                async with conn.transaction():
+                    await conn.execute(f"SET LOCAL hnsw.ef_search = {max(40, (k + 1) * rerank_factor)}")
+                    start = time.perf_counter()
+                    rows = await statement.fetch(sample, k + 1)
+                    latencies.append(time.perf_counter() - start)
+                recalls.append(_recall(expected, _neighbours(rows, sample_id, k)))
+            results[mode] = {
+                "recall": round(float(np.mean(recalls)), 4),
+                "index_mb": round(size / 2 ** 20, 2),
+                "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3),
+            }
+            print(f"{table} {mode}: {results[mode]}")
+        finally:
+            if built:
+                await indexes.drop(conn, [definition])
+    return results
+
+
+def _searched_column(table: str) -> VectorColumn:
+    return next(column for column in COLUMNS if column.table == table and column.function is not None)
+
+
+async def _sample_embeddings(
+        conn: asyncpg.Connection, column: VectorColumn, queries: int
+) -> List[Tuple[int, np.ndarray]]:
+    """
+    (id, embedding) of random rows of a column's table, used as queries.
+    """
+    rows = await conn.fetch(f"SELECT id, {column.column} FROM {column.table} ORDER BY random() LIMIT $1", queries)
+    return [(row[0], row[1]) for row in rows]
+
+
+def _neighbours(rows: List[asyncpg.Record], sample_id: int, k: int) -> set:
+    # A sampled row is its own nearest neighbour, counting it would inflate recall
+    return set([row["id"] for row in rows if row["id"] != sample_id][:k])
+
+
+def _recall(expected: set, found: set) -> float:
+    return len(expected & found) / max(1, len(expected))
+
+
+async def _exact_neighbours(
+        conn: asyncpg.Connection, column: VectorColumn, samples: List[Tuple[int, np.ndarray]], k: int
+) -> List[set]:
+    """
+    Ids of the true k nearest rows of every sample, other than the sample itself, from a scan without indexes.
+    Run inside a transaction.
+    """
+    await conn.execute("SET LOCAL enable_indexscan = off")
+    truth = []
+    for sample_id, sample in samples:
+        rows = await conn.fetch(column.nearest_query("vector"), sample, k + 1)
+        truth.append(_neighbours(rows, sample_id, k))
+    await conn.execute("SET LOCAL enable_indexscan = on")
+    return truth
+
+
+def load_tuning(path: Optional[str | Path]) -> Dict[str, Dict[str, Any]]:
+    """
+    Tuned IVFFlat parameters by table, as written by tune, or nothing when the file does not exist.
+    """
+    if path is None or not Path(path).exists():
+        return {}
+    with open(path, "r") as f:
+        return dict(json.load(f))
+
+
+def save_tuning(path: str | Path, tuning: Dict[str, Dict[str, Any]]) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(tuning, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+async def tune_ivfflat(
+        conn: asyncpg.Connection,
+        table: str,
+        target_recall: float = 0.95,
+        k: int = 10,
+        queries: int = 50,
+) -> Dict[str, Any]:
+    """
+    Pick lists for a table from its sampled row count, then the fewest ivfflat.probes, doubling from 1,
+    whose recall@k against an exact scan reaches target_recall.
+    The queries are stored embeddings of the table, each one's own row is left out of both result sets.
+    Everything happens in a transaction that is rolled back: the other indexes of the column are dropped in it
+    so only IVFFlat can answer, searches and writes on the table wait until tuning ends.
+    """
+    column = _searched_column(table)
+    await conn.execute(f"ANALYZE {table}")
+    lists = await suggested_lists(conn, table)
+    samples = await _sample_embeddings(conn, column, queries)
+    definition = column.index_definition("ivfflat")
+
+    transaction = conn.transaction()
+    await transaction.start()
+    try:
+        truth = await _exact_neighbours(conn, column, samples, k)
+        existing = await _existing_indexes(conn)
+        await indexes.drop(conn, [
+            indexes.IndexDefinition(column.index_name(mode), table, column.method(mode), "")
+            for mode in STORAGE_MODES
+            if column.index_name(mode) in existing
+        ])
+        build_seconds = (await indexes.build(conn, [definition], {"lists": lists}))[definition.name]
+        statement = await conn.prepare(column.nearest_query("ivfflat"))
+        probes, recall, latencies = 1, 0.0, []
+        while True:
+            await conn.execute(f"SET LOCAL ivfflat.probes = {probes}")
+            recalls, latencies = [], []
+            for (sample_id, sample), expected in zip(samples, truth):
+                start = time.perf_counter()
+                rows = await statement.fetch(sample, k + 1)
+                latencies.append(time.perf_counter() - start)
+                recalls.append(_recall(expected, _neighbours(rows, sample_id, k)))
+            recall = float(np.mean(recalls))
+            print(f"{table} ivfflat lists={lists} probes={probes}: recall@{k} {recall:.4f}")
+            if recall >= target_recall or probes >= lists:
+                break
+            probes = min(lists, probes * 2)
+    finally:
+        await transaction.rollback()
+    return {
+        "lists": lists,
+        "probes": probes,
+        "recall": round(recall, 4),
+        "target_recall": target_recall,
+        "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3),
+        "build_seconds": round(build_seconds, 3),
+    }
+
+
+async def tune(
+        conn: asyncpg.Connection,
+        path: str | Path,
+        tables: Tuple[str, ...] = tuple(IVFFLAT_PROFILE),
+        target_recall: float = 0.95,
+        k: int = 10,
+        queries: int = 50,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Tune IVFFlat on tables and merge the results into the tuning file at path, which RAGAgent reads at startup.
+    """
+    tuning = load_tuning(path)
+    for table in tables:
+        tuning[table] = await tune_ivfflat(conn, table, target_recall, k, queries)
+    save_tuning(path, tuning)
+    print(f"Wrote IVFFlat tuning for {len(tables)} tables to {path}")
+    return tuning
+
+
+async def _main(
+        dsn: str = "postgresql://@localhost:5432", database: str = "maia", tuning_path: Optional[str] = None
+) -> None:
+    import vectors
+
+    conn = await asyncpg.connect(dsn, database=database)
+    try:
+        await vectors.register_vector_codecs(conn)
+        if tuning_path is not None:
+            await tune(conn, tuning_path)
+            return
+        for column in COLUMNS:
+            if column.function is not None:
+                await benchmark(conn, column.table)
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    import asyncio
+    import sys
+
+    # python vector_storage.py benchmarks the storage modes, python vector_storage.py <tuning.json> tunes IVFFlat
+    asyncio.run(_main(tuning_path=sys.argv[1] if len(sys.argv) > 1 else None))
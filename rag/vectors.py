@@ -0,0 +1,96 @@
+from __future__ import annotations as _annotations
+
+import struct
+
+import asyncpg
+import numpy as np
+
+# pgvector binary wire format: int16 dimensions, int16 unused, then the elements in network byte order.
+_HEADER = struct.Struct("!hh")
+_VECTOR_DTYPE = np.dtype(">f4")
+_HALFVEC_DTYPE = np.dtype(">f2")
+
+
+def _encode(value, dtype: np.dtype) -> bytes:
+    array = np.asarray(value, dtype=dtype)
+    if array.ndim != 1:
+        raise ValueError(f"expected a 1-D embedding, got shape {array.shape}")
+    return _HEADER.pack(array.shape[0], 0) + array.tobytes()
+
+
+def _decode(data: bytes, dtype: np.dtype) -> np.ndarray:
+    dim, _ = _HEADER.unpack_from(data)
+    return np.frombuffer(data, dtype=dtype, count=dim, offset=_HEADER.size).astype(np.float32)
+
+
+def encode_vector(value) -> bytes:
+    """
+    Encode a float32 array (or any sequence of floats) as a pgvector `vector`.
+    """
+    return _encode(value, _VECTOR_DTYPE)
+
+
+def decode_vector(data: bytes) -> np.ndarray:
+    """
+    Decode a pgvector `vector` into a float32 numpy array.
+    """
+    return _decode(data, _VECTOR_DTYPE)
+
+
+def encode_halfvec(value) -> bytes:
+    """
+    Encode a float array as a pgvector `halfvec`.
+    """
+    return _encode(value, _HALFVEC_DTYPE)
+
+
+def decode_halfvec(data: bytes) -> np.ndarray:
+    """
+    Decode a pgvector `halfvec` into a float32 numpy array.
+    """
+    return _decode(data, _HALFVEC_DTYPE)
+
+
+async def register_vector_codecs(conn: asyncpg.Connection) -> None:
+    """
+    Register binary codecs for the pgvector types on a connection, so numpy arrays
+    can be passed as query arguments and vector columns come back as numpy arrays.
+    `halfvec` is skipped on pgvector versions that do not provide it.
+    """
+    await conn.set_type_codec(
+        "vector", schema="public", encoder=encode_vector, decoder=decode_vector, format="binary"
+    )
+    try:
+        await conn.set_type_codec(
+            "halfvec", schema="public", encoder=encode_halfvec, decoder=decode_halfvec, format="binary"
+        )
+    except ValueError:
+        pass
+
+
+def benchmark(dimensions: int = 384, iterations: int = 20000) -> None:
+    """
+    Compare the old JSON text round trip with the binary codec for a single embedding.
+    """
+    import timeit
+
+    import pydantic_core
+
+    embedding = np.random.default_rng(0).random(dimensions, dtype=np.float32)
+    as_json = pydantic_core.to_json(embedding.tolist()).decode()
+    as_binary = encode_vector(embedding)
+
+    results = {
+        "encode json": timeit.timeit(lambda: pydantic_core.to_json(embedding.tolist()).decode(), number=iterations),
+        "encode binary": timeit.timeit(lambda: encode_vector(embedding), number=iterations),
+        "decode json": timeit.timeit(lambda: np.asarray(pydantic_core.from_json(as_json), dtype=np.float32), number=iterations),
+        "decode binary": timeit.timeit(lambda: decode_vector(as_binary), number=iterations),
+    }
+    print(f"{dimensions}-d embedding, {iterations} iterations")
+    print(f"payload: json {len(as_json)} bytes, binary {len(as_binary)} bytes")
+    for name, seconds in results.items():
+        print(f"{name:>14}: {seconds / iterations * 1e6:8.2f} us/op")
+
+
+if __name__ == "__main__":
+    benchmark()